@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+### Time each stage of the methylmapper pipeline on synthetic data, for a range
+### of read counts. Results are written in JSON format, so that they can be
+### compared across versions.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+import synthetic
+from Fasta import FastaIterator
+import RefSequence
+import MethMap
+import Cluster
+import Draw
+from Utils import makeColHeaders
+
+class Quiet():
+    """Replaces sys.stderr while stages are running, to discard log messages."""
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+class Bench():
+    counts = [1000, 10000, 100000, 1000000]
+    length = 300
+    density = {"CG": 5, "GC": 3}
+    sites = ["CG"]
+    pattern = "patchy"
+    clusterMax = 5000           # Only cluster up to this number of reads
+    plotMax = 100000            # Only plot up to this number of reads
+    seed = 1
+    outfile = None
+    workdir = None
+    verbose = False
+    site = ""                   # Site being mapped, recorded with each result
+    results = []
+    stderr = None
+
+    def __init__(self):
+        self.results = []
+        self.stderr = sys.stderr
+
+    def log(self, s):
+        self.stderr.write(s)
+        self.stderr.flush()
+
+    def stage(self, nreads, name, func, *args):
+        """Call `func' on `args', recording its wall-clock and CPU time under stage `name'."""
+        if not self.verbose:
+            sys.stderr = Quiet()
+        try:
+            c0 = os.times()
+            t0 = time.time()
+            result = func(*args)
+            wall = time.time() - t0
+            c1 = os.times()
+        finally:
+            sys.stderr = self.stderr
+        cpu = (c1[0] + c1[1]) - (c0[0] + c0[1])
+        self.results.append({"reads": nreads, "site": self.site, "stage": name, "seconds": wall, "cpu": cpu,
+                             "reads_per_second": (nreads / wall) if wall > 0 else None})
+        self.log("{:>9} {:<4} {:<14} {:10.3f}s {:10.3f}s cpu\n".format(nreads, self.site, name, wall, cpu))
+        return result
+
+    def programAvailable(self, prog):
+        if os.path.isfile(prog):
+            return True
+        for d in os.getenv("PATH", "").split(os.pathsep):
+            if os.access(os.path.join(d, prog), os.X_OK):
+                return True
+        return False
+
+    def writeTree(self, gtrfile, n):
+        """Write a trivial tree joining `n' leaves in order, to benchmark output stages without clustering."""
+        with open(gtrfile, "w") as out:
+            prev = "GENE0X"
+            for i in range(1, n):
+                node = "NODE{}X".format(i)
+                out.write("{}\t{}\tGENE{}X\t{:.6f}\n".format(node, prev, i, 1.0 - 1.0 * i / n))
+                prev = node
+
+    def runCount(self, ref, gen, n):
+        fasta = os.path.join(self.workdir, "reads.fa")
+        with open(fasta, "w") as out:
+            synthetic.writeFasta(out, ref, gen, n)
+
+        def parse():
+            with open(fasta, "r") as f:
+                return list(FastaIterator(f))
+        self.site = ""
+        recs = self.stage(n, "parse", parse)
+        refrec = recs[0]
+        seqs = recs[1:]
+        hdrline = "#Seq\t" + "\t".join(makeColHeaders(len(ref))) + "\n"
+        gtrfile = os.path.join(self.workdir, "bench.gtr")
+        self.writeTree(gtrfile, n)
+        rownames = dict([ (s.name, "GENE{}X".format(i)) for (i, s) in enumerate(seqs) ])
+        roworder = [ s.name for s in seqs ]
+        clusterer = Cluster.Clusterer()
+        canCluster = self.programAvailable(clusterer.clusterPath)
+
+        for site in self.sites:
+            self.site = site
+            mref = self.stage(n, "refseq", RefSequence.RefSequence, refrec, site)
+            mmap = MethMap.MethMap(site, mref)
+            mmap.prefix = os.path.join(self.workdir, "")
+            mmap.top = True
+            mmap.bottom = False
+            basemaps = self.stage(n, "mapstring", lambda: [ mref.makeMapString(str(s.seq), top=mmap.top, bottom=mmap.bottom)[0] for s in seqs ])
+            filled = self.stage(n, "fill", lambda: [ mmap.fillMapString(b, mmap.makeBlocks(b)) for b in basemaps ])
+            self.stage(n, "scale", lambda: MethMap.scaleMatrix([ "".join(fmap) for (fmap, vect) in filled ], [ vect for (fmap, vect) in filled ]))
+            basemaps = filled = None
+
+            for seq in seqs:
+                seq.pattern = 0
+            self.stage(n, "makeAllMaps", mmap.makeAllMaps, seqs)
+            self.stage(n, "writeCSV", mmap.writeCSV, "bench.csv", hdrline)
+            if canCluster and n <= self.clusterMax:
+                clusterer.clusterOn = [site]
+                self.stage(n, "cluster", clusterer.run, [mmap])
+            self.stage(n, "writeCDT", mmap.writeCDT, rownames, roworder, gtrfile)
+            if n <= self.plotMax:
+                self.stage(n, "plotMap", Draw.plotMap, os.path.join(self.workdir, "bench.svg"), [mmap])
+
+    def run(self):
+        rng = random.Random(self.seed)
+        ref = synthetic.makeReference(self.length, self.density, rng=rng)
+        gen = synthetic.ReadGenerator(ref, pattern=self.pattern, rng=rng)
+        self.log("Reference: {}bp, {} site Cs; pattern: {}\n".format(len(ref), len(gen.sites), self.pattern))
+        self.workdir = tempfile.mkdtemp(prefix="mmbench")
+        try:
+            for n in self.counts:
+                self.runCount(ref, gen, n)
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        report = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "python": platform.python_version(),
+                  "platform": platform.platform(),
+                  "params": {"length": self.length, "density": self.density, "sites": self.sites,
+                             "pattern": self.pattern, "seed": self.seed},
+                  "results": self.results}
+        if self.outfile:
+            with open(self.outfile, "w") as out:
+                json.dump(report, out, indent=1)
+        else:
+            json.dump(report, sys.stdout, indent=1)
+            sys.stdout.write("\n")
+
+    def parseArgs(self, args):
+        next = ""
+        for a in args:
+            if next == "-n":
+                self.counts = [ int(x) for x in a.split(",") ]
+            elif next == "-l":
+                self.length = int(a)
+            elif next == "-d":
+                self.density = {}
+                for w in a.split(","):
+                    (site, d) = w.split(":")
+                    self.density[site] = float(d)
+            elif next == "-s":
+                self.sites = a.split(",")
+            elif next == "-p":
+                self.pattern = a
+            elif next == "-o":
+                self.outfile = a
+            elif next == "-r":
+                self.seed = int(a)
+            elif next == "--cluster-max":
+                self.clusterMax = int(a)
+            elif next == "--plot-max":
+                self.plotMax = int(a)
+            elif a in ["-n", "-l", "-d", "-s", "-p", "-o", "-r", "--cluster-max", "--plot-max"]:
+                next = a
+                continue
+            elif a == "-v":
+                self.verbose = True
+            else:
+                sys.stdout.write("""bench_stages.py - time methylmapper stages on synthetic data.
+
+Options:
+  -n N1,N2,...        Read counts (default: 1000,10000,100000,1000000)
+  -l N                Reference length (default: 300)
+  -d SITE:D,...       Sites per 100bp in reference (default: CG:5,GC:3)
+  -s SITE,...         Sites to map (default: CG)
+  -p PATTERN          Methylation pattern: random, patchy, alleles (default: patchy)
+  -r N                Random seed (default: 1)
+  -o FILE             Write JSON results to FILE (default: standard output)
+  --cluster-max N     Only run clustering (requires cluster3) up to N reads (default: 5000)
+  --plot-max N        Only run plotMap up to N reads (default: 100000)
+  -v                  Do not hide methylmapper log messages
+""")
+                return False
+            next = ""
+        return True
+
+if __name__ == "__main__":
+    B = Bench()
+    if B.parseArgs(sys.argv[1:]):
+        B.run()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+### Measure the startup time of the methylmapper command: the time to print the
+### help message, and the time to process a very small amplicon with and without
+### a plot. In the first two cases cluster3 is replaced by `true', so that only
+### methylmapper's own time is measured; the last one requires cluster3 in PATH.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MM = os.path.join(HERE, "..", "src", "methylmapper.py")
+
+import synthetic
+
+CASES = [("help", ["-h"]),
+         ("map", ["-i", "reads.fa", "--csv", "out.csv", "--cluster-path", "true"]),
+         ("map+plot", ["-i", "reads.fa", "--csv", "out.csv", "--plot", "out.svg"])]
+
+def inPath(prog):
+    for d in os.getenv("PATH", "").split(os.pathsep):
+        if os.access(os.path.join(d, prog), os.X_OK):
+            return True
+    return False
+
+def timeCommand(args, workdir, repeat):
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            t0 = time.time()
+            subprocess.call([sys.executable, MM] + args, cwd=workdir, stdout=devnull, stderr=devnull)
+            times.append(time.time() - t0)
+    times.sort()
+    return {"min": times[0], "median": times[len(times) // 2], "max": times[-1]}
+
+def importTimes(ntop):
+    """Return the `ntop' modules with the largest cumulative import time (in seconds) for methylmapper -h."""
+    proc = subprocess.Popen([sys.executable, "-X", "importtime", MM, "-h"], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    (out, err) = proc.communicate()
+    result = []
+    for line in err.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            fields = line[12:].split("|")
+            try:
+                result.append((fields[2].strip(), int(fields[1]) / 1000000.0))
+            except ValueError:
+                pass
+    result.sort(key=lambda r: r[1], reverse=True)
+    return result[:ntop]
+
+def usage():
+    sys.stdout.write("""bench_startup.py - measure methylmapper startup time.
+
+Options:
+  -n N          Number of repetitions of each command (default: 10)
+  -r N          Number of reads in the small amplicon (default: 20)
+  -o FILE       Write JSON results to FILE (default: standard output)
+  --imports N   Also report the N slowest imports (requires Python 3.7+)
+""")
+
+if __name__ == "__main__":
+    repeat = 10
+    nreads = 20
+    outfile = None
+    nimports = 0
+    next = ""
+    for a in sys.argv[1:]:
+        if next == "-n":
+            repeat = int(a)
+        elif next == "-r":
+            nreads = int(a)
+        elif next == "-o":
+            outfile = a
+        elif next == "--imports":
+            nimports = int(a)
+        elif a in ["-n", "-r", "-o", "--imports"]:
+            next = a
+            continue
+        else:
+            usage()
+            sys.exit(0)
+        next = ""
+
+    workdir = tempfile.mkdtemp(prefix="mmstartup")
+    try:
+        rng = random.Random(1)
+        ref = synthetic.makeReference(300, {"CG": 5}, rng=rng)
+        with open(os.path.join(workdir, "reads.fa"), "w") as out:
+            synthetic.writeFasta(out, ref, synthetic.ReadGenerator(ref, rng=rng), nreads)
+        results = []
+        for (name, args) in CASES:
+            if "--plot" in args and not inPath("cluster3"):
+                sys.stderr.write("cluster3 not found in PATH, skipping {}.\n".format(name))
+                continue
+            t = timeCommand(args, workdir, repeat)
+            t["case"] = name
+            results.append(t)
+            sys.stderr.write("{:<10} min {:.3f}s  median {:.3f}s  max {:.3f}s\n".format(name, t["min"], t["median"], t["max"]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"python": platform.python_version(), "repeat": repeat, "reads": nreads, "results": results}
+    if nimports:
+        imports = importTimes(nimports)
+        report["imports"] = [ {"module": m, "seconds": s} for (m, s) in imports ]
+        for (m, s) in imports:
+            sys.stderr.write("  {:<30} {:.3f}s\n".format(m, s))
+    if outfile:
+        with open(outfile, "w") as out:
+            json.dump(report, out, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+### Synthetic bisulfite data for methylmapper benchmarks: a reference sequence
+### with a controlled number of CG, GC and GCH sites, and top-strand reads in which
+### unmethylated Cs are converted to Ts.
+
+import sys
+import random
+
+def makeReference(length, density, rng=random):
+    """Return a reference sequence of `length' bases. `density' is a dictionary mapping
+site types (CG, GC, GCH) to the number of sites per 100bp to insert. The background
+sequence contains no CG or GC dinucleotides, so these are the only sites present
+(apart from the ones accidentally created at the boundaries of inserted sites)."""
+    seq = [ rng.choice("ACGT") for _ in range(length) ]
+    for i in range(1, length):
+        if seq[i-1] == "C" and seq[i] == "G":
+            seq[i] = "A"
+        elif seq[i-1] == "G" and seq[i] == "C":
+            seq[i] = "T"
+    for (site, d) in density.items():
+        n = int(round(d * length / 100.0))
+        for _ in range(n):
+            p = rng.randrange(1, length - 3)
+            if site == "GCH":
+                word = "GC" + rng.choice("ACT")
+            else:
+                word = site
+            seq[p:p+len(word)] = list(word)
+    return "".join(seq)
+
+def sitePositions(ref):
+    """Return the positions of all Cs in CG or GC dinucleotides in `ref'."""
+    pos = set()
+    for i in range(len(ref) - 1):
+        if ref[i] == "C" and ref[i+1] == "G":
+            pos.add(i)
+        if ref[i] == "G" and ref[i+1] == "C":
+            pos.add(i+1)
+    return sorted(pos)
+
+class ReadGenerator():
+    """Generate reads from `ref'. Patterns:
+  random  - each site is methylated independently with probability `pmeth';
+  patchy  - alternating methylated/unmethylated stretches with an average of `patch' sites;
+  alleles - each read is a copy of one of `nalleles' random patterns (redundant libraries)."""
+    ref = ""
+    sites = []
+    pattern = "patchy"
+    pmeth = 0.5
+    patch = 5
+    nalleles = 20
+    conversion = 0.99           # Conversion rate of non-site Cs
+    nrate = 0.0                 # Fraction of positions replaced by N
+    alleles = []
+
+    def __init__(self, ref, pattern="patchy", pmeth=0.5, patch=5, nalleles=20, conversion=0.99, nrate=0.0, rng=random):
+        self.ref = ref
+        self.sites = sitePositions(ref)
+        self.pattern = pattern
+        self.pmeth = pmeth
+        self.patch = patch
+        self.nalleles = nalleles
+        self.conversion = conversion
+        self.nrate = nrate
+        self.rng = rng
+        self.alleles = []
+        if pattern == "alleles":
+            self.alleles = [ self.patchyCalls() for _ in range(nalleles) ]
+
+    def randomCalls(self):
+        return [ self.rng.random() < self.pmeth for _ in self.sites ]
+
+    def patchyCalls(self):
+        calls = []
+        state = self.rng.random() < self.pmeth
+        for _ in self.sites:
+            if self.rng.random() < 1.0 / self.patch:
+                state = not state
+            calls.append(state)
+        return calls
+
+    def makeRead(self):
+        if self.pattern == "random":
+            calls = self.randomCalls()
+        elif self.pattern == "alleles":
+            calls = self.rng.choice(self.alleles)
+        else:
+            calls = self.patchyCalls()
+        read = list(self.ref)
+        for i in range(len(read)):
+            if read[i] == "C" and self.rng.random() < self.conversion:
+                read[i] = "T"
+        for (p, m) in zip(self.sites, calls):
+            read[p] = "C" if m else "T"
+        if self.nrate:
+            for i in range(len(read)):
+                if self.rng.random() < self.nrate:
+                    read[i] = "N"
+        return "".join(read)
+
+def writeFasta(out, ref, gen, nreads):
+    """Write the reference followed by `nreads' reads from generator `gen' to stream `out'."""
+    out.write(">Reference\n" + ref + "\n")
+    for i in range(nreads):
+        out.write(">read{}\n{}\n".format(i + 1, gen.makeRead()))
+
+def usage():
+    sys.stdout.write("""synthetic.py - generate synthetic bisulfite reads for methylmapper.
+
+Usage: synthetic.py [options] nreads > file.fa
+
+Options:
+  -l N          Reference length (default: 300)
+  -s SITE:D     Insert D sites of type SITE (CG, GC, GCH) per 100bp (default: CG:5)
+  -p PATTERN    Methylation pattern: random, patchy, alleles (default: patchy)
+  -m F          Probability of methylation (default: 0.5)
+  -c F          Conversion rate of non-site Cs (default: 0.99)
+  -n F          Fraction of Ns in reads (default: 0)
+  -r N          Random seed
+""")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or "-h" in args:
+        usage()
+        sys.exit(0)
+    length = 300
+    density = {}
+    pattern = "patchy"
+    pmeth = 0.5
+    conversion = 0.99
+    nrate = 0.0
+    nreads = 0
+    next = ""
+    for a in args:
+        if next == "-l":
+            length = int(a)
+        elif next == "-s":
+            (site, d) = a.split(":")
+            density[site] = float(d)
+        elif next == "-p":
+            pattern = a
+        elif next == "-m":
+            pmeth = float(a)
+        elif next == "-c":
+            conversion = float(a)
+        elif next == "-n":
+            nrate = float(a)
+        elif next == "-r":
+            random.seed(int(a))
+        elif a in ["-l", "-s", "-p", "-m", "-c", "-n", "-r"]:
+            next = a
+            continue
+        else:
+            nreads = int(a)
+        next = ""
+    ref = makeReference(length, density or {"CG": 5})
+    gen = ReadGenerator(ref, pattern=pattern, pmeth=pmeth, conversion=conversion, nrate=nrate)
+    writeFasta(sys.stdout, ref, gen, nreads)
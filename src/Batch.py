@@ -0,0 +1,135 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import sys
+import time
+import multiprocessing
+
+from Utils import INPUT, OUTPUT, WARNING
+
+### Batch mode: run methylmapper on all the amplicons listed in a manifest file,
+### in a single process (or a pool of worker processes).
+
+SESSION = None                  # RenderSession used by all jobs running in this process
+
+class BatchJob():
+    reference = ""
+    reads = ""
+    prefix = ""
+    options = []
+
+    # Results
+    nreads = 0                  # Number of input sequences
+    nretained = 0               # Number of sequences retained after filtering
+    elapsed = 0.0
+    status = "ok"
+
+    def __init__(self, reference, reads, prefix, options):
+        self.reference = reference
+        self.reads = reads
+        self.prefix = prefix
+        self.options = options
+
+class Batch():
+    manifest = None
+    jobs = []
+    nprocs = 1
+    baseArgs = []               # Command-line options applied to all jobs
+    summary = None              # File to write summary table to (default: stdout)
+
+    def __init__(self, manifest, baseArgs, nprocs=1, summary=None):
+        self.manifest = manifest
+        self.baseArgs = baseArgs
+        self.nprocs = nprocs
+        self.summary = summary
+        self.jobs = []
+
+    def readManifest(self):
+        """Each line of the manifest contains (tab-delimited): reference FASTA file, reads
+FASTA file, output prefix, and optionally additional command-line options for this amplicon."""
+        with open(self.manifest, "r") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                fields = line.rstrip("\r\n").split("\t")
+                if len(fields) < 3:
+                    sys.stderr.write(WARNING + "Manifest line should have at least three fields: {}".format(line))
+                    continue
+                options = fields[3].split() if len(fields) > 3 else []
+                self.jobs.append(BatchJob(fields[0], fields[1], fields[2], options))
+        sys.stderr.write(INPUT + "{} jobs read from manifest `{}'.\n".format(len(self.jobs), self.manifest))
+
+    def run(self):
+        start = time.time()
+        self.readManifest()
+        args = [ (job, self.baseArgs) for job in self.jobs ]
+        if self.nprocs > 1:
+            pool = multiprocessing.Pool(self.nprocs)
+            try:
+                self.jobs = pool.map(runJob, args, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            self.jobs = [ runJob(a) for a in args ]
+            closeSession()
+        elapsed = time.time() - start
+        nbad = len([ job for job in self.jobs if job.status != "ok" ])
+        sys.stderr.write(OUTPUT + "{} jobs completed in {:.2f}s, {} failed.\n".format(len(self.jobs), elapsed, nbad))
+        if self.summary:
+            sys.stderr.write(OUTPUT + "Writing batch summary to {}.\n".format(self.summary))
+            with open(self.summary, "w") as out:
+                self.writeSummary(out)
+        else:
+            self.writeSummary(sys.stdout)
+        return nbad == 0
+
+    def writeSummary(self, out):
+        out.write("Prefix\tReference\tReads\tSequences\tRetained\tSeconds\tStatus\n")
+        for job in self.jobs:
+            out.write("{}\t{}\t{}\t{}\t{}\t{:.3f}\t{}\n".format(job.prefix, job.reference, job.reads, job.nreads,
+                                                                 job.nretained, job.elapsed, job.status))
+
+def closeSession():
+    """Close the RenderSession of this process, if one was created."""
+    global SESSION
+    if SESSION:
+        SESSION.close()
+        SESSION = None
+
+def runJob(arg):
+    """Run a single BatchJob with a fresh MethylMapper object. Returns the job with its results filled in."""
+    global SESSION
+    from methylmapper import MethylMapper
+
+    (job, baseArgs) = arg
+    start = time.time()
+    try:
+        M = MethylMapper()
+        args = baseArgs + ["-r", job.reference, "-i", job.reads, "--prefix", job.prefix] + job.options
+        if M.parseArgs(args):
+            if M.plotfile and SESSION is None:
+                import Draw
+                from multiprocessing.util import Finalize
+                SESSION = Draw.RenderSession()
+                Finalize(None, closeSession, exitpriority=10)   # Also run when a pool worker exits
+            M.session = SESSION
+            if M.demux:
+                engines = M.demultiplex()
+                job.nreads = sum([ E.ninput for E in engines ])
+                job.nretained = sum([ len(E.sequences) for E in engines ])
+            else:
+                M.initialize()
+                M.main()
+                job.nreads = M.ninput
+                job.nretained = len(M.sequences)
+        else:
+            job.status = "bad options"
+    except SystemExit:
+        job.status = "failed"
+    except Exception as e:
+        job.status = "error: {}".format(e)
+    job.elapsed = time.time() - start
+    if job.status != "ok":
+        sys.stderr.write(WARNING + "Job {} {}.\n".format(job.prefix, job.status))
+    return job
@@ -0,0 +1,95 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import numpy as np
+
+import CDTsort
+import Linkage
+import LeafOrder
+import Ordering
+
+### Cluster stability (--bootstrap). Each replicate resamples the columns of the
+### clustering matrix (or the reads, with --bootstrap-reads) with replacement,
+### clusters the resampled matrix in the same way as the original one, and cuts
+### the tree into the same number of groups (or at the same height). The stability
+### of each original cluster C in a replicate is the largest Jaccard similarity
+### |C & D| / |C | D| between C (restricted to the sampled reads) and a cluster D of
+### the replicate; a cluster is recovered in a replicate if this is above 0.5.
+### Replicates are independent, and are run in a pool of worker processes.
+
+REPDATA = None                  # Data shared with the worker processes of bootstrap()
+
+def setReplicateData(data):
+    global REPDATA
+    REPDATA = data
+
+def treeLabels(data, dist, method, k, simil=None):
+    """Cluster the rows of `data' with Linkage and cut the tree as GTree.cut(k, simil) does.
+Returns the cluster of each row."""
+    n = data.shape[0]
+    labels = np.zeros(n, dtype=int)
+    if n < 2:
+        return labels
+    branches = Linkage.toBranches(Linkage.nnChain(LeafOrder.distanceMatrix(data, dist), method), n, dist)
+    for (i, leaves) in enumerate(CDTsort.GTree(branches=branches).cut(k, simil=simil)):
+        labels[[ int(g[4:-1]) for g in leaves ]] = i
+    return labels
+
+def jaccard(orig, new, k):
+    """Return the stability of each of the `k' clusters in `orig' with respect to the
+clustering `new' of the same rows (NaN for clusters with no rows)."""
+    knew = int(new.max()) + 1 if len(new) else 1
+    inter = np.bincount(orig * knew + new, minlength=k * knew).reshape(k, knew).astype(float)
+    osize = inter.sum(axis=1)
+    union = osize[:, None] + inter.sum(axis=0)[None, :] - inter
+    result = np.full(k, np.nan)
+    present = osize > 0
+    result[present] = (inter[present] / union[present]).max(axis=1)
+    return result
+
+def replicate(seed):
+    """Run the bootstrap replicate with random seed `seed', returning the stability of each cluster."""
+    (data, labels, params) = REPDATA
+    rng = np.random.RandomState(seed)
+    (n, ncols) = data.shape
+    if params["reads"]:
+        rows = np.unique(rng.randint(0, n, n))
+        sample = data[rows]
+        orig = labels[rows]
+    else:
+        sample = data[:, rng.randint(0, ncols, ncols)] if ncols else data
+        orig = labels
+    if params["kmodes"]:
+        new = Ordering.kModes(sample, params["k"])
+    else:
+        new = treeLabels(sample, params["dist"], params["method"], params["k"], simil=params["simil"])
+    return jaccard(orig, new, params["k"])
+
+def bootstrap(data, labels, nreps, kmodes=False, dist="7", method="m", simil=None, reads=False, nprocs=1, seed=1):
+    """Compute the stability of the clusters in `labels' (numbered from 0) of the rows of `data'
+over `nreps' bootstrap replicates, using `nprocs' processes. If `kmodes' is True, `data' contains
+site calls and replicates are clustered with Ordering.kModes, otherwise they are clustered with
+distance `dist' and method `method' and the tree is cut into the same number of clusters, or at
+similarity `simil'. Returns an array with one row per replicate and one column per cluster."""
+    import multiprocessing
+
+    k = int(labels.max()) + 1 if len(labels) else 0
+    params = {"reads": reads, "kmodes": kmodes, "k": k, "dist": dist, "method": method, "simil": simil}
+    shared = (data, labels, params)
+    seeds = [ seed + i for i in range(nreps) ]
+    if nprocs > 1 and multiprocessing.current_process().daemon:
+        nprocs = 1              # Daemonic processes (e.g. batch mode workers) cannot have children
+    if nprocs > 1 and nreps > 1:
+        pool = multiprocessing.Pool(min(nprocs, nreps), initializer=setReplicateData, initargs=(shared,))
+        try:
+            result = pool.map(replicate, seeds, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        setReplicateData(shared)
+        try:
+            result = [ replicate(s) for s in seeds ]
+        finally:
+            setReplicateData(None)
+    return np.array(result, dtype=float).reshape(nreps, k)
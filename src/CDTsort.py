@@ -4,7 +4,6 @@
 ## DiBiG, ICBR Bioinformatics, University of Florida
 
 import sys
-import csv
 import numpy as np
 
 class Node():
@@ -12,135 +11,190 @@ class Node():
     left = ""
     right = ""
     simil = ""
-    values = []
-    mean = 0.0
+    total = 0.0                 # Sum of the values of all leaves under this node
+    count = 0                   # Number of leaves under this node
 
     def __init__(self, n, l, r, s):
         self.name = n
         self.left = l
         self.right = r
         self.simil = s
-        self.values = []
-        self.mean = 0.0
+        self.total = 0.0
+        self.count = 0
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
 
 class GTree():
+    """A tree read from a GTR file (or from a list of [node, left, right, similarity]
+branches). All traversals are iterative, so arbitrarily deep trees can be handled."""
     nodes = {}
     root = ""
 
-    def __init__(self, gtrfile):
+    def __init__(self, gtrfile=None, branches=None):
         self.nodes = {}
         node = None
+        if gtrfile:
+            branches = self.readBranches(gtrfile)
+        for br in branches:
+            node = Node(br[0], br[1], br[2], br[3])
+            self.nodes[br[0]] = node
+        self.root = node.name if node else ""
+
+    def readBranches(self, gtrfile):
         with open(gtrfile, "r") as f:
-            c = csv.reader(f, delimiter='\t')
-            for line in c:
-                node = Node(line[0], line[1], line[2], line[3])
-                self.nodes[line[0]] = node
-        self.root = node.name
-        sys.stderr.write("{} nodes read, root={}\n".format(len(self.nodes), self.root))
-
-    def fillTree(self, CDT):
-        self.fillTreeAux(self.nodes[self.root], CDT)
-
-    def fillTreeAux(self, node, CDT):
-        l = node.left
-        r = node.right
-        if l.startswith("GENE"):
-            leftavg = CDT.data[l]
-            node.values.append(leftavg)
-        else:
-            leftnode = self.nodes[l]
-            self.fillTreeAux(leftnode, CDT)
-            for x in leftnode.values:
-                node.values.append(x)
-        if r.startswith("GENE"):
-            rightavg = CDT.data[r]
-            node.values.append(rightavg)
-        else:
-            rightnode = self.nodes[r]
-            self.fillTreeAux(rightnode, CDT)
-            for x in rightnode.values:
-                node.values.append(x)
-        node.mean = np.mean(node.values)
-
-    def sortTree(self, CDT):
-        self.sortTreeAux(self.nodes[self.root], CDT)
-        self.writeTree()
-
-    def sortTreeAux(self, node, CDT):
-        l = node.left
-        r = node.right
-
-        if l.startswith("NODE"):
-            leftnode = self.nodes[l]
-            self.sortTreeAux(leftnode, CDT)
-            leftavg = leftnode.mean
-        else:
-            leftavg = CDT.data[l]
-
-        if r.startswith("NODE"):
-            rightnode = self.nodes[r]
-            self.sortTreeAux(rightnode, CDT)
-            rightavg = rightnode.mean
-        else:
-            rightavg = CDT.data[r]
-
-        if leftavg > rightavg:
-            tmp = node.left
-            node.left = node.right
-            node.right = tmp
-
-    def writeTree(self):
-        self.writeTreeAux(self.nodes[self.root])
-        
-    def writeTreeAux(self, node):
-        l = node.left
-        r = node.right
-
-        if l.startswith("NODE"):
-            self.writeTreeAux(self.nodes[l])
-        if r.startswith("NODE"):
-            self.writeTreeAux(self.nodes[r])
-        sys.stdout.write("{}\t{}\t{}\t{}\n".format(node.name, l, r, node.simil))
-
-    def dumpTree(self, CDT):
-        self.dumpTreeAux(self.nodes[self.root], CDT, 0)
-
-    def dumpTreeAux(self, node, CDT, indent):
-        l = node.left
-        r = node.right
-        if l.startswith("GENE"):
-            sys.stdout.write(" "*indent + l + " avg={}\n".format(CDT.data[l]))
-        else:
-            leftnode = self.nodes[l]
-            self.dumpTreeAux(leftnode, CDT, indent+1)
-        if r.startswith("GENE"):
-            sys.stdout.write(" "*indent + r + " avg={}\n".format(CDT.data[r]))
-        else:
-            rightnode = self.nodes[r]
-            self.dumpTreeAux(rightnode, CDT, indent+1)
-        sys.stdout.write(" "*indent + "{} avg={} values={}\n".format(node.name, node.mean, node.values))
-        
+            for line in f:
+                yield line.rstrip("\r\n").split("\t")[:4]
+
+    def postorder(self):
+        """Iterate over internal nodes, children before their parents."""
+        if self.root not in self.nodes:
+            return                  # Empty tree, or a single leaf
+        stack = [(self.nodes[self.root], False)]
+        while stack:
+            (node, visited) = stack.pop()
+            if visited:
+                yield node
+            else:
+                stack.append((node, True))
+                # Pushed in reverse, so that the left child is visited first
+                for c in [node.right, node.left]:
+                    if c in self.nodes:
+                        stack.append((self.nodes[c], False))
+
+    def fillTree(self, data):
+        """Compute the mean of the leaf values under each node. `data' maps leaf names to values."""
+        for node in self.postorder():
+            node.total = 0.0
+            node.count = 0
+            for c in [node.left, node.right]:
+                if c in self.nodes:
+                    node.total += self.nodes[c].total
+                    node.count += self.nodes[c].count
+                else:
+                    node.total += data[c]
+                    node.count += 1
+
+    def sortTree(self, data):
+        """Swap the children of each node so that the one with the lower mean comes first."""
+        for node in self.postorder():
+            leftavg = self.nodes[node.left].mean() if node.left in self.nodes else data[node.left]
+            rightavg = self.nodes[node.right].mean() if node.right in self.nodes else data[node.right]
+            if leftavg > rightavg:
+                (node.left, node.right) = (node.right, node.left)
+
+    def orient(self, leaves):
+        """Swap the children of each node so that the leaves of the tree appear in the order
+given by `leaves' (which must be an ordering compatible with the tree)."""
+        pos = dict([ (l, i) for (i, l) in enumerate(leaves) ])
+        first = {}
+        for node in self.postorder():
+            l = first[node.left] if node.left in self.nodes else pos[node.left]
+            r = first[node.right] if node.right in self.nodes else pos[node.right]
+            if l > r:
+                (node.left, node.right) = (node.right, node.left)
+            first[node.name] = min(l, r)
+
+    def branches(self):
+        """Return the branches of the tree in post-order."""
+        return [ [node.name, node.left, node.right, node.simil] for node in self.postorder() ]
+
+    def leaves(self, root=None):
+        """Return the leaves of the tree (or of the subtree starting at `root') in left-to-right order."""
+        result = []
+        root = root or self.root
+        if not root:
+            return result
+        stack = [root]
+        while stack:
+            n = stack.pop()
+            if n in self.nodes:
+                stack.append(self.nodes[n].right)
+                stack.append(self.nodes[n].left)
+            else:
+                result.append(n)
+        return result
+
+    def cut(self, k, simil=None):
+        """Cut the tree into `k' clusters (or as many as there are leaves), by repeatedly
+splitting the cluster whose root has the lowest similarity. If `simil' is specified, cut
+the tree instead into the largest subtrees whose roots have a similarity of at least `simil'.
+Returns a list of clusters, each one a list of leaves, in left-to-right order."""
+        if not self.root:
+            return []
+        if simil is not None:
+            roots = []
+            stack = [self.root]
+            while stack:
+                r = stack.pop()
+                if r in self.nodes and float(self.nodes[r].simil) < simil:
+                    stack.append(self.nodes[r].right)
+                    stack.append(self.nodes[r].left)
+                else:
+                    roots.append(r)
+            return [ self.leaves(r) for r in roots ]
+        roots = [self.root]
+        while len(roots) < k:
+            internal = [ r for r in roots if r in self.nodes ]
+            if not internal:
+                break
+            split = min(internal, key=lambda r: float(self.nodes[r].simil))
+            i = roots.index(split)
+            roots[i:i+1] = [self.nodes[split].left, self.nodes[split].right]
+        return [ self.leaves(r) for r in roots ]
+
+    def writeTree(self, out=sys.stdout):
+        for br in self.branches():
+            out.write("\t".join(br) + "\n")
+
+    def dumpTree(self, data, out=sys.stdout):
+        depth = {self.root: 0}
+        stack = [self.root]
+        while stack:
+            n = stack.pop()
+            indent = " " * depth[n]
+            if n in self.nodes:
+                node = self.nodes[n]
+                out.write(indent + "{} avg={} leaves={}\n".format(node.name, node.mean(), node.count))
+                for c in [node.right, node.left]:
+                    depth[c] = depth[n] + 1
+                    stack.append(c)
+            else:
+                out.write(indent + n + " avg={}\n".format(data[n]))
 
 class CDTFile():
     data = {}
 
     def __init__(self, cdtfile):
-        self.data = {}
         with open(cdtfile, "r") as f:
-            c = csv.reader(f, delimiter='\t')
-            c.next()
-            c.next()            # Skip two header lines
-            for line in c:
-                gene = line[0]
-                avg = np.mean([float(x) for x in line[4:]])
-                self.data[gene] = avg
+            f.readline()
+            f.readline()            # Skip two header lines
+            rows = [ line.rstrip("\r\n").split("\t") for line in f ]
+        genes = [ r[0] for r in rows ]
+        if rows:
+            values = np.array([ r[4:] for r in rows ])
+            values[values == "."] = "nan"
+            avgs = np.nanmean(values.astype(float), axis=1)
+        else:
+            avgs = []
+        self.data = dict(zip(genes, avgs))
         sys.stderr.write("Averages read for {} genes.\n".format(len(self.data)))
 
+def sortTree(branches, data):
+    """Reorder the tree described by `branches' so that at each node the child with the
+lower mean value comes first. `data' maps leaf names to their values. Returns a tuple
+containing the reordered branches (in post-order) and the list of leaves in the new order."""
+    G = GTree(branches=branches)
+    G.fillTree(data)
+    G.sortTree(data)
+    return (G.branches(), G.leaves())
+
 if __name__ == "__main__":
-#    sys.setrecursionlimit(5000) # Use this if running out of stack
     G = GTree(sys.argv[1])
+    sys.stderr.write("{} nodes read, root={}\n".format(len(G.nodes), G.root))
     C = CDTFile(sys.argv[2])
-    G.fillTree(C)
+    G.fillTree(C.data)
     sys.stderr.write("Tree filled.\n")
-    #G.dumpTree(C)
-    G.sortTree(C)
+    #G.dumpTree(C.data)
+    G.sortTree(C.data)
+    G.writeTree()
@@ -5,23 +5,63 @@
 
 import os
 import sys
+import time
+import errno
+import shutil
 import os.path
 import tempfile
 import subprocess
 
-import Draw
 from Utils import saferm, makeColHeaders, INPUT, OUTPUT, WARNING, CLUSTER
 
+def openFifo(path, proc):
+    """Open the named pipe `path' for writing, waiting until process `proc' opens it for
+reading. Returns None if `proc' terminates without opening it."""
+    import fcntl
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if proc.poll() is not None:
+                return None
+            time.sleep(0.01)
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+    return os.fdopen(fd, "w")
+
 class Clusterer():
     clusterOn      = []
     clusterWeights = []
     clusterFrom    = 0             # Start position of region used for clustering
     clusterTo      = None          # End position of region used for clustering
+    offset         = 0             # Position of the first map column in the reference (--region), for messages
     clusterDist    = "7"
     clusterMeth    = "m"
     clusterPath    = os.getenv("CLUSTER3_PATH") or "cluster3"    # Path to the cluster3 executable
+    leafOrder      = None          # "mean" (as CDTsort does) or "optimal" to reorder the leaves of the tree
+    maxOptimal     = 2000          # Largest number of reads for optimal leaf ordering (time is cubic in the number of reads)
+    tmpdir         = None          # Directory for temporary files (--tmpdir), default: system temporary directory
+    useFifo        = False         # If True, send the clustering matrix to cluster3 through a named pipe (--cluster-fifo)
+    engine         = "cluster3"    # "cluster3", or "internal" to cluster using Linkage (--cluster-engine)
+    nprocs         = 1             # Number of processes computing distances with the internal engine (--cluster-procs)
+    ordering       = None          # If set, order reads with this fast ordering instead of clustering them (--order)
+    nmodes         = 8             # Number of clusters for the kmodes ordering
+    ngroups        = 0             # If > 0, cut the tree into this number of groups
+    cutHeight      = None          # If set, cut the tree at this height (1 - similarity) instead (--cut-height)
+    groups         = None          # Read name => group number (1..ngroups, in display order), set by run()
+    nboot          = 0             # Number of bootstrap replicates used to assess cluster stability (--bootstrap)
+    bootReads      = False         # If True, bootstrap replicates resample reads instead of columns (--bootstrap-reads)
+    branches       = None          # Branches of the final tree, set by run()
+    rownames       = None          # Read name => GTR id in `branches', set by run()
+
+    def __init__(self):
+        self.clusterOn      = []
+        self.clusterWeights = []
     
-    def run(self, maps, plotfile=None):
+    def getWantedMaps(self, maps):
+        """Return the maps to cluster on, or None if the clustering region is empty."""
         self.setWeights()
         wantedMaps = []
         for site in self.clusterOn:
@@ -30,38 +70,72 @@ class Clusterer():
                     wantedMaps.append(m)
                     break
         # print [m.site for m in wantedMaps]
-        m0 = wantedMaps[0]
         if not self.clusterTo:
-            self.clusterTo = m0.ref.length
+            self.clusterTo = wantedMaps[0].ref.length
         ncols = self.clusterTo - self.clusterFrom
         if ncols < 0:
-            sys.stderr.write(WARNING + "Clustering region [{}, {}] is empty!\n".format(self.clusterFrom + 1, self.clusterTo))
+            sys.stderr.write(WARNING + "Clustering region [{}, {}] is empty!\n".format(self.clusterFrom + self.offset + 1, self.clusterTo + self.offset))
+            return None
+        return wantedMaps
+
+    def clusterRow(self, wantedMaps, name):
+        """Return the row of the clustering matrix for read `name'."""
+        row = []
+        for (m, w) in zip(wantedMaps, self.clusterWeights):
+            #vect = m.mapvectors[name]     # *** THIS SHOULD BE DECIDED BY THE scale FLAG!
+            vect = m.sclvectors[name]
+            row.extend((vect[self.clusterFrom:self.clusterTo] * w).tolist())
+        return row
+
+    def run(self, maps, plotfile=None, maxheight=None, session=None):
+        wantedMaps = self.getWantedMaps(maps)
+        if not wantedMaps:
             return False
-        sys.stderr.write(CLUSTER + "Clustering on {}; region=[{}, {}]\n".format(",".join([m.site for m in wantedMaps]), self.clusterFrom + 1, self.clusterTo))
+        m0 = wantedMaps[0]
+        ncols = self.clusterTo - self.clusterFrom
+        sys.stderr.write(CLUSTER + "Clustering on {}; region=[{}, {}]\n".format(",".join([m.site for m in wantedMaps]), self.clusterFrom + self.offset + 1, self.clusterTo + self.offset))
         wlist = [ "{}={}".format(x, y) for x,y in zip(self.clusterOn, self.clusterWeights) ]
         sys.stderr.write(CLUSTER + "Clustering weights: {}\n".format(", ".join(wlist)))
-        totcols = len(wantedMaps) * ncols
-        hdr = makeColHeaders(totcols)
-        tmpfile = tempfile.mkstemp(dir=".")[1]
-        saferm(tmpfile)
-        csvfile = tmpfile + ".csv"
-        cdtfile = tmpfile + ".cdt"
-        gtrfile = tmpfile + ".gtr"
+        means = {}              # Mean of each row of the clustering matrix
+        rows = []               # (name, row) pairs of the clustering matrix (only for optimal leaf ordering)
+        if self.leafOrder == "optimal" and len(m0.mapstrings) > self.maxOptimal:
+            sys.stderr.write(WARNING + "Too many sequences for optimal leaf ordering (max {}), sorting by mean instead.\n".format(self.maxOptimal))
+            self.leafOrder = "mean"
+        if self.engine == "internal" and self.clusterMeth not in ["s", "m", "a"]:
+            sys.stderr.write(WARNING + "Clustering method {} not supported by the internal engine, using cluster3.\n".format(self.clusterMeth))
+            self.engine = "cluster3"
+        if self.engine == "internal" and self.clusterDist not in ["1", "2", "7", "8"]:
+            sys.stderr.write(WARNING + "Distance {} not supported by the internal engine, using cluster3.\n".format(self.clusterDist))
+            self.engine = "cluster3"
+        workdir = tempfile.mkdtemp(prefix="mmcluster", dir=self.tmpdir)
+        csvfile = os.path.join(workdir, "matrix.csv")
+        cdtfile = os.path.join(workdir, "matrix.cdt")
+        gtrfile = os.path.join(workdir, "matrix.gtr")
         try:
-            with open(csvfile, "w") as out:
-                out.write("#Sequence\t" + "\t".join(hdr) + "\n")
-                for (name, fmap) in m0.mapstrings:
-                    out.write(name)
-                    for (m, w) in zip(wantedMaps, self.clusterWeights):
-                        #vect = m.mapvectors[name]     # *** THIS SHOULD BE DECIDED BY THE scale FLAG!
-                        vect = m.sclvectors[name]
-                        for i in range(self.clusterFrom, self.clusterTo):
-                            out.write("\t" + str(vect[i] * w))
-                    out.write("\n")
-
+            if self.engine == "internal":
+                (rownames, roworder) = self.clusterInternal(wantedMaps, workdir, gtrfile, means, rows)
+                if self.leafOrder in ["mean", "optimal"]:
+                    roworder = self.orderLeaves(gtrfile, rownames, means, rows)
+                self.writeOutputs(maps, rownames, roworder, gtrfile, plotfile, maxheight, session)
+                return True
             cmd = [self.clusterPath, "-f", csvfile, "-g", self.clusterDist, "-m", self.clusterMeth]
-            sys.stderr.write(CLUSTER + "Executing: " + " ".join(cmd) + "\n")
-            retcode = subprocess.call(cmd)
+            if self.useFifo and hasattr(os, "mkfifo"):
+                os.mkfifo(csvfile)
+                sys.stderr.write(CLUSTER + "Executing: " + " ".join(cmd) + "\n")
+                proc = subprocess.Popen(cmd)
+                out = openFifo(csvfile, proc)
+                if out:
+                    try:
+                        with out:
+                            self.writeMatrix(out, wantedMaps, ncols, means, rows)
+                    except (IOError, OSError) as e:
+                        sys.stderr.write(WARNING + "Error sending clustering matrix to cluster3: {}\n".format(e))
+                retcode = proc.wait()
+            else:
+                with open(csvfile, "w") as out:
+                    self.writeMatrix(out, wantedMaps, ncols, means, rows)
+                sys.stderr.write(CLUSTER + "Executing: " + " ".join(cmd) + "\n")
+                retcode = subprocess.call(cmd)
             if retcode != 0:
                 sys.stderr.write(WARNING + "cluster3 command returned exit code {}!\n".format(retcode))
                 return False
@@ -81,21 +155,248 @@ class Clusterer():
                     fields = line.split("\t")
                     rownames[fields[1]] = fields[0]
                     roworder.append(fields[1])
-            for m in maps:
-                if m.csvfile:
-                    m.writeCDT(rownames, roworder, gtrfile)
+            if self.leafOrder in ["mean", "optimal"]:
+                roworder = self.orderLeaves(gtrfile, rownames, means, rows)
+            self.writeOutputs(maps, rownames, roworder, gtrfile, plotfile, maxheight, session)
+            return True
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def clusterInternal(self, wantedMaps, workdir, gtrfile, means, rows):
+        """Cluster the reads without cluster3. The distances between reads are computed in
+blocks (using `nprocs' processes) into a memory-mapped file in `workdir', so the distance
+matrix does not need to fit in memory, and the tree is built from it by Linkage.nnChain.
+The tree is written to `gtrfile'; `means' and `rows' are filled as in writeMatrix. Returns
+the dictionary mapping read names to GTR ids, and the list of read names in tree order."""
+        import numpy as np
+        import Linkage
+        import CDTsort
+
+        names = [ name for (name, fmap) in wantedMaps[0].mapstrings ]
+        data = np.hstack([ m.sclmatrix[:, self.clusterFrom:self.clusterTo] * w for (m, w) in zip(wantedMaps, self.clusterWeights) ])
+        means.update(zip(names, data.mean(axis=1).tolist() if data.shape[1] else [ 0.0 for _ in names ]))
+        if self.leafOrder == "optimal":
+            rows.extend(zip(names, data.tolist()))
+        sys.stderr.write(CLUSTER + "Computing distances between {} reads ({} process{}).\n".format(len(names), self.nprocs, "" if self.nprocs == 1 else "es"))
+        D = Linkage.condensedDistances(data, os.path.join(workdir, "distances"), self.clusterDist, nprocs=self.nprocs)
+        sys.stderr.write(CLUSTER + "Building tree.\n")
+        branches = Linkage.toBranches(Linkage.nnChain(D, self.clusterMeth), len(names), self.clusterDist)
+        del D
+        with open(gtrfile, "w") as out:
+            for br in branches:
+                out.write("\t".join(br) + "\n")
+        rownames = dict([ (name, "GENE{}X".format(i)) for (i, name) in enumerate(names) ])
+        if not branches:
+            return (rownames, names)
+        gids = dict([ (gid, name) for (name, gid) in rownames.items() ])
+        sys.stderr.write(CLUSTER + "Clustering successful.\n")
+        sys.stderr.write(CLUSTER + "Writing CDT files:\n")
+        return (rownames, [ gids[g] for g in CDTsort.GTree(branches=branches).leaves() ])
+
+    def writeMatrix(self, out, wantedMaps, ncols, means, rows):
+        """Write the clustering matrix to stream `out' in the format read by cluster3, storing
+the mean of each row in `means', and the rows themselves in `rows' if needed for optimal
+leaf ordering."""
+        totcols = len(wantedMaps) * ncols
+        out.write("#Sequence\t" + "\t".join(makeColHeaders(totcols)) + "\n")
+        for (name, fmap) in wantedMaps[0].mapstrings:
+            row = self.clusterRow(wantedMaps, name)
+            out.write(name + "\t" + "\t".join([ str(x) for x in row ]) + "\n")
+            means[name] = sum(row) / totcols if totcols else 0.0
+            if self.leafOrder == "optimal":
+                rows.append((name, row))
+
+    def order(self, maps, plotfile=None, maxheight=None, session=None):
+        """Order the reads using the fast ordering `ordering' (see Ordering) instead of clustering
+them, and write the CDT files (without a tree) and the heatmap."""
+        import numpy as np
+        import Ordering
+
+        wantedMaps = self.getWantedMaps(maps)
+        if not wantedMaps:
+            return False
+        sys.stderr.write(CLUSTER + "Ordering reads by {} on {}; region=[{}, {}]\n".format(
+            self.ordering, ",".join([m.site for m in wantedMaps]), self.clusterFrom + self.offset + 1, self.clusterTo + self.offset))
+        names = [ name for (name, fmap) in wantedMaps[0].mapstrings ]
+        codes = np.hstack([ Ordering.mapMatrix(m.mapstrings, self.clusterFrom, self.clusterTo) for m in wantedMaps ])
+        (order, labels) = Ordering.orderReads(codes, self.ordering, k=self.nmodes)
+        if labels is not None:
+            self.groups = dict(zip(names, (labels + 1).tolist()))
+            sizes = np.bincount(labels)
+            sys.stderr.write(CLUSTER + "Reads assigned to {} clusters: {}.\n".format(len(sizes), ", ".join([ str(s) for s in sizes ])))
+        rownames = dict([ (name, "GENE{}X".format(i)) for (i, name) in enumerate(names) ])
+        sys.stderr.write(CLUSTER + "Writing CDT files:\n")
+        self.writeOutputs(maps, rownames, [ names[i] for i in order ], None, plotfile, maxheight, session)
+        return True
+
+    def writeOutputs(self, maps, rownames, roworder, gtrfile, plotfile, maxheight, session):
+        """Write the CDT files and the heatmap for the tree in `gtrfile' (None if the reads
+were ordered without a tree)."""
+        if (self.ngroups > 0 or self.cutHeight is not None) and gtrfile:
+            self.cutTree(gtrfile, rownames)
+        for m in maps:
+            if m.csvfile:
+                m.writeCDT(rownames, roworder, gtrfile)
+            else:
+                sys.stderr.write(WARNING + "Writing CDT file requires the --csv option.\n")
+            # m.dump()
+        if gtrfile:
+            with open(gtrfile, "r") as f:
+                self.branches = [ line.rstrip("\r\n").split("\t")[:4] for line in f ]
+            self.rownames = rownames
+        if plotfile:
+            import Draw
+            sys.stderr.write(CLUSTER + "Saving heatmap to: {}.\n".format(plotfile))
+            Draw.plotMap(plotfile, maps, maxheight=maxheight, session=session)
+
+    def attach(self, maps, branches, gids, plotfile=None, maxheight=None, session=None):
+        """Add the reads in `maps' that are not in the tree described by `branches' (in which
+read names are mapped to GTR ids by `gids') to the tree, each one next to the most similar
+read already in the tree, instead of clustering all reads again. The existing leaf order is
+preserved. Reads are only attached to reads that were already in the tree."""
+        import numpy as np
+        import CDTsort
+        import LeafOrder
+
+        wantedMaps = self.getWantedMaps(maps)
+        if not wantedMaps:
+            return False
+        names = [ name for (name, fmap) in wantedMaps[0].mapstrings ]
+        old = [ n for n in names if n in gids ]
+        new = [ n for n in names if n not in gids ]
+        if not old:
+            sys.stderr.write(WARNING + "No clustering tree to attach reads to, clustering all reads.\n")
+            return self.run(maps, plotfile=plotfile, maxheight=maxheight, session=session)
+        if len(old) != len(gids):
+            sys.stderr.write(WARNING + "{} reads in the clustering tree are not in the store, clustering all reads.\n".format(len(gids) - len(old)))
+            return self.run(maps, plotfile=plotfile, maxheight=maxheight, session=session)
+        sys.stderr.write(CLUSTER + "Attaching {} new reads to tree with {} reads.\n".format(len(new), len(old)))
+
+        G = CDTsort.GTree(branches=branches)
+        if not G.root:
+            G.root = gids[old[0]]
+        parents = {}
+        for node in G.nodes.values():
+            parents[node.left] = node.name
+            parents[node.right] = node.name
+        nextGene = max([ int(g[4:-1]) for g in gids.values() ]) + 1
+        nextNode = max([ int(n[4:-1]) for n in G.nodes ] or [0]) + 1
+        rownames = dict([ (n, gids[n]) for n in old ])
+        oldrows = np.array([ self.clusterRow(wantedMaps, n) for n in old ])
+        for start in range(0, len(new), 1000):
+            block = new[start:start+1000]
+            D = LeafOrder.distanceMatrix([ self.clusterRow(wantedMaps, n) for n in block ], self.clusterDist, oldrows)
+            for (i, name) in enumerate(block):
+                j = int(np.argmin(D[i]))
+                leaf = gids[old[j]]
+                gid = "GENE{}X".format(nextGene)
+                node = "NODE{}X".format(nextNode)
+                nextGene += 1
+                nextNode += 1
+                parent = parents.get(leaf)
+                psimil = float(G.nodes[parent].simil) if parent else 0.0
+                simil = min(1.0, max(psimil, 1.0 - D[i, j]))
+                G.nodes[node] = CDTsort.Node(node, leaf, gid, "{:.6f}".format(simil))
+                if parent:
+                    pnode = G.nodes[parent]
+                    if pnode.left == leaf:
+                        pnode.left = node
+                    else:
+                        pnode.right = node
                 else:
-                    sys.stderr.write(WARNING + "Writing CDT file requires the --csv option.\n")
-                # m.dump()
-            if plotfile:
-                sys.stderr.write(CLUSTER + "Saving heatmap to: {}.\n".format(plotfile))
-                Draw.plotMap(plotfile, maps)
+                    G.root = node
+                parents[node] = parent
+                parents[leaf] = node
+                parents[gid] = node
+                rownames[name] = gid
+
+        gidnames = dict([ (g, n) for (n, g) in rownames.items() ])
+        roworder = [ gidnames[g] for g in G.leaves() ]
+        (fd, gtrfile) = tempfile.mkstemp(suffix=".gtr", dir=self.tmpdir)
+        try:
+            with os.fdopen(fd, "w") as out:
+                G.writeTree(out)
+            self.writeOutputs(maps, rownames, roworder, gtrfile, plotfile, maxheight, session)
             return True
         finally:
-            saferm(csvfile)
-            saferm(cdtfile)
             saferm(gtrfile)
 
+    def orderLeaves(self, gtrfile, rownames, means, rows):
+        """Reorder the tree in `gtrfile' (in place). With leafOrder="mean", at each node the
+subtree with the lower mean comes first; with leafOrder="optimal", the sum of the distances
+between adjacent rows (computed from the (name, row) pairs in `rows') is minimized. Returns
+the names of the rows in the new order."""
+        gids = {}
+        data = {}
+        for (name, gid) in rownames.items():
+            gids[gid] = name
+            data[gid] = means[name]
+        with open(gtrfile, "r") as f:
+            branches = [ line.rstrip("\r\n").split("\t")[:4] for line in f ]
+        if self.leafOrder == "optimal":
+            import LeafOrder
+            sys.stderr.write(CLUSTER + "Computing optimal leaf ordering.\n")
+            index = dict([ (rownames[r[0]], i) for (i, r) in enumerate(rows) ])
+            D = LeafOrder.distanceMatrix([ r[1] for r in rows ], self.clusterDist)
+            (branches, leaves) = LeafOrder.optimalOrder(branches, index, D)
+        else:
+            import CDTsort
+            sys.stderr.write(CLUSTER + "Sorting tree leaves by mean value.\n")
+            (branches, leaves) = CDTsort.sortTree(branches, data)
+        with open(gtrfile, "w") as out:
+            for br in branches:
+                out.write("\t".join(br) + "\n")
+        return [ gids[g] for g in leaves ]
+
+    def cutTree(self, gtrfile, rownames):
+        """Cut the tree in `gtrfile' into `ngroups' groups, or at height `cutHeight', setting `groups'."""
+        import CDTsort
+        gids = dict([ (gid, name) for (name, gid) in rownames.items() ])
+        simil = None if self.cutHeight is None else 1.0 - self.cutHeight
+        clusters = CDTsort.GTree(gtrfile).cut(self.ngroups, simil=simil)
+        self.groups = {}
+        for (i, leaves) in enumerate(clusters):
+            for g in leaves:
+                self.groups[gids[g]] = i + 1
+        sys.stderr.write(CLUSTER + "Tree cut into {} groups: {}.\n".format(len(clusters), ", ".join([ str(len(c)) for c in clusters ])))
+
+    def bootstrap(self, maps):
+        """Assess the stability of the clusters in `groups' with `nboot' bootstrap replicates (see
+Bootstrap), reusing the scaled maps (or the site calls, for the kmodes ordering) of the reads."""
+        import numpy as np
+        import Bootstrap
+        import Ordering
+
+        if self.ordering is None and self.clusterMeth not in ["s", "m", "a"]:
+            sys.stderr.write(WARNING + "Bootstrap is not supported for clustering method {}.\n".format(self.clusterMeth))
+            return None
+        wantedMaps = self.getWantedMaps(maps)
+        if not wantedMaps:
+            return None
+        names = [ name for (name, fmap) in wantedMaps[0].mapstrings ]
+        labels = np.array([ self.groups[name] - 1 for name in names ], dtype=int)
+        kmodes = (self.ordering is not None)
+        if kmodes:
+            data = Ordering.siteCalls(np.hstack([ Ordering.mapMatrix(m.mapstrings, self.clusterFrom, self.clusterTo) for m in wantedMaps ]))
+        else:
+            data = np.hstack([ m.sclmatrix[:, self.clusterFrom:self.clusterTo] * w for (m, w) in zip(wantedMaps, self.clusterWeights) ])
+        simil = None if self.cutHeight is None else 1.0 - self.cutHeight
+        sys.stderr.write(CLUSTER + "Running {} bootstrap replicates resampling {} ({} process{}).\n".format(
+            self.nboot, "reads" if self.bootReads else "columns", self.nprocs, "" if self.nprocs == 1 else "es"))
+        t0 = time.time()
+        stab = Bootstrap.bootstrap(data, labels, self.nboot, kmodes=kmodes, dist=self.clusterDist, method=self.clusterMeth,
+                                   simil=simil, reads=self.bootReads, nprocs=self.nprocs)
+        sys.stderr.write(CLUSTER + "Bootstrap completed in {:.1f}s.\n".format(time.time() - t0))
+        sizes = np.bincount(labels, minlength=stab.shape[1])
+        for g in range(stab.shape[1]):
+            values = stab[:, g][~np.isnan(stab[:, g])]
+            if len(values):
+                sys.stderr.write(CLUSTER + "  Cluster {}: {} reads, mean Jaccard {:.3f}, recovered in {:.1f}% of replicates.\n".format(
+                    g + 1, sizes[g], values.mean(), 100.0 * (values > 0.5).sum() / len(values)))
+            else:
+                sys.stderr.write(CLUSTER + "  Cluster {}: {} reads, never sampled.\n".format(g + 1, sizes[g]))
+        return stab
+
     def setWeights(self):
         lw = len(self.clusterWeights)
         if lw == 0 or lw != len(self.clusterOn):
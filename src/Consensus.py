@@ -0,0 +1,83 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import numpy as np
+
+from Ordering import mapMatrix, METH, UNMETH
+from MethMap import patchRegions
+
+### Per-cluster summaries (--cluster-summary). Given the group of each read (from
+### cutting the clustering tree, or from the kmodes ordering), the table contains
+### one row for each cluster and site, with:
+###   Cluster, Reads, Fraction  - cluster number, size, and fraction of all reads
+###   Site, Meth                - site, and mean methylation fraction of the site calls
+###   Consensus                 - consensus call at each site (* methylated, # unmethylated, . no calls)
+###   SiteMeth                  - fraction of methylated calls at each site
+###   SitePatch                 - fraction of reads in which each site is in a methylated patch
+### All values are computed with group-by operations on the matrix of map characters.
+
+def patchMask(codes, openMin):
+    """Return a boolean array indicating which positions of `codes' (see Ordering.mapMatrix)
+are in a methylated patch (see MethMap.patchRegions)."""
+    (rows, kind, start, end) = patchRegions(codes, openMin)
+    meth = (kind == 1)
+    ncols = codes.shape[1]
+    # +1 at the first position of each patch, -1 after its last one
+    marks = np.zeros(codes.size + 1, dtype=int)
+    marks[rows[meth] * ncols + start[meth]] += 1
+    marks[rows[meth] * ncols + end[meth]] -= 1
+    return (np.cumsum(marks[:-1]) > 0).reshape(codes.shape)
+
+def groupSums(labels, data, ngroups):
+    """Return the sums of the rows of `data' in each group, where `labels' contains the group
+(0..ngroups-1) of each row, as an array with `ngroups' rows."""
+    order = np.argsort(labels, kind="stable")
+    sizes = np.bincount(labels, minlength=ngroups)
+    result = np.zeros((ngroups, data.shape[1]), dtype=float)
+    present = np.nonzero(sizes)[0]
+    if len(present):
+        bounds = np.concatenate(([0], np.cumsum(sizes[present])[:-1]))
+        result[present] = np.add.reduceat(data[order].astype(float), bounds, axis=0)
+    return result
+
+def siteSummary(m, names, labels, ngroups):
+    """Return the number of methylated calls, calls and patch reads at each site of map `m'
+for the reads in `names', by group, as three arrays with one row per group."""
+    rows = dict([ (name, fmap) for (name, fmap) in m.mapstrings ])
+    codes = mapMatrix([ (name, rows[name]) for name in names ], 0, m.ref.length)
+    cols = np.array(m.allPositions(), dtype=int)
+    sitecodes = codes[:, cols]
+    meth = groupSums(labels, sitecodes == METH, ngroups)
+    calls = groupSums(labels, (sitecodes == METH) | (sitecodes == UNMETH), ngroups)
+    patch = groupSums(labels, patchMask(codes, m.openMin)[:, cols], ngroups)
+    return (meth, calls, patch)
+
+def consensusString(meth, calls):
+    return "".join([ "." if c == 0 else "*" if 2 * x >= c else "#" for (x, c) in zip(meth, calls) ])
+
+def formatValues(values):
+    return ",".join([ "{:.3f}".format(v) for v in values ])
+
+def writeSummary(out, maps, groups, offset=0):
+    """Write the summary table for the clusters in `groups' (read name => cluster, starting at 1)
+to stream `out'. `offset' is added to site positions. Returns the number of clusters."""
+    names = [ name for (name, fmap) in maps[0].mapstrings if name in groups ]
+    labels = np.array([ groups[name] - 1 for name in names ], dtype=int)
+    ngroups = int(labels.max()) + 1 if len(labels) else 0
+    sizes = np.bincount(labels, minlength=ngroups)
+    summaries = [ siteSummary(m, names, labels, ngroups) for m in maps ]
+    for m in maps:
+        out.write("# {} sites: {}\n".format(m.site, ",".join([ str(p + offset + 1) for p in m.allPositions() ])))
+    out.write("Cluster\tReads\tFraction\tSite\tMeth\tConsensus\tSiteMeth\tSitePatch\n")
+    for g in range(ngroups):
+        if sizes[g] == 0:
+            continue
+        for (m, (meth, calls, patch)) in zip(maps, summaries):
+            totcalls = calls[g].sum()
+            out.write("{}\t{}\t{:.3f}\t{}\t{:.3f}\t{}\t{}\t{}\n".format(
+                g + 1, sizes[g], float(sizes[g]) / len(names), m.site,
+                meth[g].sum() / totcalls if totcalls else 0.0,
+                consensusString(meth[g], calls[g]),
+                formatValues(meth[g] / np.maximum(calls[g], 1)),
+                formatValues(patch[g] / sizes[g])))
+    return ngroups
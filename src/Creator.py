@@ -1,3 +1,5 @@
+import sys
+import time
 import subprocess
 
 class Creator():
@@ -9,7 +11,7 @@ class Creator():
 
     def __init__(self, pathname="gdcreate"):
         self.gdcreate = pathname
-        self.proc = subprocess.Popen(self.gdcreate, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.proc = subprocess.Popen(self.gdcreate, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
         self.pin = self.proc.stdin
         self.pout = self.proc.stdout
 
@@ -31,6 +33,37 @@ class Creator():
             sys.exit(1)
         return reply.rstrip("\n")
 
+    def sendBatch(self, commands):
+        """Send all the commands in `commands' (each one a list of words) at once, then
+read their replies. Returns the list of replies."""
+        for words in commands:
+            for w in words:
+                self.pin.write("{}\n".format(w))
+        self.pin.flush()
+        replies = []
+        for words in commands:
+            reply = self.pout.readline()
+            if reply == "bad\n":
+                sys.stderr.write("Error in command: {}\n".format(words))
+                sys.exit(1)
+            replies.append(reply.rstrip("\n"))
+        return replies
+
+    def close(self, timeout=5):
+        """Ask gdcreate to exit and wait for it, killing it if it is still running after `timeout' seconds."""
+        try:
+            self.sendCommand("ZZ")
+            self.pin.close()
+        except (IOError, OSError, ValueError):
+            pass
+        limit = time.time() + timeout
+        while self.proc.poll() is None and time.time() < limit:
+            time.sleep(0.01)
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.pout.close()
+
     def terminate(self):
         self.send("ZZ")
         self.proc.terminate()
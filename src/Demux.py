@@ -0,0 +1,112 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import sys
+from collections import Counter
+
+from Utils import INPUT, WARNING
+
+### Assign pooled reads to amplicons. A read is assigned using the tag in its
+### header if present; otherwise it is compared to the references with the same
+### length, by counting shared k-mers after in-silico bisulfite conversion (all
+### Cs to Ts for the top strand, all Gs to As for the bottom strand), so that the
+### methylation state of the read does not affect the match.
+
+def convertTop(s):
+    return s.upper().replace("C", "T")
+
+def convertBot(s):
+    return s.upper().replace("G", "A")
+
+class Demultiplexer():
+    names = []
+    lengths = []
+    bylength = {}               # Sequence length => list of reference indices
+    byname = {}                 # Reference name => reference index
+    tag = None                  # Header tag containing the reference name, e.g. "amplicon="
+    k = 12
+    index = {}                  # Converted k-mer => set of reference indices
+
+    # Counts
+    counts = []
+    nunknown = 0                # Reads whose length does not match any reference
+    nambiguous = 0              # Reads matching more than one reference equally well
+
+    def __init__(self, refs, tag=None, k=12):
+        self.names = [ r.id for r in refs ]
+        self.lengths = [ len(r) for r in refs ]
+        self.tag = tag
+        self.k = k
+        self.bylength = {}
+        self.byname = {}
+        self.index = {}
+        self.counts = [0] * len(refs)
+        self.nunknown = 0
+        self.nambiguous = 0
+        for i in range(len(refs)):
+            self.byname[self.names[i]] = i
+            self.bylength.setdefault(self.lengths[i], []).append(i)
+        for (l, idxs) in self.bylength.items():
+            if len(idxs) > 1:
+                for i in idxs:
+                    seq = str(refs[i].seq)
+                    for kmer in self.kmers(convertTop(seq)) | self.kmers(convertBot(seq)):
+                        self.index.setdefault(kmer, set()).add(i)
+
+    def kmers(self, s):
+        k = self.k
+        return set([ s[i:i+k] for i in range(len(s) - k + 1) ])
+
+    def tagged(self, rec):
+        """Return the reference name in the header of `rec', or None."""
+        for word in rec.description.split():
+            if word.startswith(self.tag):
+                return word[len(self.tag):]
+        return None
+
+    def assign(self, rec):
+        """Return the index of the reference that read `rec' should be assigned to, or None."""
+        idx = None
+        if self.tag:
+            name = self.tagged(rec)
+            if name in self.byname:
+                idx = self.byname[name]
+                if self.lengths[idx] != len(rec):
+                    idx = None
+        if idx is None:
+            candidates = self.bylength.get(len(rec), [])
+            if len(candidates) == 1:
+                idx = candidates[0]
+            elif candidates:
+                idx = self.bestMatch(str(rec.seq), candidates)
+                if idx is None:
+                    self.nambiguous += 1
+                    return None
+            else:
+                self.nunknown += 1
+                return None
+        self.counts[idx] += 1
+        return idx
+
+    def bestMatch(self, seq, candidates):
+        hits = Counter()
+        for conv in [convertTop, convertBot]:
+            found = Counter()
+            for kmer in self.kmers(conv(seq)):
+                if kmer in self.index:
+                    found.update(self.index[kmer])
+            for i in candidates:
+                hits[i] = max(hits[i], found[i])
+        best = hits.most_common(2)
+        if not best or best[0][1] == 0 or (len(best) > 1 and best[0][1] == best[1][1]):
+            return None
+        return best[0][0]
+
+    def report(self):
+        for i in range(len(self.names)):
+            sys.stderr.write(INPUT + "  {}: {} reads.\n".format(self.names[i], self.counts[i]))
+        sys.stderr.write(INPUT + "{} reads assigned to {} references.\n".format(sum(self.counts), len([ c for c in self.counts if c > 0 ])))
+        if self.nunknown:
+            sys.stderr.write(WARNING + "{} reads do not match the length of any reference.\n".format(self.nunknown))
+        if self.nambiguous:
+            sys.stderr.write(WARNING + "{} reads could not be assigned unambiguously.\n".format(self.nambiguous))
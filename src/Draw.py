@@ -5,9 +5,12 @@
 
 import os
 import sys
+import numpy as np
 import colormaps
 from Creator import Creator
 from Drawer import Drawer
+from VectorDrawer import SVGDrawer, PDFDrawer
+from Utils import CLUSTER
 
 class Drawable():
     width = 0
@@ -39,18 +42,30 @@ class Drawable():
             newpoints.append(points[i+1] + self.yoffset)
         d.drawFilledPolygon(newpoints, color)
 
+def rowLayout(nrow, rowh, maxheight):
+    """Returns a tuple (rowh, binsize) describing how to fit `nrow' rows of height `rowh'
+in `maxheight' pixels. If needed rows are made thinner, and when even one pixel per row
+is too much, `binsize' consecutive rows are merged into each pixel row."""
+    if not maxheight or nrow * rowh <= maxheight:
+        return (rowh, 1)
+    if nrow <= maxheight:
+        return (maxheight // nrow, 1)
+    return (1, (nrow + maxheight - 1) // maxheight)
+
 class ClustPanel(Drawable):
     rowh = 10
     cellw = 10
+    binsize = 1                 # Number of CDT rows drawn in each row of the panel
     nrow = 0                    # Rows in CDT file
+    nbins = 0                   # Rows in panel (nrow / binsize)
     ncol = 0                    # Columns in CDT file
-    data = []
+    cdtfile = None
 
-    def __init__(self, cdtfile, rowh=10, cellw=10):
-        self.rowh = rowh
+    def __init__(self, cdtfile, rowh=10, cellw=10, maxheight=None):
         self.margin = rowh / 2
         self.cellw = cellw
-        self.data = []
+        self.cdtfile = cdtfile
+        self.nrow = 0
 
         with open(cdtfile, "r") as f:
             hdr = f.readline().split("\t")
@@ -58,9 +73,20 @@ class ClustPanel(Drawable):
             f.readline()
             for line in f:
                 self.nrow += 1
-                self.data.append( [ (x if x == "." else int(float(x))) for x in line.rstrip("\r\n").split("\t")[4:] ] )
+        # At least one pixel row is always drawn, even if the margins alone exceed maxheight
+        avail = max(1, int(maxheight - self.margin * 2)) if maxheight else None
+        (self.rowh, self.binsize) = rowLayout(self.nrow, rowh, avail)
+        self.nbins = (self.nrow + self.binsize - 1) // self.binsize
         self.width = self.cellw * self.ncol + self.margin * 2
-        self.height = self.rowh * self.nrow + self.margin * 2
+        self.height = self.rowh * self.nbins + self.margin * 2
+
+    def rows(self):
+        """Iterate over the data rows of the CDT file, without keeping them in memory."""
+        with open(self.cdtfile, "r") as f:
+            f.readline()
+            f.readline()
+            for line in f:
+                yield [ (x if x == "." else int(float(x))) for x in line.rstrip("\r\n").split("\t")[4:] ]
 
     def findLimits(self, line):
         """Returns the index of the first and last non-zero position in `line'."""
@@ -77,8 +103,11 @@ class ClustPanel(Drawable):
         return (a, b)
 
     def draw(self, d, cmap):
+        if self.binsize > 1:
+            return self.drawBinned(d, cmap)
+        bottom = self.rowh - (2 if self.rowh > 2 else 1)
         row = 0
-        for line in self.data:
+        for line in self.rows():
             col = 0
             (a, b) = self.findLimits(line)
             for v in line:
@@ -89,10 +118,48 @@ class ClustPanel(Drawable):
                     color = cmap.getColor(v)
                     # print "{},{} {} => {}".format(x, y, v, color)
                     # raw_input()
-                    self.drawFilledRectangle(d, x, y, x + self.cellw - 1, y + self.rowh - 2, color)
+                    self.drawFilledRectangle(d, x, y, x + self.cellw - 1, y + bottom, color)
                 col += 1
             row += 1
 
+    def drawBinned(self, d, cmap):
+        """Draw the panel merging `binsize' consecutive rows into each pixel row. Each cell
+is colored according to the fraction of methylated calls (positive values) over all
+calls (non-zero values) in the corresponding column of the bin."""
+        meth   = np.zeros(self.ncol, dtype=int)
+        calls  = np.zeros(self.ncol, dtype=int)
+        inside = np.zeros(self.ncol, dtype=int)
+        nrows = 0
+        row = 0
+        for line in self.rows():
+            vals = np.array([ (0 if v == "." else v) for v in line ])
+            meth  += (vals > 0)
+            calls += (vals != 0)
+            (a, b) = self.findLimits(line)
+            inside[a:b+1] += 1
+            nrows += 1
+            if nrows == self.binsize:
+                self.drawBin(d, cmap, row, meth, calls, inside)
+                meth[:] = 0
+                calls[:] = 0
+                inside[:] = 0
+                nrows = 0
+                row += 1
+        if nrows:
+            self.drawBin(d, cmap, row, meth, calls, inside)
+
+    def drawBin(self, d, cmap, row, meth, calls, inside):
+        y = row * self.rowh + self.margin
+        for col in range(self.ncol):
+            if inside[col] == 0:
+                continue
+            x = col * self.cellw + self.margin
+            if calls[col] > 0:
+                color = cmap.getFraction(1.0 * meth[col] / calls[col])
+            else:
+                color = cmap.getColor(0)
+            self.drawFilledRectangle(d, x, y, x + self.cellw - 1, y + self.rowh - 1, color)
+
 class SiteBar(Drawable):
     ncol = 0
     cellw = 10
@@ -118,6 +185,7 @@ class SiteBar(Drawable):
 class ClustTree(Drawable):
     treewidth = 100
     rowh = 10
+    binsize = 1
     spacing = 6
     genes = []
     names = []
@@ -125,9 +193,10 @@ class ClustTree(Drawable):
     coords = {}
     maxnamelen = 0
 
-    def __init__(self, cdtfile, gtrfile, treewidth=100, rowh=10):
+    def __init__(self, cdtfile, gtrfile, treewidth=100, rowh=10, binsize=1):
         self.treewidth = treewidth
         self.rowh = rowh
+        self.binsize = binsize
         self.margin = rowh / 2
         self.genes = []
         self.names = []
@@ -146,9 +215,10 @@ class ClustTree(Drawable):
                 gname = fields[0]
                 name = fields[1]
                 self.genes.append(gname)
-                self.names.append(name)
-                self.maxnamelen = max(self.maxnamelen, len(name))
-                ypos = self.margin + row * self.rowh
+                if self.writeNames:
+                    self.names.append(name)
+                    self.maxnamelen = max(self.maxnamelen, len(name))
+                ypos = self.margin + (row // self.binsize) * self.rowh
                 self.coords[gname] = (self.margin + self.treewidth, ypos)
                 row += 1
         self.height = ypos + self.margin
@@ -157,11 +227,12 @@ class ClustTree(Drawable):
         else:
             self.width = self.treewidth + self.margin * 2
 
-        with open(gtrfile, "r") as f:
-            for line in f:
-                fields = line.rstrip("\r\n").split()
-                fields[3] = float(fields[3])
-                self.branches.append(fields)
+        if gtrfile:             # No tree if reads were ordered with --order
+            with open(gtrfile, "r") as f:
+                for line in f:
+                    fields = line.rstrip("\r\n").split()
+                    fields[3] = float(fields[3])
+                    self.branches.append(fields)
 
     def draw(self, d):
 
@@ -171,43 +242,29 @@ class ClustTree(Drawable):
                 name = self.names[gidx]
                 d.drawString(name, self.xoffset + self.margin + self.treewidth + self.spacing, self.yoffset + self.coords[gene][1], 1, anchor=4)
 
-        while True:
-            found = None
-            for gidx in range(len(self.genes) - 1):
-                g1 = self.genes[gidx]
-                g2 = self.genes[gidx+1]
-                br = self.findBranch(g1, g2) # find branch containing g1 and g2
-                if br:
-                    found = True
-                    break
-
-            if not found:
-                sys.stderr.write("Error: branch for {} and {} not found!\n".format(g1, g2))
-                return
+        # Branches are listed in the GTR file after both their children, so
+        # the coordinates of each branch can be computed in a single pass.
+        # Subtrees lying entirely on a single pixel row are not drawn: their
+        # parent extends its line to the right edge of the tree instead.
+        drawn = set()
+        for br in self.branches:
             top = br[0]
-            left = br[1]
-            leftcoord = self.coords[left]
-            right = br[2]
-            rightcoord = self.coords[right]
-            # print leftcoord
-            # print rightcoord
+            if br[1] not in self.coords or br[2] not in self.coords:
+                sys.stderr.write("Error: branch for {} and {} not found!\n".format(br[1], br[2]))
+                return
+            leftcoord = self.coords[br[1]]
+            rightcoord = self.coords[br[2]]
+            if leftcoord[1] == rightcoord[1]:
+                self.coords[top] = (max(leftcoord[0], rightcoord[0]), leftcoord[1])
+                continue
             blen = self.margin + int(br[3] * self.treewidth)
             self.coords[top] = (blen, (leftcoord[1] + rightcoord[1]) / 2)
-            # print self.coords[top]
-            self.drawLine(d, blen, leftcoord[1], blen, rightcoord[1], 1)
-            self.drawLine(d, blen, leftcoord[1], leftcoord[0], leftcoord[1], 1)
-            self.drawLine(d, blen, rightcoord[1], rightcoord[0], rightcoord[1], 1)
-
-            self.genes[gidx:gidx+2] = [br[0]]
-            # print self.genes
-            if len(self.genes) == 1:
-                break
-
-    def findBranch(self, g1, g2):
-        for br in self.branches:
-            if ((br[1] == g1) and (br[2] == g2)) or ((br[1] == g2) and (br[2] == g1)):
-                return br
-        return None
+            for line in [(blen, leftcoord[1], blen, rightcoord[1]),
+                         (blen, leftcoord[1], leftcoord[0], leftcoord[1]),
+                         (blen, rightcoord[1], rightcoord[0], rightcoord[1])]:
+                if line not in drawn:
+                    drawn.add(line)
+                    self.drawLine(d, line[0], line[1], line[2], line[3], 1)
 
 class MultiClusterPlot():
     maps = []
@@ -224,6 +281,7 @@ class MapColors():
     name = ""
     rgbs = []
     colors = []
+    range = None                # RangeColorMap from closed patch to open patch color
 
     def __init__(self, name, rgbs):
         self.name = name
@@ -242,14 +300,23 @@ class MapColors():
             n += 1
         #print "Map {}: {}".format(self.name, self.colors)
 
+    def allocateRange(self, d, n=32):
+        """Allocate `n' colors going from the closed patch color to the open patch color,
+used to display the fraction of methylated calls in binned rows."""
+        self.range = colormaps.RangeColorMap(d)
+        self.range.allocate(n, *(self.rgbs[1] + self.rgbs[3]))
+
     def getColor(self, idx):
         if idx in self.colors:
             return self.colors[idx]
         else:
             return [255, 255, 255]
 
+    def getFraction(self, f):
+        return self.range.decode(f)
+
 def makeColormaps(cm, weights):
-    weights.reverse()
+    weights = list(reversed(weights))
     cmaps = {"rgb": MapColors("rgb", [[250, 250, 250],
                                       [  0,   0,   0],
                                       [128, 128, 128],
@@ -266,26 +333,96 @@ def makeColormaps(cm, weights):
     #print cm.colors
     return cmaps
 
-def plotMap(plotfile, methmaps, rowh=15, cellw=3):
+def makePalette(d, weights, binned=False):
+    """Allocate the colors used by plotMap in the current image of drawer `d'. Returns the
+standard colormap and the dictionary of map colormaps."""
+    cm = colormaps.StandardColorMap(d)
+    cmaps = makeColormaps(cm, weights)
+    if binned:
+        for mc in cmaps.values():
+            mc.allocateRange(d)
+    return (cm, cmaps)
+
+def makeDrawer(plotfile, creator=None):
+    """Return a drawer for `plotfile': SVG or PDF files are written directly by a vector
+backend, anything else is rendered by gdcreate (through `creator', if supplied)."""
+    ext = os.path.splitext(plotfile)[1].lower()
+    if ext == ".svg":
+        return SVGDrawer(plotfile)
+    elif ext == ".pdf":
+        return PDFDrawer(plotfile)
+    else:
+        c = creator or Creator(pathname=os.getenv("GDCREATE_PATH") or "gdcreate")
+        return Drawer(c)
+
+class RenderSession():
+    """Draws any number of plots with a single gdcreate process. The colors allocated for
+each image configuration are remembered, so that later images with the same configuration
+can allocate their whole palette in a single exchange with gdcreate."""
+    creator = None
+    palettes = {}               # (backend, weights, binned) => (saved palette, cm, cmaps)
+    nplots = 0
+
+    def __init__(self):
+        self.creator = None
+        self.palettes = {}
+        self.nplots = 0
+
+    def drawer(self, plotfile):
+        ext = os.path.splitext(plotfile)[1].lower()
+        if ext not in [".svg", ".pdf"] and not self.creator:
+            self.creator = Creator(pathname=os.getenv("GDCREATE_PATH") or "gdcreate")
+        return makeDrawer(plotfile, creator=self.creator)
+
+    def palette(self, d, weights, binned=False):
+        """Like makePalette(), but reuses the palette built for a previous image with the same configuration."""
+        key = (d.__class__.__name__, tuple(weights), binned)
+        if key in self.palettes:
+            (saved, cm, cmaps) = self.palettes[key]
+            if d.restorePalette(saved):
+                return (cm, cmaps)
+            # The colors are allocated but with other indices: rebuild the colormaps from the replies
+        (cm, cmaps) = makePalette(d, weights, binned)
+        self.palettes[key] = (d.savePalette(), cm, cmaps)
+        return (cm, cmaps)
+
+    def plot(self, plotfile, methmaps, **args):
+        plotMap(plotfile, methmaps, session=self, **args)
+        self.nplots += 1
+
+    def close(self):
+        if self.creator:
+            self.creator.close()
+            self.creator = None
+
+def plotMap(plotfile, methmaps, rowh=15, cellw=3, maxheight=None, session=None):
+    """Draw the clustered maps in `methmaps' to `plotfile'. If `maxheight' is specified,
+the heatmap rows are shrunk or binned so that panels are at most `maxheight' pixels tall.
+If `session' (a RenderSession) is supplied, its gdcreate process and palettes are used."""
     panels  = []
     bars    = []
     map0    = methmaps[0]
 
-    tree  = ClustTree(map0.cdtfile, map0.gtrfile, rowh=rowh)
-    totwidth  = tree.width
+    totwidth = 0
     for mmap in methmaps:
-        pan = ClustPanel(mmap.cdtfile, rowh=rowh, cellw=cellw)
+        pan = ClustPanel(mmap.cdtfile, rowh=rowh, cellw=cellw, maxheight=maxheight)
         panels.append(pan)
         totwidth += pan.width
         bars.append(SiteBar(pan.ncol, mmap.allPositions(), cellw=cellw))
+    tree  = ClustTree(map0.cdtfile, map0.gtrfile, rowh=panels[0].rowh, binsize=panels[0].binsize)
+    totwidth += tree.width
 
     totheight = panels[0].height + bars[0].height
 
-    c = Creator(pathname=os.getenv("GDCREATE_PATH") or "gdcreate")
-    d = Drawer(c)
+    binned = panels[0].binsize > 1
+    if binned:
+        sys.stderr.write(CLUSTER + "Heatmap rows binned {} reads per pixel row.\n".format(panels[0].binsize))
+    d = session.drawer(plotfile) if session else makeDrawer(plotfile)
     d.createImage(totwidth, totheight)
-    cm = colormaps.StandardColorMap(d)
-    cmaps = makeColormaps(cm, map0.weights)
+    if session:
+        (cm, cmaps) = session.palette(d, map0.weights, binned)
+    else:
+        (cm, cmaps) = makePalette(d, map0.weights, binned)
     d.setColormap(cm)
     d.setFont(2)
 
@@ -305,4 +442,6 @@ def plotMap(plotfile, methmaps, rowh=15, cellw=3):
         i += 1
 
     d.saveImage(plotfile)
+    if session and d.cr:
+        return                  # The gdcreate process belongs to the session
     d.close()
@@ -5,10 +5,14 @@ import colormaps
 class Drawer():
     cr = None                   # Creator (connection to gdcreate)
     cm = None                   # Default colormap
+    allocated = []              # Color allocation commands sent for the current image, with their replies
+    pending = []                # Colors allocated by a failed restorePalette(), not yet claimed by colorAllocate()
 
     def __init__(self, creator):
         self.cr = creator
         self.cm = colormaps.ColorMap(self)
+        self.allocated = []
+        self.pending = []
 
     def setColormap(self, colormap):
         self.cm = colormap
@@ -24,18 +28,48 @@ class Drawer():
         self.cr.terminate()
 
     def createImage(self, width, height):
+        self.allocated = []
+        self.pending = []
         return self.cr.sendCommand("CR", width, height)
 
+    def allocate(self, words):
+        """Send the color allocation command `words', unless the same color was already allocated
+by restorePalette(), in which case its reply is reused."""
+        if self.pending and self.pending[0][0] == words:
+            result = self.pending.pop(0)[1]
+        else:
+            result = self.cr.sendCommandList(words)
+        self.allocated.append((words, result))
+        return result
+
     def colorAllocate(self, red, green, blue):
-        return self.cr.sendCommand("CA", red, green, blue)
+        return self.allocate(["CA", red, green, blue])
 
     def colorRangeAllocate(self, n, red1, green1, blue1, red2, green2, blue2):
         """Allocate `n' different colors ranging from (red1, green1, blue1) to (red2, green2, blue2). Returns the index of the
 first and last allocated colors."""
-        result = self.cr.sendCommand("C*", n, red1, green1, blue1, red2, green2, blue2)
+        result = self.allocate(["C*", n, red1, green1, blue1, red2, green2, blue2])
         crange = result.split("-")
         return (int(crange[0]), int(crange[1]))
 
+    def savePalette(self):
+        """Return the colors allocated so far in the current image, to be passed to restorePalette()."""
+        return list(self.allocated)
+
+    def restorePalette(self, saved):
+        """Allocate the colors in `saved' in the current image, sending all commands at once.
+Returns True if the new colors have the same indices as the saved ones, so that colormaps
+built for the saved palette can be reused. Otherwise, the colors are not allocated a second
+time when the palette is rebuilt: the following allocations of the same colors use the
+replies received here."""
+        replies = self.cr.sendBatch([ words for (words, result) in saved ])
+        if replies == [ result for (words, result) in saved ]:
+            self.allocated = list(saved)
+            return True
+        self.allocated = []
+        self.pending = [ (words, reply) for ((words, result), reply) in zip(saved, replies) ]
+        return False
+
     def drawPixel(self, x, y, color):
         return self.cr.sendCommand("PI", x, y, self.color(color))
 
@@ -112,7 +146,7 @@ five built-in GD fonts. Otherwise it should be the name of a TrueType font."""
         return self.cr.sendCommand("SA", filename)
 
     def close(self):
-        return self.cr.sendCommand("ZZ")
+        return self.cr.close()
 
     # Special purpose
     def drawGene(self, start, end, y, strand, color, smallboxes, largeboxes):
@@ -0,0 +1,57 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import re
+
+### Minimal FASTA reader and sequence utilities. Importing Bio.SeqIO takes longer
+### than processing a typical amplicon, so the command-line program uses these
+### instead. FastaRecord provides the subset of the SeqRecord interface used by
+### methylmapper (id, name, description, seq, len() and indexing).
+
+IUPAC = {"A": "A", "C": "C", "G": "G", "T": "T", "R": "AG", "Y": "CT", "S": "GC", "W": "AT", "K": "GT",
+         "M": "AC", "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "GATC", "X": "GATC"}
+COMPLEMENT = {"A": "T", "C": "G", "G": "C", "T": "A", "R": "Y", "Y": "R", "S": "S", "W": "W", "K": "M",
+              "M": "K", "B": "V", "V": "B", "D": "H", "H": "D", "N": "N", "X": "X"}
+
+class FastaRecord():
+    id = ""
+    name = ""
+    description = ""
+    seq = ""
+
+    def __init__(self, title, seq):
+        self.description = title
+        words = title.split(None, 1)
+        self.id = words[0] if words else ""
+        self.name = self.id
+        self.seq = seq
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __getitem__(self, i):
+        return self.seq[i]
+
+def FastaIterator(f):
+    """Iterate over the records in FASTA stream `f', returning FastaRecord objects."""
+    title = None
+    lines = []
+    for line in f:
+        if line.startswith(">"):
+            if title is not None:
+                yield FastaRecord(title, "".join(lines).replace(" ", ""))
+            title = line[1:].rstrip()
+            lines = []
+        elif title is not None:
+            lines.append(line.strip())
+    if title is not None:
+        yield FastaRecord(title, "".join(lines).replace(" ", ""))
+
+def reverseComplement(s):
+    return "".join([ COMPLEMENT[b] for b in reversed(s) ])
+
+def siteSearch(seq, site):
+    """Return the positions of all (possibly overlapping) occurrences of `site' in `seq'.
+`site' may contain IUPAC ambiguity codes (e.g. GCH)."""
+    pattern = "".join([ IUPAC[b] if len(IUPAC[b]) == 1 else "[" + IUPAC[b] + "]" for b in site ])
+    return [ m.start() for m in re.finditer("(?=" + pattern + ")", seq) ]
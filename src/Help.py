@@ -41,12 +41,20 @@ assumed to be the potentially-converted base. Default: CG.""")
         self.addHelp(["-o", "--open"], True, "Number of methylated sites required to open a patch.", "")
         self.addHelp(["-c", "--close"], True, "Number of unmethylated sites required to close a patch.", "")
         self.addHelp(["-x", "--strand"], True, "Strand to be examined (one of t, b, tb, bt).", "")
+        self.addHelp(["--fill-cache"], True, "Number of methylation patterns whose maps are cached (default: 10000, 0 to disable).", """
+The filled map of a read only depends on its calls at the sites, so reads with the same
+methylation pattern share the same map, which is only computed once. The log reports how
+many maps were computed and how many were reused.""")
         self.addHelp(["-w", "--weights"], True, "Weights for C positions and patches (a list of 5 numbers).", """
 The value of this option should be a comma-separated list of 5 numeric values, representing the weight of 
 open C position, open patch, undetermined, closed patch, closed C position respectively. Default: 2,1,0,-1,2.""")
 
         self.addHelp(["--map"], True, "Name of map output file.", "")
         self.addHelp(["--csv"], True, "Name of tab-delimited output file.", "")
+        self.addHelp(["-f", "--freq"], True, "Name of base frequencies output file.", """
+Frequencies are written to a separate file for each site, called SITE-FILE. If the clustering
+tree is cut into groups (--freq-groups, --cut-height), the frequencies in each group are also
+written to SITE-groups-FILE.""")
         self.addHelp(["-C", "--cluster-on"], True, "Map(s) to perform clustering on.", """
 The value of this option should be one or more nucleotide strings chosen from the ones listed in the 
 -s option. For example, if the value of -s is `CG GC', possible values for this option are `CG', `GC', 
@@ -61,6 +69,59 @@ to 1.0.""")
         self.addHelp(["-g", "--cluster-dist"], True, "Distance metric to use for clustering.", "")
         self.addHelp(["-m", "--cluster-meth"], True, "Clustering method (see cluster3 docs).", "")
         self.addHelp(["--cluster-path"], True, "Path to the cluster3 executable.", "")
+        self.addHelp(["--freq-groups"], True, "Cut the clustering tree into this number of groups.", """
+The tree is cut by repeatedly splitting the group whose root has the lowest similarity. Groups
+are numbered from 1 in display order.""")
+        self.addHelp(["--cut-height"], True, "Cut the clustering tree at this height (1 - similarity) instead.", """
+Each group is a subtree whose root has a similarity of at least 1 - H in the GTR file. With
+Euclidean and city-block distances, similarities are 1 - d/dmax, where dmax is the height of
+the root of the tree (as in cluster3), so H is always between 0 and 1.""")
+        self.addHelp(["--bootstrap"], True, "Assess the stability of the groups of reads with this number of bootstrap replicates.", """
+The groups are those obtained with --freq-groups or --cut-height, or the clusters of --order kmodes.
+Each replicate resamples the columns of the clustering matrix (or the reads, with --bootstrap-reads)
+with replacement, and clusters them again (without cluster3) in the same way. For each group, the
+mean Jaccard similarity with the most similar group of each replicate is reported, along with the
+percentage of replicates in which it is above 0.5. Replicates are run in parallel using the number
+of processes specified with --cluster-procs.""")
+        self.addHelp(["--bootstrap-reads"], False, "Resample reads instead of columns in bootstrap replicates.", "")
+        self.addHelp(["--order"], True, "Order reads with a fast method instead of clustering them (fraction, first, last, pattern, kmodes[:K]).", """
+The heatmap and CDT files are produced without a tree, and without computing distances between
+reads, so very large sets of reads can be ordered quickly. Reads are sorted by fraction of
+methylated sites (fraction), by position of the first or of the end of the last methylated
+patch (first, last), or by methylation pattern (pattern). With kmodes, reads are divided into
+K clusters (default: 8) with similar patterns, and sorted by fraction within each cluster; the
+clusters are used as groups for -f. All methods use the maps and region given by -C, -p, -q.""")
+        self.addHelp(["--cluster-engine"], True, "Program used for clustering (one of cluster3, internal; default: cluster3).", """
+With `internal', reads are clustered by methylmapper itself, without running cluster3. The
+distances between reads are computed in blocks and stored in a temporary file (see --tmpdir)
+instead of memory, so that much larger sets of reads can be clustered. Supports distances
+1, 2, 7, 8 and methods s, m, a; cluster3 is used for other distances and methods.""")
+        self.addHelp(["--cluster-procs"], True, "Number of processes computing distances with the internal engine, or running bootstrap replicates (default: 1).", "")
+        self.addHelp(["--cluster-fifo"], False, "Send the clustering matrix to cluster3 through a named pipe.", """
+The matrix is passed to cluster3 while it is being generated, instead of being written
+to a temporary file first. Only available on systems supporting named pipes (FIFOs).""")
+        self.addHelp(["--tmpdir"], True, "Directory for temporary files (default: system temporary directory).", """
+Temporary files include the clustering matrix and the output of cluster3. They are written to
+the directory specified by the TMPDIR environment variable, or /tmp, unless this option is used.""")
+        self.addHelp(["--cluster-summary"], True, "Write a summary of each group of reads to this file.", """
+The groups are those obtained with --freq-groups or --cut-height, or the clusters of --order kmodes.
+The file is tab-delimited, with one line for each group and site, containing the number and
+fraction of reads in the group, the mean methylation fraction, the consensus call at each site
+(* if at least half of the calls are methylated, # otherwise, . if there are no calls), and
+comma-separated lists of the fraction of methylated calls and of reads in a methylated patch at
+each site. The positions of the sites are listed in the header lines starting with #.""")
+        self.addHelp(["-O", "--leaf-order"], True, "Reorder the leaves of the clustering tree (one of none, mean, optimal).", """
+The order of the two subtrees joined at each node of the tree is arbitrary. With `mean', the
+subtree with the lower average value is placed first (this is what the CDTsort.py script does).
+With `optimal', subtrees are flipped so that the sum of the distances between adjacent reads
+is minimal; this requires computing all pairwise distances, and takes time proportional to the
+cube of the number of reads (about 15 seconds for 2000 reads), so it is only performed for up to
+2000 reads (larger sets are sorted by mean instead). Default: none.""")
+        self.addHelp(["--region"], True, "Only analyze this region of the reference, specified as START:END.", """
+START and END are 1-based and inclusive. The reference and all reads are cut to the region
+as soon as they are read, so mapping, clustering and plotting only process the bases in the
+region. Column headers in CSV and CDT files and positions in frequency files still refer to
+the whole reference, as do the values of -p and -q. Sites must be entirely inside the region.""")
         self.addHelp(["-d"], True, "Read only this number of reads (at random) from the input file.", "")
         self.addHelp(["-u"], False, "Remove duplicate input sequences.", """
 If supplied, sequences from the input file that are identical to already seen ones will be discarded.
@@ -71,8 +132,77 @@ Useful to display unique methylation patterns only.""")
         self.addHelp(["-n", "--unconv"], True, "Maximum number of consecutive unconverted Cs.", """
 If supplied, sequences containing this number of consecutive unconverted Cs or more will be discarded
 before starting the analysis.""")
-        self.addHelp(["--plot"], True, "Name of heatmap output file.", "")
+        self.addHelp(["--qc"], True, "Write a table of quality measures for each read to this file.", """
+The table contains, for each read: the conversion rate at non-site Cs (Cs that are not part
+of any of the detected sites, on the strands selected with -x), the number of non-site Cs with
+a call, the longest run of consecutive unconverted sites on either strand for each site, the
+fraction of Ns and gaps, and whether the read passed the QC filters (--min-conversion,
+--max-unconv-run, --max-n-fraction). A summary is written to the log.""")
+        self.addHelp(["--min-conversion"], True, "Remove reads with a lower conversion rate at non-site Cs (between 0 and 1).", "")
+        self.addHelp(["--max-unconv-run"], True, "Remove reads with this number of consecutive unconverted sites or more on either strand.", "")
+        self.addHelp(["--max-n-fraction"], True, "Remove reads with a higher fraction of Ns and gaps (between 0 and 1).", "")
+        self.addHelp(["--plot"], True, "Name of heatmap output file.", """
+The heatmap is saved as a PNG image produced by gdcreate, unless the file name ends in .svg
+or .pdf, in which case a vector image is written directly in the corresponding format.""")
+        self.addHelp(["--max-height"], True, "Maximum height of heatmap in pixels.", """
+If the heatmap would be taller than this number of pixels, rows are made thinner. When there
+are more reads than pixels, consecutive reads are merged into a single pixel row, colored
+according to the fraction of methylated calls at each position.""")
+        self.addHelp(["--prefix"], True, "Prefix for the names of all output files.", """
+The value of this option is prepended to the names of all output files (map, CSV, frequency,
+CDT/GTR and plot files). For example, `--prefix amp1/' writes all output files to the amp1
+directory, which should already exist.""")
+        self.addHelp(["--demux"], False, "Assign reads to the sequences in the reference file.", """
+If supplied, all sequences in the file specified with -r are used as references, and each read in
+the input file is assigned to one of them in a single pass. A read is assigned to the reference named
+in its header (see --demux-tag), or to the only reference with the same length, or to the reference
+of the same length sharing the largest number of k-mers with it after bisulfite conversion. Each
+reference is then analyzed separately, and the names of its output files start with the reference name.""")
+        self.addHelp(["--demux-tag"], True, "Header tag containing the reference name of each read (implies --demux).", """
+For example, with `--demux-tag amplicon=', a read whose header contains `amplicon=amp1' is assigned
+to the reference sequence called amp1.""")
+        self.addHelp(["--batch"], True, "Process all amplicons listed in this manifest file.", """
+The manifest is a tab-delimited file with one line for each amplicon, containing: the reference
+FASTA file, the reads FASTA file, the prefix for the output files, and optionally additional
+command-line options for this amplicon (separated by spaces). Lines starting with # are ignored.
+All other options given on the command line apply to all amplicons. Amplicons are processed by
+a single methylmapper process (or by the number of worker processes specified with -j), and a
+table of read counts and runtimes for each amplicon is written at the end.""")
+        self.addHelp(["-j", "--jobs"], True, "Number of worker processes in batch mode (default: 1).", "")
+        self.addHelp(["--summary"], True, "Write batch mode summary table to this file (default: standard output).", "")
         self.addHelp(["-z"], False, "Display gaps and Ns as white in heatmap.", "")
+        self.addHelp(["--patterns"], True, "Write the most frequent methylation patterns (epialleles) to this file.", """
+The pattern of a read is its list of calls at all sites: methylated (*), unmethylated (#), or
+no call (.) when the read does not contain C/T (G/A on the bottom strand) at the site. The file
+is tab-delimited, with the rank, count and fraction of reads of each pattern, followed by the
+pattern for each site. Patterns are counted before duplicate removal with -U.""")
+        self.addHelp(["--patterns-top"], True, "Number of patterns written by --patterns, 0 for all (default: 20).", "")
+        self.addHelp(["--read-summary"], True, "Write statistics on the map of each read to this file (one for each site).", """
+Statistics are written to a separate file for each site, called SITE-FILE, containing for each
+read: the number of methylated and unmethylated sites, the fraction of methylated sites, and the
+number, total length and maximum length of methylated (+) and unmethylated (-) patches, followed
+by the lists of patches as START-END (1-based positions in the reference). A patch includes the
+sites inside it and the sites that open and close it; adjacent sites with no positions between
+them form a patch if there are at least -o of them, as in --cluster-summary. If the file name
+ends in .npz, statistics are saved in NumPy format instead, with one array for each column and
+a `patches' array containing the read index, kind (1 for +, -1 for -), start and end (0-based,
+end excluded) of each patch. Statistics are computed while the maps are scaled.""")
+        self.addHelp(["--store"], True, "Keep the maps of all reads processed so far in this file (incremental mode).", """
+If the file exists, the reads it contains are loaded from it and the reads in the input file
+are added to them: only the new reads are mapped, and all outputs (maps, frequencies, CDT files,
+heatmap) are produced for all reads. The file is then updated. Reads identical to a read already
+in the store are skipped, and new reads with the same name as an existing read are renamed by
+adding a suffix (_2, _3, ...). All runs using the same store must use the same reference sequence,
+sites, strands, open/close values and weights.""")
+        self.addHelp(["--attach"], False, "In incremental mode, attach new reads to the existing tree instead of clustering all reads.", """
+Each new read is placed next to the most similar read already in the tree, so the order of
+the existing reads does not change. Use a normal run with --store to cluster all reads again.""")
+        self.addHelp(["--profile"], False, "Report time and memory used by each stage of the analysis.", """
+For each stage (reading, maps, output, clustering...) the log reports wall-clock time, CPU time,
+reads per second, and the peak memory (resident set size) used by the process so far.""")
+        self.addHelp(["--profile-json"], True, "Write the stage timings to this file in JSON format (implies --profile).", "")
+        self.addHelp(["--profile-dump"], True, "Write cProfile statistics to this file (implies --profile).", """
+The file can be examined with the pstats module, e.g. python -m pstats FILE.""")
 
     def shortHelp(self):
         sys.stdout.write("metyhlmapper.py - Generate and plot methylation maps.\n\nOptions:\n\n")
@@ -0,0 +1,120 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import sys
+import numpy as np
+
+from CDTsort import GTree
+from Utils import WARNING
+
+### Optimal leaf ordering (Bar-Joseph, Gifford, Jaakkola 2001): flip the children
+### of the nodes of a tree so that the sum of the distances between adjacent
+### leaves is minimal.
+
+def distanceMatrix(data, dist="7", other=None):
+    """Return the matrix of pairwise distances between the rows of `data' (or between
+the rows of `data' and those of `other', if specified), using the cluster3 distance
+code `dist' (1=uncentered correlation, 2=Pearson correlation, 7=Euclidean, 8=city-block).
+As in cluster3, the Euclidean distance is the mean squared difference and the city-block
+distance is the mean absolute difference."""
+    data = np.asarray(data, dtype=float)
+    other = data if other is None else np.asarray(other, dtype=float)
+    ncols = float(max(data.shape[1], 1))
+    if dist in ["1", "2"]:
+        def normalize(x):
+            if dist == "2":
+                x = x - x.mean(axis=1)[:, None]
+            norms = np.sqrt((x * x).sum(axis=1))
+            norms[norms == 0] = 1.0
+            return x / norms[:, None]
+        return 1.0 - normalize(data).dot(normalize(other).T)
+    elif dist == "8":
+        D = np.zeros((data.shape[0], other.shape[0]))
+        for i in range(data.shape[0]):
+            D[i] = np.abs(other - data[i]).sum(axis=1) / ncols
+        return D
+    if dist != "7":
+        sys.stderr.write(WARNING + "Distance {} not supported, using Euclidean distance.\n".format(dist))
+    sq1 = (data * data).sum(axis=1)
+    sq2 = (other * other).sum(axis=1)
+    D = sq1[:, None] + sq2[None, :] - 2 * data.dot(other.T)
+    return np.maximum(D, 0) / ncols
+
+def minplus(X, Y):
+    """Min-plus product of matrices `X' (a x b) and `Y' (b x c). Returns the result
+and, for each cell, the index in 0..b-1 that achieves the minimum."""
+    result = X[:, 0, None] + Y[None, 0, :]
+    args = np.zeros(result.shape, dtype=int)
+    for k in range(1, X.shape[1]):
+        new = X[:, k, None] + Y[None, k, :]
+        better = new < result
+        result[better] = new[better]
+        args[better] = k
+    return (result, args)
+
+def optimalOrder(branches, index, D):
+    """Reorder the tree described by `branches' to minimize the sum of the distances
+between adjacent leaves. `index' maps each leaf to its row in the distance matrix `D'.
+Returns a tuple containing the reordered branches (in post-order) and the list of
+leaves in the new order."""
+    G = GTree(branches=branches)
+    if not G.root:
+        return (branches, list(index.keys()))
+
+    # For each node we compute the cost M[i, j] of the best ordering of its leaves
+    # starting with leaf i and ending with leaf j (i in the left subtree, j in the
+    # right one, or vice versa), remembering which pair of adjacent leaves (k, m)
+    # across the two subtrees realizes it. Cost matrices are discarded as soon as
+    # the parent has been computed; the (k, m) tables take O(N^2) space overall.
+    costs = {}
+    choices = {}
+    sizes = {}
+    for node in G.postorder():
+        parts = []
+        for c in [node.left, node.right]:
+            if c in G.nodes:
+                parts.append(costs.pop(c))
+            else:
+                parts.append((np.array([index[c]]), np.zeros((1, 1))))
+                sizes[c] = 1
+        ((ll, ML), (rl, MR)) = parts
+        (A, argA) = minplus(ML, D[np.ix_(ll, rl)])
+        (B, argB) = minplus(A, MR)
+        K = argA[np.arange(len(ll))[:, None], argB]
+        choices[node.name] = (K, argB)
+        nl = len(ll)
+        n = nl + len(rl)
+        M = np.full((n, n), np.inf)
+        M[:nl, nl:] = B
+        M[nl:, :nl] = B.T
+        costs[node.name] = (np.concatenate([ll, rl]), M)
+        sizes[node.name] = n
+
+    (allLeaves, M) = costs.pop(G.root)
+    (a, b) = np.unravel_index(np.argmin(M), M.shape)
+
+    # Rebuild the ordering; (a, b) are the positions of the first and last leaf
+    # in the list of leaves of each node.
+    leaves = []
+    stack = [(G.root, a, b)]
+    while stack:
+        (name, a, b) = stack.pop()
+        if name not in G.nodes:
+            leaves.append(name)
+            continue
+        node = G.nodes[name]
+        nl = sizes[node.left]
+        (K, argB) = choices[name]
+        if a < nl:
+            k = K[a, b - nl]
+            m = argB[a, b - nl]
+            stack.append((node.right, m, b - nl))
+            stack.append((node.left, a, k))
+        else:
+            k = K[b, a - nl]
+            m = argB[b, a - nl]
+            stack.append((node.left, k, b))
+            stack.append((node.right, a - nl, m))
+
+    G.orient(leaves)
+    return (G.branches(), leaves)
@@ -0,0 +1,138 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import numpy as np
+
+import MethMap
+import Patterns
+import RefSequence
+import CDTsort
+import Linkage
+import LeafOrder
+
+### Library interface. mapReads() and cluster() perform the same computations as
+### the methylmapper command, but take and return in-memory objects: they do not
+### read or write files, run cluster3, write to stderr, or keep any state between
+### calls, so they can be called repeatedly from long-running programs.
+###
+###   import Library
+###   result = Library.mapReads(refseq, reads, sites=["CG", "GC"])
+###   (order, tree) = Library.cluster(result, sites=["CG"], leafOrder="optimal")
+###   heatmap = result.scaled["CG"][order]
+
+STRANDS = {"t": (True, False), "b": (False, True), "tb": (True, True), "bt": (True, True)}
+
+class MapResult():
+    """Methylation maps for a set of reads. For each site, `maps' contains an array of
+map characters (one row per read, one column per reference position), `values' the
+corresponding numeric values, and `scaled' the values scaled by patch length."""
+    names = []                  # Read names, in input order
+    sites = []
+    length = 0                  # Length of reference sequence
+    patterns = []               # Methylation pattern of each read at all sites, packed as in Patterns
+    positions = {}              # Site => array of the positions of the C in each site
+    maps = {}                   # Site => array of map characters (nreads x length)
+    values = {}                 # Site => array of map values
+    scaled = {}                 # Site => array of scaled map values (float32)
+
+    def __init__(self, names, sites, length):
+        self.names = names
+        self.sites = sites
+        self.length = length
+        self.patterns = [ 0 for _ in names ]
+        self.positions = {}
+        self.maps = {}
+        self.values = {}
+        self.scaled = {}
+
+    def nreads(self):
+        return len(self.names)
+
+def readName(rec, i):
+    return getattr(rec, "id", None) or "read{}".format(i + 1)
+
+def mapReads(reference, reads, sites=None, openMin=2, closeMin=1, strands="t", weights=None):
+    """Compute the methylation maps of `reads' (a list of strings or SeqRecords, all as long
+as `reference') for each site in `sites' (default: CG). `openMin' and `closeMin' are the
+number of sites required to open and close a patch, `strands' is one of t, b, tb, bt, and
+`weights' is a list of 5 values for the map characters. Returns a MapResult."""
+    sites = sites or ["CG"]
+    if strands not in STRANDS:
+        raise ValueError("Strands should be one of t, b, tb, bt.")
+    (top, bottom) = STRANDS[strands]
+    refseq = str(getattr(reference, "seq", reference))
+    seqs = [ str(getattr(r, "seq", r)) for r in reads ]
+    names = [ readName(r, i) for (i, r) in enumerate(reads) ]
+    for (name, seq) in zip(names, seqs):
+        if len(seq) != len(refseq):
+            raise ValueError("Length of read {} ({}) does not match reference length ({}).".format(name, len(seq), len(refseq)))
+
+    result = MapResult(names, list(sites), len(refseq))
+    for site in sites:
+        mref = RefSequence.RefSequence(refseq, site, verbose=False)
+        mmap = MethMap.MethMap(site, mref, weights=weights)
+        mmap.openMin = openMin
+        mmap.closeMin = closeMin
+        mmap.top = top
+        mmap.bottom = bottom
+        nsites = mref.nsites(top, bottom)
+        fmaps = []
+        vects = []
+        for (i, seq) in enumerate(seqs):
+            (basemap, pattern) = mref.makeMapString(seq, top=top, bottom=bottom)
+            result.patterns[i] = Patterns.combine(result.patterns[i], pattern, nsites)
+            (fmap, vect) = mmap.fillPattern(basemap, pattern)
+            fmaps.append(fmap)
+            vects.append(vect)
+        shape = (len(seqs), len(refseq))
+        result.positions[site] = np.array(mmap.allPositions(), dtype=int)
+        result.maps[site] = np.array([ list(f) for f in fmaps ], dtype="U1").reshape(shape)
+        result.values[site] = np.array(vects, dtype=float).reshape(shape)
+        result.scaled[site] = MethMap.scaleMatrix(fmaps, vects).reshape(shape)
+    return result
+
+def clusterMatrix(result, sites=None, weights=None, start=0, end=None):
+    """Return the matrix used for clustering: the scaled values of the maps for `sites',
+each multiplied by its (normalized) weight, in the region [start, end)."""
+    sites = sites or result.sites[:1]
+    for s in sites:
+        if s not in result.scaled:
+            raise ValueError("Unknown site for clustering: {}.".format(s))
+    if not weights or len(weights) != len(sites):
+        weights = [ 1.0 for _ in sites ]
+    tot = float(sum(weights))
+    end = end or result.length
+    if end <= start:
+        raise ValueError("Clustering region [{}, {}] is empty.".format(start + 1, end))
+    return np.hstack([ result.scaled[s][:, start:end] * (w / tot) for (s, w) in zip(sites, weights) ])
+
+def cluster(result, sites=None, weights=None, start=0, end=None, dist="7", method="m", leafOrder=None):
+    """Cluster the reads in MapResult `result', using the maps for `sites' (default: the
+first site) with the specified `weights' in the region [start, end). `dist' and `method'
+are cluster3 codes (distance: 1, 2, 7, 8; method: s, m, a), and `leafOrder' can be None,
+"mean" or "optimal" as in Clusterer. Returns a tuple containing an array with the read
+indices in display order, and the tree as an array of (left, right, distance) rows, in
+which reads are numbered 0..N-1 and the node created by row k is numbered N+k."""
+    if dist not in ["1", "2", "7", "8"]:
+        raise ValueError("Distance should be one of 1, 2, 7, 8.")
+    if leafOrder not in [None, "none", "mean", "optimal"]:
+        raise ValueError("Leaf order should be one of none, mean, optimal.")
+    data = clusterMatrix(result, sites, weights, start, end)
+    n = data.shape[0]
+    if n < 2:
+        return (np.arange(n), np.zeros((0, 3)))
+    D = LeafOrder.distanceMatrix(data, dist)
+    merges = Linkage.nnChain(D, method)
+    branches = Linkage.toBranches(merges, n, dist)
+    if leafOrder == "mean":
+        means = data.mean(axis=1)
+        (branches, leaves) = CDTsort.sortTree(branches, dict([ ("GENE{}X".format(i), means[i]) for i in range(n) ]))
+    elif leafOrder == "optimal":
+        index = dict([ ("GENE{}X".format(i), i) for i in range(n) ])
+        (branches, leaves) = LeafOrder.optimalOrder(branches, index, D)
+    else:
+        leaves = CDTsort.GTree(branches=branches).leaves()
+    children = dict([ (node, (l, r)) for (node, l, r) in Linkage.fromBranches(branches, n) ])
+    tree = np.array([ children[n + k] + (merges[k][2],) for k in range(len(merges)) ], dtype=float)
+    order = np.array([ int(g[4:-1]) for g in leaves ], dtype=int)
+    return (order, tree)
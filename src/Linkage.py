@@ -0,0 +1,210 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import numpy as np
+
+### Hierarchical clustering using the nearest-neighbor chain algorithm (O(N^2) time).
+### The distance matrix can be held in memory, or in a memory-mapped file on disk
+### (CondensedMatrix) for sets of reads too large for the matrix to fit in memory.
+### Method codes are the same as cluster3's: s=single, m=complete (maximum), a=average
+### linkage. Centroid linkage (c) is not supported, since it does not satisfy the
+### reducibility property the algorithm relies on.
+
+METHODS = ["s", "m", "a"]
+
+class DenseMatrix():
+    """Distance matrix of n items held in memory as an n x n array."""
+    D = None
+
+    def __init__(self, D):
+        self.D = np.array(D, dtype=float)
+
+    def size(self):
+        return self.D.shape[0]
+
+    def row(self, a):
+        return self.D[a].copy()
+
+    def setRow(self, a, values):
+        self.D[a, :] = values
+        self.D[:, a] = values
+
+class CondensedMatrix():
+    """Distance matrix of n items stored in condensed form (the upper triangle, row by
+row, as float32) in memory-mapped file `filename', so that it does not need to fit in
+memory. Use mode="r+" to open an existing file."""
+    n = 0
+    data = None
+
+    def __init__(self, filename, n, mode="w+"):
+        self.n = n
+        self.data = np.memmap(filename, dtype=np.float32, mode=mode, shape=(max(n * (n - 1) // 2, 1),))
+
+    def size(self):
+        return self.n
+
+    def index(self, i, j):
+        """Position of the distance between items `i' and `j' (i < j; arrays are allowed) in the file."""
+        return self.n * i - i * (i + 1) // 2 + (j - i - 1)
+
+    def row(self, a):
+        result = np.empty(self.n, dtype=float)
+        if a > 0:
+            result[:a] = self.data[self.index(np.arange(a, dtype=np.int64), a)]
+        start = self.index(a, a + 1)
+        result[a+1:] = self.data[start:start + self.n - a - 1]
+        return result
+
+    def setRow(self, a, values):
+        if a > 0:
+            self.data[self.index(np.arange(a, dtype=np.int64), a)] = values[:a]
+        start = self.index(a, a + 1)
+        self.data[start:start + self.n - a - 1] = values[a+1:]
+
+    def flush(self):
+        self.data.flush()
+
+def distanceBlock(args):
+    """Worker for condensedDistances: compute the rows [start, end) of the matrix."""
+    import LeafOrder
+    (filename, n, start, end, dist) = args
+    C = CondensedMatrix(filename, n, mode="r+")
+    data = BLOCKDATA
+    D = LeafOrder.distanceMatrix(data[start:end], dist, data[start:])
+    for i in range(start, min(end, n - 1)):
+        k = C.index(i, i + 1)
+        C.data[k:k + n - i - 1] = D[i - start, i - start + 1:]
+    C.flush()
+    return end - start
+
+BLOCKDATA = None                # Data matrix shared with the worker processes of condensedDistances
+
+def setBlockData(data):
+    global BLOCKDATA
+    BLOCKDATA = data
+
+def condensedDistances(data, filename, dist="7", nprocs=1, blocksize=None):
+    """Compute the pairwise distances between the rows of `data' (using the cluster3 distance
+code `dist', see LeafOrder.distanceMatrix) into a CondensedMatrix stored in `filename'. Rows
+are processed in blocks of `blocksize' rows (by default, blocks of about 8 million distances),
+using `nprocs' worker processes. Returns the CondensedMatrix."""
+    import multiprocessing
+
+    data = np.asarray(data, dtype=float)
+    n = data.shape[0]
+    C = CondensedMatrix(filename, n)
+    del C.data                  # Close the file before the workers open it
+    blocksize = blocksize or max(1, 8000000 // max(n, 1))
+    jobs = [ (filename, n, start, min(start + blocksize, n), dist) for start in range(0, n, blocksize) ]
+    if nprocs > 1 and multiprocessing.current_process().daemon:
+        nprocs = 1              # Daemonic processes (e.g. batch mode workers) cannot have children
+    if nprocs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(nprocs, initializer=setBlockData, initargs=(data,))
+        try:
+            pool.map(distanceBlock, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        setBlockData(data)
+        try:
+            for job in jobs:
+                distanceBlock(job)
+        finally:
+            setBlockData(None)
+    return CondensedMatrix(filename, n, mode="r+")
+
+def nnChain(D, method="m"):
+    """Cluster the items whose pairwise distances are in `D', either a matrix or a
+CondensedMatrix (which is modified). Returns a list of (left, right, distance) merges
+sorted by distance, in which items are numbered 0..N-1 and the node created by the
+k-th merge is numbered N+k."""
+    if method not in METHODS:
+        raise ValueError("Clustering method should be one of {}.".format(", ".join(METHODS)))
+    M = D if isinstance(D, CondensedMatrix) else DenseMatrix(D)
+    n = M.size()
+    size = np.ones(n)
+    active = np.ones(n, dtype=bool)
+    ids = list(range(n))        # Id of the cluster currently stored in each row
+    merges = []                 # (left id, right id, distance, new id)
+    chain = []
+    rows = {}                   # Rows of the last two elements of the chain
+    nextid = n
+    free = 0                    # All rows before this one are inactive
+
+    def getRow(c):
+        if c not in rows:
+            row = M.row(c)
+            row[~active] = np.inf
+            row[c] = np.inf
+            rows[c] = row
+        return rows[c]
+
+    while len(merges) < n - 1:
+        if not chain:
+            while not active[free]:
+                free += 1
+            chain.append(free)
+        a = chain[-1]
+        row = getRow(a)
+        b = int(np.argmin(row))
+        if len(chain) > 1 and row[chain[-2]] <= row[b]:
+            b = chain[-2]       # Prefer the previous element in case of ties
+        if len(chain) > 1 and b == chain[-2]:
+            chain.pop()
+            chain.pop()
+            rowa = rows.pop(a)
+            rowb = getRow(b)
+            rows.pop(b)
+            d = rowa[b]
+            if method == "s":
+                new = np.minimum(rowa, rowb)
+            elif method == "m":
+                new = np.maximum(rowa, rowb)
+            else:
+                new = (size[a] * rowa + size[b] * rowb) / (size[a] + size[b])
+            active[b] = False
+            new[a] = np.inf
+            new[b] = np.inf
+            M.setRow(a, new)
+            for (c, rowc) in rows.items():
+                rowc[a] = new[c]
+                rowc[b] = np.inf
+            size[a] += size[b]
+            merges.append((ids[a], ids[b], d, nextid))
+            ids[a] = nextid
+            ids[b] = None
+            nextid += 1
+        else:
+            chain.append(b)
+            if len(chain) > 2:
+                rows.pop(chain[-3], None)
+
+    # Merges are found out of order: sort them by distance and renumber the nodes.
+    # Since linkage is monotonic, children are still created before their parents.
+    merges.sort(key=lambda m: m[2])
+    newids = {}
+    result = []
+    for (k, (l, r, d, old)) in enumerate(merges):
+        newids[old] = n + k
+        result.append((newids.get(l, l), newids.get(r, r), d))
+    return result
+
+def toBranches(merges, n, dist="7"):
+    """Convert `merges' (as returned by nnChain) to GTR-style [node, left, right, similarity] branches.
+As cluster3 does, for Euclidean and city-block distances (`dist' 7 or 8) the merge distances
+are divided by the largest one, so that similarities are between 0 and 1 for all distances."""
+    def name(i):
+        return "GENE{}X".format(i) if i < n else "NODE{}X".format(i - n + 1)
+    scale = 1.0
+    if dist in ["7", "8"] and merges:
+        scale = max([ d for (l, r, d) in merges ]) or 1.0
+    return [ [name(n + k), name(l), name(r), "{:.6f}".format(1.0 - d / scale)] for (k, (l, r, d)) in enumerate(merges) ]
+
+def fromBranches(branches, n):
+    """Inverse of toBranches: returns a list of (node, left, right) triples, using the numbering of nnChain."""
+    def number(s):
+        if s.startswith("GENE"):
+            return int(s[4:-1])
+        return int(s[4:-1]) + n - 1
+    return [ (number(br[0]), number(br[1]), number(br[2])) for br in branches ]
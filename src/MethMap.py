@@ -5,8 +5,11 @@
 
 import sys
 import shutil
+import tempfile
+from collections import OrderedDict
 
-from Utils import parseLine, OUTPUT, CLUSTER
+import Patterns
+from Utils import parseLine, OUTPUT, CLUSTER, MAPS
 
 ### Utils
 
@@ -30,39 +33,238 @@ class Block():
     def __str__(self):
         return "<Block {}{}{}-{}>".format(self.n, self.char, self.start, self.end)
 
-class BaseFreq():
-    pos = 0
-    n = 0
-    counts = {}
-
-    def __init__(self, pos):
-        self.pos = pos
-        self.n = 0
-        self.counts = {'A': 0, 'C': 0, 'G': 0, 'T': 0}
-    
-    def base(self, b):
-        b = b.upper()
-        if b in "ACGT":
-            self.n += 1
-            self.counts[b] += 1
-
-    def writeRow(self, out):
-        if self.n > 0:
-            out.write("{}\t{}\t{}\t{}\t{}\n".format(self.pos, 
-                                                    1.0 * self.counts['A'] / self.n,
-                                                    1.0 * self.counts['C'] / self.n,
-                                                    1.0 * self.counts['G'] / self.n,
-                                                    1.0 * self.counts['T'] / self.n))
+def baseCounts(sequences, length, groups=None, ngroups=1, chunk=10000):
+    """Count the bases at each position of `sequences'. Returns an array of shape (ngroups, length, 4)
+containing the number of A, C, G, T (in either case) at each position. If `groups' is specified,
+it should contain the group number (0..ngroups-1) of each sequence, and counts are computed
+separately for each group. Sequences are processed in chunks of `chunk' reads."""
+    import numpy as np
+
+    table = np.full(256, 4, dtype=np.intp)
+    for (i, b) in enumerate("ACGT"):
+        table[ord(b)] = i
+        table[ord(b.lower())] = i
+    offsets = np.arange(length, dtype=np.intp) * 5
+    counts = np.zeros(ngroups * length * 5, dtype=np.int64)
+    for start in range(0, len(sequences), chunk):
+        block = sequences[start:start+chunk]
+        data = "".join([ str(s.seq)[:length].ljust(length, "N") for s in block ])
+        codes = table[np.frombuffer(data.encode("ascii", "replace"), dtype=np.uint8)].reshape(len(block), length)
+        codes += offsets
+        if groups is not None:
+            codes += np.asarray(groups[start:start+chunk], dtype=np.intp)[:, None] * (length * 5)
+        counts += np.bincount(codes.ravel(), minlength=counts.size)
+    return counts.reshape(ngroups, length, 5)[:, :, :4]
+
+def patchRuns(codes):
+    """Find the patches (runs of + or - characters) in the array of map characters `codes'.
+Returns the array of patch characters (0 outside patches), a boolean array marking the
+first position of each run, and the length of the run containing each position."""
+    import numpy as np
+
+    patch = np.where((codes == ord('+')) | (codes == ord('-')), codes, 0)
+    runstart = np.ones(patch.shape, dtype=bool)
+    runstart[:, 1:] = patch[:, 1:] != patch[:, :-1]
+    runs = np.cumsum(runstart.ravel()) - 1
+    runlen = np.bincount(runs)[runs].reshape(patch.shape)
+    return (patch, runstart, runlen)
+
+def patchRegions(codes, openMin=2):
+    """Find the patches in the array of map characters `codes' (one row per map). A patch is
+a run of methylated (* or +) or unmethylated (# or -) positions containing at least one + or -,
+or at least `openMin' (adjacent) sites, so the site calls inside a patch are part of it. Returns
+the row, kind (1 for methylated, -1 for unmethylated), start and end (exclusive) of each patch
+as four arrays, ordered by row and start."""
+    import numpy as np
+
+    sites = (codes == ord('*')) | (codes == ord('#'))
+    fill = (codes == ord('+')) | (codes == ord('-'))
+    region = ((codes == ord('*')) | (codes == ord('+'))).astype(np.int8) - ((codes == ord('#')) | (codes == ord('-')))
+    runstart = np.ones(region.shape, dtype=bool)
+    runstart[:, 1:] = region[:, 1:] != region[:, :-1]
+    runs = np.cumsum(runstart.ravel()) - 1
+    runlen = np.bincount(runs)
+    nsites = np.bincount(runs, weights=sites.ravel(), minlength=len(runlen))
+    nfill = np.bincount(runs, weights=fill.ravel(), minlength=len(runlen))
+    # Runs are numbered in the same order as their first positions
+    (rows, cols) = np.nonzero(runstart)
+    kind = region[rows, cols].astype(int)
+    keep = (kind != 0) & ((nfill > 0) | (nsites >= openMin))
+    return (rows[keep], kind[keep], cols[keep], (cols + runlen)[keep])
+
+def scaleMatrix(fmaps, values, chunk=10000, stats=None, dtype="float32"):
+    """Scale the map values in `values' (one row for each filled map in `fmaps'): the value
+at each position of a patch (a run of + or - characters) is divided by the length of the
+run. Returns an array of shape (len(fmaps), length) of type `dtype'. Maps are processed in
+chunks of `chunk' rows. If `stats' (a ReadStats object) is specified, the statistics of each
+map are added to it at the same time."""
+    import numpy as np
+
+    scaled = np.array(values, dtype=dtype, ndmin=2)
+    if len(fmaps) == 0:
+        return scaled.reshape(0, 0)
+    length = scaled.shape[1]
+    for start in range(0, len(fmaps), chunk):
+        block = fmaps[start:start+chunk]
+        codes = np.frombuffer("".join(block).encode("ascii"), dtype=np.uint8).reshape(len(block), length)
+        (patch, runstart, runlen) = patchRuns(codes)
+        scaled[start:start+len(block)] /= np.where(patch > 0, runlen, 1)
+        if stats is not None:
+            stats.addBlock(codes)
+    return scaled
+
+class ReadStats():
+    """Per-read summary of the filled maps of a site (--read-summary): number of methylated
+and unmethylated sites, and position and length of each methylated (+) and unmethylated (-)
+patch. Maps are added in blocks by scaleMatrix() (or by addMaps()), in mapstrings order."""
+    openMin = 2                 # Number of adjacent sites forming a patch without fill characters
+    nreads = 0
+    meth = []                   # Number of methylated sites in each read, one array per block
+    unmeth = []                 # Number of unmethylated sites in each read, one array per block
+    patches = []                # Arrays of (read, kind, start, end) rows, kind is 1 for methylated and -1 for unmethylated, end is exclusive
+
+    def __init__(self, openMin=2):
+        self.openMin = openMin
+        self.reset()
+
+    def reset(self):
+        self.nreads = 0
+        self.meth = []
+        self.unmeth = []
+        self.patches = []
+
+    def addBlock(self, codes):
+        """Add the maps in `codes' (an array of map characters with one row per map). Patches
+are found by patchRegions()."""
+        import numpy as np
+
+        self.meth.append((codes == ord('*')).sum(axis=1))
+        self.unmeth.append((codes == ord('#')).sum(axis=1))
+        (rows, kind, start, end) = patchRegions(codes, self.openMin)
+        self.patches.append(np.column_stack((rows + self.nreads, kind, start, end)).astype(np.int32))
+        self.nreads += codes.shape[0]
+
+    def addMaps(self, fmaps, chunk=10000):
+        """Add the filled maps `fmaps' (strings of the same length)."""
+        import numpy as np
+
+        for start in range(0, len(fmaps), chunk):
+            block = fmaps[start:start+chunk]
+            codes = np.frombuffer("".join(block).encode("ascii"), dtype=np.uint8).reshape(len(block), len(block[0]))
+            self.addBlock(codes)
+
+    def arrays(self):
+        """Return the statistics as a dictionary of arrays with one element per read, and the
+array of all patches (one row per patch, sorted by read and start position)."""
+        import numpy as np
+
+        meth = np.concatenate(self.meth) if self.meth else np.zeros(0, dtype=int)
+        unmeth = np.concatenate(self.unmeth) if self.unmeth else np.zeros(0, dtype=int)
+        patches = np.vstack(self.patches) if self.patches else np.zeros((0, 4), dtype=np.int32)
+        result = {"meth": meth, "unmeth": unmeth}
+        for (kind, label) in [(1, "plus"), (-1, "minus")]:
+            sel = patches[patches[:, 1] == kind]
+            lens = sel[:, 3] - sel[:, 2]
+            result["n" + label] = np.bincount(sel[:, 0], minlength=self.nreads)
+            result[label + "len"] = np.bincount(sel[:, 0], weights=lens, minlength=self.nreads).astype(int)
+            maxlen = np.zeros(self.nreads, dtype=int)
+            if len(sel):
+                first = np.concatenate(([0], np.nonzero(np.diff(sel[:, 0]))[0] + 1))
+                maxlen[sel[first, 0]] = np.maximum.reduceat(lens, first)
+            result["max" + label] = maxlen
+        return (result, patches)
+
+    def save(self, filename, names, offset=0):
+        """Save the statistics for the reads `names' to `filename' in NumPy .npz format. Patch
+positions are 0-based reference coordinates (`offset' is added to them)."""
+        import numpy as np
+
+        (result, patches) = self.arrays()
+        patches = patches.copy()
+        patches[:, 2:] += offset
+        result["names"] = np.array(names, dtype=str)
+        result["patches"] = patches
+        with open(filename, "wb") as out:
+            np.savez_compressed(out, **result)
+
+    def writeTable(self, out, names, offset=0):
+        """Write the statistics for the reads `names' to stream `out' as a tab-delimited table.
+Patches are written as comma-separated lists of START-END (1-based reference coordinates)."""
+        import numpy as np
+
+        (result, patches) = self.arrays()
+        bounds = np.searchsorted(patches[:, 0], np.arange(self.nreads + 1))
+        out.write("Read\tMeth\tUnmeth\tFraction\tNPlus\tPlusLen\tMaxPlus\tNMinus\tMinusLen\tMaxMinus\tPlusPatches\tMinusPatches\n")
+        for (i, name) in enumerate(names):
+            (m, u) = (result["meth"][i], result["unmeth"][i])
+            rp = patches[bounds[i]:bounds[i+1]]
+            lists = [ ",".join([ "{}-{}".format(a + offset + 1, b + offset) for (a, b) in rp[rp[:, 1] == kind, 2:].tolist() ]) for kind in [1, -1] ]
+            out.write("{}\t{}\t{}\t{:.4f}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
+                name, m, u, float(m) / (m + u) if m + u else 0.0,
+                result["nplus"][i], result["pluslen"][i], result["maxplus"][i],
+                result["nminus"][i], result["minuslen"][i], result["maxminus"][i],
+                lists[0] or ".", lists[1] or "."))
+
+def writeFreqRows(out, counts, positions, group=None, offset=0):
+    """Write the base frequencies and coverage at `positions' (skipping uncovered positions).
+`offset' is added to each position when writing it."""
+    for p in positions:
+        (a, c, g, t) = [ int(x) for x in counts[p] ]
+        n = a + c + g + t
+        if n > 0:
+            if group is not None:
+                out.write("{}\t".format(group))
+            out.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(p + offset, 1.0 * a / n, 1.0 * c / n, 1.0 * g / n, 1.0 * t / n, n))
+
+class MapWriter():
+    """Write maps in text format (--map) while they are computed. The map of each read is
+written to a temporary file for its site as soon as it is built, and the sections for all
+sites are concatenated into the output file by close(), so the maps do not need to be
+kept in memory as lists of characters."""
+    fstr = "{:9} |{}\n"
+    sections = []               # (site, header, temporary file) for each map
+
+    tmpdir = None               # Directory for temporary files (default: system temporary directory)
+
+    def __init__(self, namelen=9, tmpdir=None):
+        self.fstr = "{:" + str(namelen) + "} |{}\n"
+        self.sections = []
+        self.tmpdir = tmpdir
+
+    def addSection(self, m):
+        """Start the section for MethMap `m'. Its rows are written by addRow()."""
+        header = "## " + m.site + "\n" + self.fstr.format("Reference", m.ref.sequence) + self.fstr.format("Sites", m.sitesToString())
+        self.sections.append((m.site, header, tempfile.TemporaryFile(mode="w+", dir=self.tmpdir)))
+
+    def addRow(self, site, name, fmap):
+        for (s, header, spill) in self.sections:
+            if s == site:
+                spill.write(self.fstr.format(name, fmap))
+                return
+
+    def close(self, filename):
+        """Write all sections to `filename' and remove the temporary files."""
+        with open(filename, "w") as out:
+            for (site, header, spill) in self.sections:
+                out.write(header)
+                spill.seek(0)
+                shutil.copyfileobj(spill, out)
+                out.write("\n")
+        self.discard()
+
+    def discard(self):
+        for (site, header, spill) in self.sections:
+            spill.close()
+        self.sections = []
 
 class MethMap():
     site = ""
     ref = None
-    mapstrings = []
+    mapstrings = []             # (name, map string) for each read
     mapvectors = {}
-    sclvectors = {}
+    sclvectors = {}             # Read name => row of sclmatrix
+    sclmatrix  = None           # Scaled values of all maps (float32, rows in the same order as mapstrings)
     origvectors = {}
-    sitefreqs  = {}    # frequencies for C positions in sites
-    otherfreqs = {}    # frequencies for other C positions
     positions  = []
     weights    = [2.0, 1.0, 0.0, -1.0, -2.0] # , 0.0]
     charvalues = {'*': 2.0, '+': 1.0, ' ': 0.0, '-': -1.0, '#': -2.0} #, '_': 0.0}
@@ -74,11 +276,21 @@ class MethMap():
     closeMin = 1
     top      = True
     bottom   = True
+    cacheSize = 10000           # Maximum number of site-call patterns in fillCache, 0 to disable
+    offset   = 0                # Position of the first map column in the reference (--region)
+
+    # Filled maps by site-call pattern (see fillPattern)
+    fillCache   = None
+    cacheHits   = 0
+    cacheMisses = 0
 
     # Files
+    prefix  = ""                # prepended to the names of all output files
     csvfile = None              # added by writeMapCSV
     cdtfile = None              # added by Clusterer
     gtrfile = None              # added by Clusterer
+    writer  = None              # MapWriter receiving each map as it is computed (--map)
+    readStats = None            # ReadStats receiving the statistics of each map as it is computed (--read-summary)
 
     def __init__(self, site, ref, weights=None, white=False):
         self.site = site 
@@ -86,23 +298,13 @@ class MethMap():
         self.mapstrings = []
         self.mapvectors = {}
         self.sclvectors = {}
-        self.sitefreqs  = {}
-        self.otherfreqs = {}
         self.positions  = []
+        self.charvalues = dict(self.charvalues)
         self.white = white
-        for p in ref.cpositionsTop:
-            self.sitefreqs[p] = BaseFreq(p)
-            self.positions.append(p)
-        for p in ref.cpositionsBot:
-            self.sitefreqs[p] = BaseFreq(p)
-            self.positions.append(p)
-        self.positions.sort()
-
-        # print "othercTop:", ref.othercTop
-        for p in ref.othercTop:
-            self.otherfreqs[p] = BaseFreq(p)
-        for p in ref.othercBot:
-            self.otherfreqs[p] = BaseFreq(p)
+        self.positions = sorted(ref.cpositionsTop + ref.cpositionsBot)
+        self.fillCache = OrderedDict()
+        self.cacheHits = 0
+        self.cacheMisses = 0
         if weights:
             self.weights = weights
             self.setCharvalues(self.weights)
@@ -255,82 +457,110 @@ nsites >= closeMin terminates the search."""
                 break
 
     def scaleVector(self, fmap, vect):
-        patchStart = None
-        patchType = "N"
-        newVect = [x for x in vect]
-
-        for i in range(len(fmap)):
-            # print (i, fmap[i], patchType, patchStart)
-            if patchType in '+-':
-                if fmap[i] == patchType:
-                    continue
-                else:
-                    plen = i - patchStart
-                    for y in range(patchStart, i):
-                        newVect[y] = float(newVect[y]) / plen
-                    patchType = "N"
-            else:
-                if fmap[i] in '+-':
-                    patchType = fmap[i]
-                    patchStart = i
-        return newVect
+        """Return the scaled values for a single map (see scaleMatrix)."""
+        return scaleMatrix(["".join(fmap)], [vect])[0]
+
+    def addScaled(self, scaled):
+        """Append the rows of `scaled' to sclmatrix, for the last maps added to mapstrings."""
+        import numpy as np
+
+        if self.sclmatrix is None or len(self.sclmatrix) == 0:
+            self.sclmatrix = scaled
+        elif len(scaled):
+            self.sclmatrix = np.vstack([self.sclmatrix, scaled])
+        self.sclvectors = dict(zip([ name for (name, fmap) in self.mapstrings ], self.sclmatrix))
 
     def makeAllMaps(self, sequences):
         self.mapstrings = []
         self.mapvectors = {}
         self.sclvectors = {}
+        self.sclmatrix = None
         self.origvectors = {}
+        if self.readStats:
+            self.readStats.reset()
+        self.addMaps(sequences)
+
+    def loadMaps(self, names, seqs, mapstrs, values, scaled):
+        """Set the maps of this object to the ones previously computed for reads `names' (see Store)."""
+        self.mapstrings = list(zip(names, mapstrs))
+        if self.writer:
+            for (n, s) in self.mapstrings:
+                self.writer.addRow(self.site, n, s)
+        self.mapvectors = dict(zip(names, values.tolist()))
+        if self.readStats:
+            self.readStats.reset()
+            self.readStats.addMaps(mapstrs)
+        self.sclmatrix = None
+        self.addScaled(scaled.astype("float32"))
+        self.origvectors = dict(zip(names, seqs))
+
+    def addMaps(self, sequences):
+        """Compute the maps of `sequences', adding them to the existing ones."""
+        nsites = self.ref.nsites(self.top, self.bottom)
+        (hits, misses) = (self.cacheHits, self.cacheMisses)
+        fmaps = []
+        vects = []
         for seq in sequences:
             seqstr = str(seq.seq)
             (basemap, pattern) = self.ref.makeMapString(seqstr, top=self.top, bottom=self.bottom)
-            seq.pattern += pattern
-            # print basemap
-            blocks = self.makeBlocks(basemap)
-            # print [str(b) for b in blocks]
-            (fmap, vect) = self.fillMapString(basemap, blocks)
-            # print fmap
-            # raw_input()
-            # print vect
-            # raw_input()
-            # print "".join(fmap)
-            # raw_input()
+            seq.pattern = Patterns.combine(seq.pattern, pattern, nsites)
+            (fmap, vect) = self.fillPattern(basemap, pattern)
             self.mapstrings.append((seq.name, fmap))
+            if self.writer:
+                self.writer.addRow(self.site, seq.name, fmap)
             self.mapvectors[seq.name] = vect
-            self.sclvectors[seq.name] = self.scaleVector(fmap, vect)
             self.origvectors[seq.name] = seqstr
-
-    def calcAllFrequencies(self, sequences, freqfile):
-        for seq in sequences:
-            for p in self.ref.cpositionsTop:
-                self.sitefreqs[p].base(seq[p])
-            for p in self.ref.cpositionsBot:
-                self.sitefreqs[p].base(seq[p])
-            # print sorted(self.otherfreqs.keys())
-            for p in self.ref.othercTop:
-                self.otherfreqs[p].base(seq[p])
-            for p in self.ref.othercBot:
-                self.otherfreqs[p].base(seq[p])
-
+            fmaps.append(fmap)
+            vects.append(vect)
+        self.addScaled(scaleMatrix(fmaps, vects, stats=self.readStats).reshape(len(fmaps), self.ref.length))
+        if self.cacheSize > 0 and sequences:
+            sys.stderr.write(MAPS + "{}: {} maps filled, {} reused from cache.\n".format(
+                self.site, self.cacheMisses - misses, self.cacheHits - hits))
+
+    def fillPattern(self, basemap, key):
+        """Return the filled map and vector for `basemap', whose site calls are packed in `key'
+(see RefSequence.makeMapString). Since they only depend on the site calls, the last
+`cacheSize' results are cached by key and shared by all reads with the same pattern."""
+        cache = self.fillCache
+        if key in cache:
+            self.cacheHits += 1
+            result = cache.pop(key)
+            cache[key] = result         # Move to most recently used
+            return result
+        self.cacheMisses += 1
+        blocks = self.makeBlocks(basemap)
+        (fmap, vect) = self.fillMapString(basemap, blocks)
+        result = ("".join(fmap), vect)
+        if self.cacheSize > 0:
+            cache[key] = result
+            if len(cache) > self.cacheSize:
+                cache.popitem(last=False)
+        return result
+
+    def calcAllFrequencies(self, sequences, freqfile, counts=None, groupnames=None):
+        """Write base frequencies and coverage at site and non-site C positions to `freqfile'.
+`counts' can be precomputed by baseCounts() (so that it can be shared by all maps). If
+`groupnames' is specified, `counts' contains one table for each group, and rows are
+written for each group, preceded by the group name."""
+        if counts is None:
+            counts = baseCounts(sequences, self.ref.length)
+        hdr = ("Group\t" if groupnames else "") + "Pos\tA\tC\tG\tT\tCov\n"
+        sections = [("# Site Cs, Top", self.ref.cpositionsTop), ("# Site Cs, Bot", self.ref.cpositionsBot),
+                    ("# Non-site Cs, Top", self.ref.othercTop), ("# Non-site Cs, Bot", self.ref.othercBot)]
         with open(freqfile, "w") as out:
-            out.write("# Site Cs, Top\n")
-            out.write("Pos\tA\tC\tG\tT\n")
-            for p in self.ref.cpositionsTop:
-                self.sitefreqs[p].writeRow(out)
-            out.write("\n# Site Cs, Bot\n")
-            out.write("Pos\tA\tC\tG\tT\n")
-            for p in self.ref.cpositionsBot:
-                self.sitefreqs[p].writeRow(out)
-            out.write("\n# Non-site Cs, Top\n")
-            out.write("Pos\tA\tC\tG\tT\n")
-            for p in self.ref.othercTop:
-                self.otherfreqs[p].writeRow(out)
-            out.write("\n# Non-site Cs, Bot\n")
-            out.write("Pos\tA\tC\tG\tT\n")
-            for p in self.ref.othercBot:
-                self.otherfreqs[p].writeRow(out)
+            for (i, (title, positions)) in enumerate(sections):
+                if i > 0:
+                    out.write("\n")
+                out.write(title + "\n")
+                out.write(hdr)
+                if groupnames:
+                    for (g, gname) in enumerate(groupnames):
+                        writeFreqRows(out, counts[g], positions, group=gname, offset=self.offset)
+                else:
+                    writeFreqRows(out, counts[0], positions, offset=self.offset)
 
     def writeCSV(self, csvname, hdrline):
-        self.csvfile = "{}-{}".format(self.site, csvname)
+        self.csvfile = "{}{}-{}".format(self.prefix, self.site, csvname)
         sys.stderr.write(OUTPUT + "  " + self.csvfile + "\n")
         with open(self.csvfile, "w") as out:
             out.write(hdrline)
@@ -346,27 +576,34 @@ nsites >= closeMin terminates the search."""
                         out.write("\t" + str(data[i]))
                 out.write("\n")
         if self.scale:
-            self.sclfile = "{}-scaled.csv".format(self.site)
+            self.sclfile = "{}{}-scaled.csv".format(self.prefix, self.site)
             with open(self.sclfile, "w") as out:
                 out.write(hdrline)
-                for name in self.sclvectors.keys():
-                    data = self.sclvectors[name]
-                #    out.write(name + "\t" + "\t".join(str(x) for x in data) + "\n")
-                    orig = self.origvectors[name]
-                    out.write(name)
-                    for i in range(len(data)):
-                        if self.white and orig[i] in "-N":
-                            out.write("\t.")
-                        else:
-                            out.write("\t" + str(data[i]))
-                    out.write("\n")
+                # sclmatrix is float32: the values written are scaled again in double precision
+                for start in range(0, len(self.mapstrings), 10000):
+                    block = self.mapstrings[start:start+10000]
+                    scaled = scaleMatrix([ fmap for (name, fmap) in block ], [ self.mapvectors[name] for (name, fmap) in block ], dtype="float64")
+                    for ((name, fmap), data) in zip(block, scaled.tolist()):
+                        orig = self.origvectors[name]
+                        out.write(name)
+                        for i in range(len(data)):
+                            if self.white and orig[i] in "-N":
+                                out.write("\t.")
+                            else:
+                                out.write("\t" + str(data[i]))
+                        out.write("\n")
 
     def writeCDT(self, rownames, roworder, gtrfile):
-        """Write a CDT file for this map, using the gene order specified in `gtrfile'."""
-        self.cdtfile = self.site + "-map.cdt"
-        self.gtrfile = self.site + "-map.gtr"
-        sys.stderr.write(CLUSTER + "  {} ({})\n".format(self.cdtfile, self.gtrfile))
-        shutil.copyfile(gtrfile, self.gtrfile)
+        """Write a CDT file for this map, with the rows in the order specified by `roworder'.
+The tree in `gtrfile' is copied next to it, unless `gtrfile' is None."""
+        self.cdtfile = self.prefix + self.site + "-map.cdt"
+        if gtrfile:
+            self.gtrfile = self.prefix + self.site + "-map.gtr"
+            sys.stderr.write(CLUSTER + "  {} ({})\n".format(self.cdtfile, self.gtrfile))
+            shutil.copyfile(gtrfile, self.gtrfile)
+        else:
+            self.gtrfile = None
+            sys.stderr.write(CLUSTER + "  {}\n".format(self.cdtfile))
         with open(self.cdtfile, "w") as out:
             with open(self.csvfile, "r") as f:
                 hdr = parseLine(f.readline())
@@ -0,0 +1,95 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import numpy as np
+
+### Fast orderings of reads for display (--order), as an alternative to hierarchical
+### clustering when only a readable heatmap is needed. Orderings are computed from
+### the matrix of map characters of the reads, without pairwise distances, in
+### O(N log N) time:
+###   fraction - by fraction of methylated sites
+###   first    - by position of the first methylated patch
+###   last     - by position of the end of the last methylated patch
+###   pattern  - lexicographically by methylation pattern (methylated sites first)
+###   kmodes   - by k-modes clustering of the site calls, then by fraction within each cluster
+
+ORDERINGS = ["fraction", "first", "last", "pattern", "kmodes"]
+
+METH   = ord('*')
+UNMETH = ord('#')
+PATCH  = ord('+')
+
+def mapMatrix(mapstrings, start, end):
+    """Return the map characters of the (name, map) pairs in `mapstrings' in the region
+[start, end) as an array of bytes, with one row per read."""
+    data = "".join([ fmap[start:end] for (name, fmap) in mapstrings ])
+    return np.frombuffer(data.encode("ascii"), dtype=np.uint8).reshape(len(mapstrings), end - start)
+
+def methFraction(codes):
+    """Fraction of methylated sites in each row of `codes' (0 for reads without sites)."""
+    meth = (codes == METH).sum(axis=1)
+    calls = meth + (codes == UNMETH).sum(axis=1)
+    return meth / np.maximum(calls, 1).astype(float)
+
+def patchEdge(codes, last=False):
+    """Column of the first (or of the last, if `last' is True) methylated patch position in
+each row of `codes'. Rows without patches get the number of columns."""
+    inpatch = (codes == PATCH)
+    ncols = codes.shape[1]
+    if last:
+        edge = ncols - 1 - np.argmax(inpatch[:, ::-1], axis=1)
+    else:
+        edge = np.argmax(inpatch, axis=1)
+    edge[~inpatch.any(axis=1)] = ncols
+    return edge
+
+def siteCalls(codes):
+    """Return the calls at the site columns of `codes': 0 for methylated, 1 for unmethylated."""
+    sites = ((codes == METH) | (codes == UNMETH)).any(axis=0)
+    return (codes[:, sites] != METH).astype(np.uint8)
+
+def kModes(calls, k, maxiter=20):
+    """Cluster the rows of `calls' into (at most) `k' clusters by k-modes, starting from the
+`k' most common patterns. Returns the cluster of each row."""
+    if calls.shape[0] == 0 or calls.shape[1] == 0:
+        return np.zeros(calls.shape[0], dtype=int)
+    packed = np.ascontiguousarray(np.packbits(calls, axis=1))
+    (first, counts) = np.unique(packed.view(np.dtype((np.void, packed.shape[1]))).ravel(), return_index=True, return_counts=True)[1:]
+    modes = calls[first[np.argsort(-counts, kind="stable")[:k]]]
+    labels = None
+    for _ in range(maxiter):
+        dist = np.empty((calls.shape[0], len(modes)), dtype=np.int32)
+        for (j, mode) in enumerate(modes):
+            dist[:, j] = (calls != mode).sum(axis=1)
+        new = np.argmin(dist, axis=1)
+        if labels is not None and np.array_equal(new, labels):
+            break
+        labels = new
+        for j in range(len(modes)):
+            members = calls[labels == j]
+            if len(members):
+                modes[j] = (members.mean(axis=0) > 0.5)
+    return labels
+
+def orderReads(codes, ordering, k=8):
+    """Return the order of the rows of `codes' (see mapMatrix) according to `ordering', and
+for `kmodes' the cluster of each row, numbered in display order starting at 0 (otherwise None)."""
+    frac = methFraction(codes)
+    if codes.shape[0] == 0:
+        return (np.arange(0), None)
+    if ordering == "fraction":
+        return (np.argsort(frac, kind="stable"), None)
+    elif ordering in ["first", "last"]:
+        return (np.lexsort((frac, patchEdge(codes, last=(ordering == "last")))), None)
+    elif ordering == "pattern":
+        calls = siteCalls(codes)
+        return (np.lexsort(calls.T[::-1]) if calls.shape[1] else np.arange(codes.shape[0]), None)
+    elif ordering == "kmodes":
+        labels = kModes(siteCalls(codes), k)
+        nclust = labels.max() + 1
+        means = np.bincount(labels, weights=frac, minlength=nclust) / np.maximum(np.bincount(labels, minlength=nclust), 1)
+        rank = np.empty(nclust, dtype=int)
+        rank[np.argsort(means, kind="stable")] = np.arange(nclust)
+        labels = rank[labels]
+        return (np.lexsort((frac, labels)), labels)
+    raise ValueError("Ordering should be one of {}.".format(", ".join(ORDERINGS)))
@@ -0,0 +1,47 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+from collections import Counter
+
+### Methylation patterns. The pattern of a read is the list of its calls at all
+### sites (for all maps, in order), packed into an integer with two bits per site,
+### the first site in the most significant bits. Patterns are used as keys to remove
+### duplicates (-U) and to count epialleles (--patterns).
+
+METH   = 0                  # Methylated C (C in read)
+UNMETH = 1                  # Unmethylated C (converted to T)
+NOCALL = 2                  # Any other base (N, gap, mismatch)
+CHARS  = "*#."              # Characters used to display each call
+
+def combine(key, other, n):
+    """Append pattern `other', containing `n' sites, to pattern `key'."""
+    return (key << (2 * n)) | other
+
+def unpack(key, n):
+    """Return the list of the `n' calls packed in `key'."""
+    return [ (key >> (2 * (n - i - 1))) & 3 for i in range(n) ]
+
+def toString(key, n):
+    return "".join([ CHARS[c] for c in unpack(key, n) ])
+
+def countPatterns(sequences):
+    """Return a Counter of the patterns of `sequences'."""
+    return Counter([ seq.pattern for seq in sequences ])
+
+def writeReport(out, sequences, layout, top=20):
+    """Write the `top' most frequent patterns in `sequences' (all of them if `top' is 0) with
+their counts. `layout' is a list of (site, number of sites) for each map, used to display
+each pattern as one string per map. Returns the number of distinct patterns."""
+    counts = countPatterns(sequences)
+    total = len(sequences)
+    nsites = sum([ n for (site, n) in layout ])
+    out.write("Rank\tCount\tFraction\t" + "\t".join([ site for (site, n) in layout ]) + "\n")
+    for (rank, (key, count)) in enumerate(counts.most_common(top or None)):
+        s = toString(key, nsites)
+        fields = []
+        start = 0
+        for (site, n) in layout:
+            fields.append(s[start:start+n])
+            start += n
+        out.write("{}\t{}\t{}\t{}\n".format(rank + 1, count, 1.0 * count / total, "\t".join(fields)))
+    return len(counts)
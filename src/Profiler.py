@@ -0,0 +1,113 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from Utils import PROFILE
+
+### Per-stage timing and memory measurements (--profile). Each stage records
+### wall-clock time, CPU time, and the peak resident set size of the process
+### at the end of the stage (this is a high-water mark, so it never decreases).
+
+def peakRSS():
+    """Return the peak resident set size of this process in MB, or None if not available."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 1048576.0  # bytes on macOS
+    return rss / 1024.0         # kilobytes on Linux
+
+def cpuTime():
+    t = os.times()
+    return t[0] + t[1]
+
+class Stage():
+    name = ""
+    nreads = 0                  # Number of reads processed by this stage
+    wall = 0.0
+    cpu = 0.0
+    rss = None
+
+    def __init__(self, name, nreads):
+        self.name = name
+        self.nreads = nreads
+
+    def rate(self):
+        if self.nreads and self.wall > 0:
+            return self.nreads / self.wall
+        return None
+
+    def toDict(self):
+        return {"stage": self.name, "reads": self.nreads, "seconds": self.wall, "cpu": self.cpu,
+                "reads_per_second": self.rate(), "peak_rss_mb": self.rss}
+
+class Profiler():
+    enabled = False             # If True, record stages (--profile)
+    jsonfile = None             # Write timing report to this file (--profile-json)
+    dumpfile = None             # Write cProfile statistics to this file (--profile-dump)
+    stages = []
+    cprof = None
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, nreads=0):
+        """Measure the execution of the body of the `with' statement as stage `name'. The Stage
+object is returned so that `nreads' can be set within the body if it is not known in advance."""
+        if not self.enabled:
+            yield Stage(name, nreads)
+            return
+        st = Stage(name, nreads)
+        c0 = cpuTime()
+        t0 = time.time()
+        try:
+            yield st
+        finally:
+            st.wall = time.time() - t0
+            st.cpu = cpuTime() - c0
+            st.rss = peakRSS()
+            self.stages.append(st)
+
+    def startCProfile(self):
+        if self.dumpfile:
+            import cProfile
+            self.cprof = cProfile.Profile()
+            self.cprof.enable()
+
+    def stopCProfile(self):
+        if self.cprof:
+            self.cprof.disable()
+            sys.stderr.write(PROFILE + "Writing cProfile statistics to {}.\n".format(self.dumpfile))
+            self.cprof.dump_stats(self.dumpfile)
+            self.cprof = None
+
+    def report(self, prefix=""):
+        """Write the stages recorded so far to the log, and to the JSON report if requested."""
+        if not self.enabled:
+            return
+        totwall = 0.0
+        totcpu = 0.0
+        for st in self.stages:
+            totwall += st.wall
+            totcpu += st.cpu
+            rate = st.rate()
+            sys.stderr.write(PROFILE + "{:<10} {:9.3f}s wall {:9.3f}s cpu {:>12} reads/s {:>10} peak RSS\n".format(
+                st.name, st.wall, st.cpu, "{:.1f}".format(rate) if rate else "-", "{:.1f}MB".format(st.rss) if st.rss else "-"))
+        sys.stderr.write(PROFILE + "{:<10} {:9.3f}s wall {:9.3f}s cpu\n".format("total", totwall, totcpu))
+        if self.jsonfile:
+            import json
+            jsonfile = prefix + self.jsonfile
+            sys.stderr.write(PROFILE + "Writing timing report to {}.\n".format(jsonfile))
+            with open(jsonfile, "w") as out:
+                json.dump({"stages": [ st.toDict() for st in self.stages ],
+                           "seconds": totwall, "cpu": totcpu, "peak_rss_mb": peakRSS()}, out, indent=1)
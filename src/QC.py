@@ -0,0 +1,108 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import numpy as np
+
+### Read quality control (--qc). All measures are computed in a single pass over
+### the matrix of read bases (one row per read, one column per reference position):
+###   Conversion - fraction of converted Cs at non-site C positions (C->T on the top
+###                strand, G->A on the bottom strand), i.e. the bisulfite conversion rate
+###   NonsiteCs  - number of non-site C positions with a call (C/T, or G/A)
+###   MaxRun     - longest run of consecutive unconverted sites, on either strand, for each site
+###   NFraction  - fraction of positions containing N or a gap
+### Only the strands selected with -x are examined. Non-site Cs are the Cs that are not
+### part of any of the sites being detected.
+
+NCHARS = b"N-."
+
+def readMatrix(seqs, length):
+    """Return the bases of the reads in `seqs' as an array of bytes with one row per read and
+`length' columns (reads of a different length are truncated or padded with N)."""
+    data = "".join([ str(seq.seq)[:length].upper().ljust(length, "N") for seq in seqs ])
+    return np.frombuffer(data.encode("ascii", "replace"), dtype=np.uint8).reshape(len(seqs), length)
+
+def longestRun(mask):
+    """Return the length of the longest run of True values in each row of boolean array `mask'."""
+    if mask.shape[1] == 0:
+        return np.zeros(mask.shape[0], dtype=int)
+    pos = np.arange(1, mask.shape[1] + 1)
+    last = np.maximum.accumulate(np.where(mask, 0, pos), axis=1)
+    return (pos - last).max(axis=1)
+
+def strandCalls(bases, cols, top):
+    """Return two boolean arrays indicating which of the positions `cols' of `bases' are
+unconverted and converted, on the top (C/T) or bottom (G/A) strand."""
+    sub = bases[:, np.asarray(cols, dtype=int)]
+    if top:
+        return (sub == ord('C'), sub == ord('T'))
+    return (sub == ord('G'), sub == ord('A'))
+
+def nonsiteCs(refs, top=True):
+    """Return the positions of the Cs (Gs if `top' is False) in the reference that are not
+part of any of the sites of the RefSequences `refs'."""
+    ref = refs[0].sequence.upper()
+    sites = set()
+    for r in refs:
+        sites.update(r.cpositionsTop if top else r.cpositionsBot)
+    base = 'C' if top else 'G'
+    return [ i for (i, b) in enumerate(ref) if b == base and i not in sites ]
+
+class QCStats():
+    """Quality measures for a set of reads, as arrays with one element per read."""
+    conversion = None           # Conversion rate at non-site Cs (NaN if no calls)
+    nonsite = None              # Number of non-site Cs with a call
+    maxrun = {}                 # Site => longest run of unconverted sites
+    nfraction = None            # Fraction of Ns and gaps
+    passed = None               # True for reads that pass all filters
+
+    def __init__(self, seqs, refs, sites, top=True, bottom=True):
+        bases = readMatrix(seqs, refs[0].length)
+        conv = np.zeros(len(seqs), dtype=int)
+        unconv = np.zeros(len(seqs), dtype=int)
+        self.maxrun = {}
+        for (strand, wanted) in [(True, top), (False, bottom)]:
+            if not wanted:
+                continue
+            (u, c) = strandCalls(bases, nonsiteCs(refs, top=strand), strand)
+            unconv += u.sum(axis=1)
+            conv += c.sum(axis=1)
+            for (site, r) in zip(sites, refs):
+                (u, c) = strandCalls(bases, r.cpositionsTop if strand else r.cpositionsBot, strand)
+                run = longestRun(u)
+                self.maxrun[site] = np.maximum(self.maxrun[site], run) if site in self.maxrun else run
+        self.nonsite = conv + unconv
+        self.conversion = np.full(len(seqs), np.nan)
+        called = self.nonsite > 0
+        self.conversion[called] = conv[called] / self.nonsite[called].astype(float)
+        isN = np.zeros(256, dtype=bool)
+        isN[np.frombuffer(NCHARS, dtype=np.uint8)] = True
+        self.nfraction = isN[bases].sum(axis=1) / float(max(bases.shape[1], 1))
+        self.passed = np.ones(len(seqs), dtype=bool)
+
+    def applyFilters(self, minConversion=None, maxRun=None, maxNFraction=None):
+        """Mark the reads that do not pass the filters, returning the number of reads failing
+each one as a list of (filter, count) pairs. Reads without non-site C calls pass the conversion filter."""
+        result = []
+        if minConversion is not None:
+            bad = self.conversion < minConversion
+            result.append(("conversion < {}".format(minConversion), int(bad.sum())))
+            self.passed &= ~bad
+        if maxRun is not None:
+            bad = np.zeros(len(self.passed), dtype=bool)
+            for run in self.maxrun.values():
+                bad |= (run >= maxRun)
+            result.append(("unconverted run >= {}".format(maxRun), int(bad.sum())))
+            self.passed &= ~bad
+        if maxNFraction is not None:
+            bad = self.nfraction > maxNFraction
+            result.append(("N fraction > {}".format(maxNFraction), int(bad.sum())))
+            self.passed &= ~bad
+        return result
+
+    def writeTable(self, out, seqs, sites):
+        out.write("Read\tConversion\tNonsiteCs\t" + "\t".join([ "MaxRun:" + s for s in sites ]) + "\tNFraction\tPass\n")
+        for i in range(len(seqs)):
+            out.write("{}\t{}\t{}\t{}\t{:.4f}\t{}\n".format(
+                seqs[i].name, "NA" if np.isnan(self.conversion[i]) else "{:.4f}".format(self.conversion[i]),
+                self.nonsite[i], "\t".join([ str(self.maxrun[s][i]) for s in sites ]),
+                self.nfraction[i], "Y" if self.passed[i] else "N"))
@@ -3,10 +3,8 @@
 
 import sys
 
-import Bio
-import Bio.Seq
-import Bio.SeqUtils
-
+from Fasta import siteSearch, reverseComplement
+from Patterns import METH, UNMETH, NOCALL
 from Utils import INPUT, OUTPUT, WARNING, MAPS
 
 class RefSequence():
@@ -21,25 +19,28 @@ class RefSequence():
     othercTop     = []          # list of other C positions (top)
     othercBot     = []          # list of other C positions (bottom)
 
-    def __init__(self, sequence, target):
+    def __init__(self, sequence, target, verbose=True):
+        """`sequence' can be a SeqRecord or a string. If `verbose' is False, nothing is written to stderr."""
         tg = str(target)
-        self.sequence = str(sequence.seq)
+        self.sequence = str(getattr(sequence, "seq", sequence))
         self.length = len(self.sequence)
         self.target = target
+        self.positionsTop  = []
+        self.cpositionsTop = []
+        self.positionsBot  = []
+        self.cpositionsBot = []
         self.othercTop = []
         self.othercBot = []
         if len(target) > 0:
             if "C" in tg:
                 coffset = target.index("C")
-                hits = Bio.SeqUtils.nt_search(self.sequence, tg)
-                self.positionsTop = hits[1:]
+                self.positionsTop = siteSearch(self.sequence, tg)
                 self.cpositionsTop = [h + coffset for h in self.positionsTop]
 
                 # Now do bottom strand
-                target = Bio.Seq.reverse_complement(target)
+                target = reverseComplement(tg)
                 coffset = len(target) - coffset - 1
-                hits = Bio.SeqUtils.nt_search(self.sequence, str(target))
-                self.positionsBot = hits[1:]
+                self.positionsBot = siteSearch(self.sequence, target)
                 self.cpositionsBot = [h + coffset for h in self.positionsBot]
                 for i in range(len(self.sequence)):
                     b = self.sequence[i]
@@ -54,39 +55,45 @@ class RefSequence():
                 #print self.othercTop
                 #print self.othercBot
                 #raw_input()
+                if not verbose:
+                    return
                 sys.stderr.write(MAPS + "{} map: {} sites ({} top, {} bot)\n".format(tg, len(self.positionsTop) + len(self.positionsBot),
                                                                                      len(self.positionsTop), len(self.positionsBot)))
                 sys.stderr.write(MAPS + "        {} non-site C positions ({} top, {} bot)\n".format(len(self.othercTop) + len(self.othercBot),
                                                                                                     len(self.othercTop), len(self.othercBot)))
-            else:
+            elif verbose:
                 sys.stderr.write(WARNING + "target `{}' does not contain a C.\n".format(tg))
 
+    def nsites(self, top=True, bottom=True):
+        """Return the number of sites examined by makeMapString."""
+        return (len(self.cpositionsTop) if top else 0) + (len(self.cpositionsBot) if bottom else 0)
+
     def makeMapString(self, read, top=True, bottom=True):
+        """Return the map string for `read' and its methylation pattern (see Patterns)."""
         if len(read) != self.length:
             sys.stderr.write("Warning: read length ({}) does not match reference sequence length ({}).\n".format(len(read), self.length))
             return None
         smap = [" "]*self.length
-        pattern = []
+        key = 0
         if top:
             for i in self.cpositionsTop:
-                if read[i] == 'C':
+                b = read[i]
+                if b == 'C':
                     smap[i] = '*'
-                    pattern.append("0")
+                    key = (key << 2) | METH
                 else:
                     smap[i] = '#'
-                    pattern.append("1")
+                    key = (key << 2) | (UNMETH if b == 'T' else NOCALL)
         if bottom:
             for i in self.cpositionsBot:
-                if read[i] == 'G':
+                b = read[i]
+                if b == 'G':
                     smap[i] = '*'
-                    pattern.append("0")
+                    key = (key << 2) | METH
                 else:
                     smap[i] = '#'
-                    pattern.append("1")
-        # print pattern
-        # print (self.cpositionsTop, self.cpositionsBot)
-        # print (len(self.cpositionsTop), len(self.cpositionsBot), len(pattern))
-        return ("".join(smap), "".join(pattern))
+                    key = (key << 2) | (UNMETH if b == 'A' else NOCALL)
+        return ("".join(smap), key)
 
     def methylStretch(self, read, maxunconv, top=True, bottom=True):
         """Returns False if `read' contains `maxunconv' or more non-converted Cs, otherwise True."""
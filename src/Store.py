@@ -0,0 +1,120 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import os
+import sys
+import json
+import numpy as np
+
+from Fasta import FastaRecord
+from Utils import INPUT, OUTPUT
+
+### On-disk store for incremental mode (--store). It contains all the reads
+### processed so far with their maps, so that new reads can be added to a run
+### without remapping the old ones. The store is a NumPy .npz file containing:
+###   params                       - mapping parameters (JSON), which must not change between runs
+###   names, seqs, patterns        - name, sequence and methylation pattern (as a decimal string) of each read
+###   map:SITE, values:SITE, scaled:SITE - filled map, values and scaled values of each read for each site
+###   counts                       - base counts at each position (see MethMap.baseCounts)
+###   tree, gids                   - clustering tree (GTR branches) and GTR id of each clustered read
+
+class Store():
+    filename = None
+    params = {}
+    names = []
+    seqs = []
+    patterns = []
+    maps = {}                   # Site => (map strings, values, scaled values)
+    counts = None
+    tree = []                   # Branches of the clustering tree
+    gids = {}                   # Read name => GTR id in tree
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.params = {}
+        self.names = []
+        self.seqs = []
+        self.patterns = []
+        self.maps = {}
+        self.counts = None
+        self.tree = []
+        self.gids = {}
+
+    def exists(self):
+        return os.path.isfile(self.filename)
+
+    def nreads(self):
+        return len(self.names)
+
+    def load(self):
+        with np.load(self.filename, allow_pickle=False) as data:
+            self.params = json.loads(str(data["params"]))
+            self.names = data["names"].tolist()
+            self.seqs = data["seqs"].tolist()
+            self.patterns = [ int(p) for p in data["patterns"].tolist() ]
+            for site in self.params["sites"]:
+                self.maps[site] = ([ s.decode("ascii") for s in data["map:" + site].tolist() ],
+                                   data["values:" + site], data["scaled:" + site])
+            self.counts = data["counts"]
+            self.tree = data["tree"].tolist()
+            self.gids = dict(zip(data["gids"][0].tolist(), data["gids"][1].tolist()))
+        sys.stderr.write(INPUT + "{} reads loaded from store `{}'.\n".format(len(self.names), self.filename))
+
+    def check(self, params):
+        """Return the names of the parameters whose values in `params' are different from the ones in the store."""
+        return [ k for k in sorted(params.keys()) if self.params.get(k) != params[k] ]
+
+    def records(self):
+        """Return the reads in the store as FastaRecord objects."""
+        result = []
+        for (name, seq, pattern) in zip(self.names, self.seqs, self.patterns):
+            rec = FastaRecord(name, seq)
+            rec.pattern = pattern
+            result.append(rec)
+        return result
+
+    def update(self, params, sequences, maps, counts):
+        """Replace the contents of the store with `sequences' and their `maps'."""
+        self.params = params
+        self.names = [ seq.name for seq in sequences ]
+        self.seqs = [ str(seq.seq) for seq in sequences ]
+        self.patterns = [ seq.pattern for seq in sequences ]
+        self.counts = counts
+        self.maps = {}
+        for m in maps:
+            names = [ name for (name, fmap) in m.mapstrings ]
+            self.maps[m.site] = ([ fmap for (name, fmap) in m.mapstrings ],
+                                 np.array([ m.mapvectors[n] for n in names ], dtype=float).reshape(len(names), m.ref.length),
+                                 np.asarray(m.sclmatrix, dtype=np.float32).reshape(len(names), m.ref.length))
+
+    def select(self, names):
+        """Only keep the reads in `names', with their maps. Base counts are not updated."""
+        keep = set(names)
+        idx = [ i for (i, name) in enumerate(self.names) if name in keep ]
+        self.names = [ self.names[i] for i in idx ]
+        self.seqs = [ self.seqs[i] for i in idx ]
+        self.patterns = [ self.patterns[i] for i in idx ]
+        for (site, (mapstrs, values, scaled)) in list(self.maps.items()):
+            self.maps[site] = ([ mapstrs[i] for i in idx ], values[idx], scaled[idx])
+
+    def setTree(self, branches, gids):
+        self.tree = branches or []
+        self.gids = gids or {}
+
+    def save(self):
+        sys.stderr.write(OUTPUT + "Saving {} reads to store `{}'.\n".format(len(self.names), self.filename))
+        arrays = {"params": np.array(json.dumps(self.params)),
+                  "names": np.array(self.names, dtype=str),
+                  "seqs": np.array(self.seqs, dtype=str),
+                  "patterns": np.array([ str(p) for p in self.patterns ], dtype=str),
+                  "counts": self.counts if self.counts is not None else np.zeros((1, 0, 4), dtype=np.int64),
+                  "tree": np.array(self.tree, dtype=str).reshape(len(self.tree), 4),
+                  "gids": np.array([list(self.gids.keys()), list(self.gids.values())], dtype=str).reshape(2, len(self.gids))}
+        for (site, (mapstrs, values, scaled)) in self.maps.items():
+            arrays["map:" + site] = np.array([ s.encode("ascii") for s in mapstrs ], dtype=bytes)
+            arrays["values:" + site] = values
+            arrays["scaled:" + site] = scaled
+        tmpfile = self.filename + ".tmp"
+        with open(tmpfile, "wb") as out:
+            np.savez_compressed(out, **arrays)
+        os.rename(tmpfile, self.filename)
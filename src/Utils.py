@@ -25,11 +25,12 @@ INPUT   =       bold("[input  ] ")
 OUTPUT  =       bold("[output ] ")
 MAPS    =       bold("[maps   ] ")
 CLUSTER =       bold("[cluster] ")
+PROFILE =       bold("[profile] ")
 WARNING = bold(color("[warning] ", 1))
 
-def makeColHeaders(n):
-    """Returns a list of n strings of the form C1, C2... Cn, to use as column headers."""
-    return [ "C" + str(x) for x in range(1, n+1) ]
+def makeColHeaders(n, start=1):
+    """Returns a list of n strings of the form C1, C2... Cn (or Cstart... if `start' is specified), to use as column headers."""
+    return [ "C" + str(x) for x in range(start, start+n) ]
 
 def parseLine(s):
     return s.strip("\r\n").split("\t")
@@ -47,6 +48,13 @@ def safeInt(a):
         sys.stderr.write("Error: `{}' should be a number.".format(a))
         sys.exit(1)
 
+def safeFloat(a):
+    try:
+        return float(a)
+    except ValueError:
+        sys.stderr.write("Error: `{}' should be a number.".format(a))
+        sys.exit(1)
+
 def parseConsecutive(a):
     parts = a.split(":")
     if len(parts) == 1:
@@ -54,3 +62,11 @@ def parseConsecutive(a):
     else:
         parts = [ parts[0], safeInt(parts[1]) ]
     return parts
+
+def parseRegion(a):
+    """Parse a region of the form START:END (1-based, inclusive), returning (START, END)."""
+    parts = a.split(":")
+    if len(parts) != 2:
+        sys.stderr.write("Error: `{}' should be a region of the form START:END.\n".format(a))
+        sys.exit(1)
+    return (safeInt(parts[0]), safeInt(parts[1]))
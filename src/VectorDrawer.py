@@ -0,0 +1,238 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import colormaps
+from Drawer import Drawer
+
+## Vector drawing backends. These implement the same API as Drawer, but instead
+## of talking to gdcreate they write each primitive to the output file as soon
+## as it is produced. Consecutive filled rectangles on the same row with the
+## same color are merged into a single rectangle before being written.
+
+def num(v):
+    """Format coordinate `v' compactly."""
+    if v == int(v):
+        return str(int(v))
+    return "{:.2f}".format(v)
+
+class VectorDrawer(Drawer):
+    filename = None
+    out = None
+    width = 0
+    height = 0
+    palette = []                # List of (r, g, b) tuples, indexed by color number
+    pending = None              # Filled rectangle waiting to be extended: [x1, y1, x2, y2, color]
+    fontsize = 10
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.cm = colormaps.ColorMap(self)
+        self.palette = []
+        self.pending = None
+        self.out = open(filename, self.mode)
+
+    def terminate(self):
+        self.close()
+
+    def createImage(self, width, height):
+        self.width = width
+        self.height = height
+        self.writeHeader()
+        return "ok"
+
+    def colorAllocate(self, red, green, blue):
+        self.palette.append((red, green, blue))
+        return len(self.palette) - 1
+
+    def colorRangeAllocate(self, n, red1, green1, blue1, red2, green2, blue2):
+        first = len(self.palette)
+        for i in range(n):
+            f = 1.0 * i / (n - 1) if n > 1 else 0.0
+            self.palette.append((int(round(red1 + f * (red2 - red1))),
+                                 int(round(green1 + f * (green2 - green1))),
+                                 int(round(blue1 + f * (blue2 - blue1)))))
+        return (first, len(self.palette) - 1)
+
+    def savePalette(self):
+        return list(self.palette)
+
+    def restorePalette(self, saved):
+        self.palette = list(saved)
+        return True
+
+    def rgb(self, color):
+        if isinstance(color, list):
+            return tuple(color)
+        idx = self.color(color)
+        return (255, 255, 255) if idx is None else self.palette[idx]
+
+    def flush(self):
+        """Write out the pending filled rectangle, if any."""
+        if self.pending:
+            (x1, y1, x2, y2, color) = self.pending
+            self.pending = None
+            self.writeRectangle(x1, y1, x2, y2, color, True)
+
+    def drawRectangle(self, x1, y1, x2, y2, color):
+        self.flush()
+        self.writeRectangle(x1, y1, x2, y2, self.rgb(color), False)
+
+    def drawFilledRectangle(self, x1, y1, x2, y2, color):
+        rgb = self.rgb(color)
+        p = self.pending
+        if p and p[1] == y1 and p[3] == y2 and p[4] == rgb and p[0] <= x1 <= p[2] + 1:
+            p[2] = max(p[2], x2)
+        else:
+            self.flush()
+            self.pending = [x1, y1, x2, y2, rgb]
+
+    def drawPolygon(self, coordinates, color):
+        self.flush()
+        self.writePolygon(coordinates, self.rgb(color), False)
+
+    def drawFilledPolygon(self, coordinates, color):
+        self.flush()
+        self.writePolygon(coordinates, self.rgb(color), True)
+
+    def drawLine(self, x1, y1, x2, y2, color):
+        self.flush()
+        self.writeLine(x1, y1, x2, y2, self.rgb(color))
+
+    def setFont(self, font):
+        """Only the size of built-in GD fonts (0-4) is emulated."""
+        if not isinstance(font, str):
+            self.fontsize = [8, 10, 12, 13, 15][font]
+
+    def drawString(self, string, x, y, color, anchor=1):
+        """`anchor' follows the gdcreate convention: 1-3 top, 4-6 middle, 7-9 bottom
+(left, center, right)."""
+        self.flush()
+        self.writeString(string, x, y, self.rgb(color), anchor)
+
+    def saveImage(self, filename):
+        self.flush()
+        self.writeTrailer()
+        return "ok"
+
+    def close(self):
+        if self.out:
+            self.out.close()
+            self.out = None
+        return "ok"
+
+class SVGDrawer(VectorDrawer):
+    mode = "w"
+
+    def hexcolor(self, rgb):
+        return "#{:02x}{:02x}{:02x}".format(*rgb)
+
+    def writeHeader(self):
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.out.write('<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" viewBox="0 0 {} {}" shape-rendering="crispEdges">\n'.format(
+            num(self.width), num(self.height), num(self.width), num(self.height)))
+        self.out.write('<rect width="100%" height="100%" fill="#ffffff"/>\n')
+
+    def writeTrailer(self):
+        self.out.write("</svg>\n")
+
+    def writeRectangle(self, x1, y1, x2, y2, rgb, filled):
+        if filled:
+            self.out.write('<rect x="{}" y="{}" width="{}" height="{}" fill="{}"/>\n'.format(
+                num(x1), num(y1), num(x2 - x1 + 1), num(y2 - y1 + 1), self.hexcolor(rgb)))
+        else:
+            self.out.write('<rect x="{}" y="{}" width="{}" height="{}" fill="none" stroke="{}"/>\n'.format(
+                num(x1), num(y1), num(x2 - x1), num(y2 - y1), self.hexcolor(rgb)))
+
+    def writeLine(self, x1, y1, x2, y2, rgb):
+        self.out.write('<line x1="{}" y1="{}" x2="{}" y2="{}" stroke="{}"/>\n'.format(
+            num(x1), num(y1), num(x2), num(y2), self.hexcolor(rgb)))
+
+    def writePolygon(self, coordinates, rgb, filled):
+        points = " ".join([ "{},{}".format(num(coordinates[i]), num(coordinates[i+1])) for i in range(0, len(coordinates), 2) ])
+        if filled:
+            self.out.write('<polygon points="{}" fill="{}"/>\n'.format(points, self.hexcolor(rgb)))
+        else:
+            self.out.write('<polygon points="{}" fill="none" stroke="{}"/>\n'.format(points, self.hexcolor(rgb)))
+
+    def writeString(self, string, x, y, rgb, anchor):
+        halign = ["start", "middle", "end"][(anchor - 1) % 3]
+        valign = ["hanging", "central", "auto"][(anchor - 1) // 3]
+        string = string.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        self.out.write('<text x="{}" y="{}" fill="{}" font-family="monospace" font-size="{}" text-anchor="{}" dominant-baseline="{}">{}</text>\n'.format(
+            num(x), num(y), self.hexcolor(rgb), self.fontsize, halign, valign, string))
+
+class PDFDrawer(VectorDrawer):
+    """Writes a single-page PDF. The page content stream is written while drawing;
+the objects that depend on its length, and the cross-reference table, are written
+by saveImage()."""
+    mode = "wb"
+    offsets = []
+    streamStart = 0
+
+    def write(self, s):
+        self.out.write(s.encode("latin-1"))
+
+    def startObject(self):
+        self.offsets.append(self.out.tell())
+        self.write("{} 0 obj\n".format(len(self.offsets)))
+
+    def writeHeader(self):
+        self.offsets = []
+        self.write("%PDF-1.4\n")
+        self.startObject()
+        self.write("<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+        self.startObject()
+        self.write("<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n")
+        self.startObject()
+        self.write("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] /Contents 4 0 R /Resources << /Font << /F1 6 0 R >> >> >>\nendobj\n".format(
+            num(self.width), num(self.height)))
+        self.startObject()
+        self.write("<< /Length 5 0 R >>\nstream\n")
+        self.streamStart = self.out.tell()
+        self.write("1 w\n")
+
+    def writeTrailer(self):
+        length = self.out.tell() - self.streamStart
+        self.write("\nendstream\nendobj\n")
+        self.startObject()
+        self.write("{}\nendobj\n".format(length))
+        self.startObject()
+        self.write("<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>\nendobj\n")
+        xref = self.out.tell()
+        self.write("xref\n0 {}\n0000000000 65535 f \n".format(len(self.offsets) + 1))
+        for o in self.offsets:
+            self.write("{:010d} 00000 n \n".format(o))
+        self.write("trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(len(self.offsets) + 1, xref))
+
+    def pdfcolor(self, rgb, op):
+        return "{:.3f} {:.3f} {:.3f} {}".format(rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0, op)
+
+    def y(self, y):
+        """PDF coordinates have their origin at the bottom left of the page."""
+        return self.height - y
+
+    def writeRectangle(self, x1, y1, x2, y2, rgb, filled):
+        if filled:
+            self.write("{} {} {} {} {} re f\n".format(self.pdfcolor(rgb, "rg"), num(x1), num(self.y(y2 + 1)), num(x2 - x1 + 1), num(y2 - y1 + 1)))
+        else:
+            self.write("{} {} {} {} {} re S\n".format(self.pdfcolor(rgb, "RG"), num(x1), num(self.y(y2)), num(x2 - x1), num(y2 - y1)))
+
+    def writeLine(self, x1, y1, x2, y2, rgb):
+        self.write("{} {} {} m {} {} l S\n".format(self.pdfcolor(rgb, "RG"), num(x1), num(self.y(y1)), num(x2), num(self.y(y2))))
+
+    def writePolygon(self, coordinates, rgb, filled):
+        path = []
+        for i in range(0, len(coordinates), 2):
+            path.append("{} {} {}".format(num(coordinates[i]), num(self.y(coordinates[i+1])), "l" if i else "m"))
+        if filled:
+            self.write("{} {} h f\n".format(self.pdfcolor(rgb, "rg"), " ".join(path)))
+        else:
+            self.write("{} {} h S\n".format(self.pdfcolor(rgb, "RG"), " ".join(path)))
+
+    def writeString(self, string, x, y, rgb, anchor):
+        # Courier glyphs are 0.6 em wide, so the string width is known without font metrics
+        width = 0.6 * self.fontsize * len(string)
+        x = x - width * ((anchor - 1) % 3) / 2.0
+        y = self.y(y) - self.fontsize * [0.8, 0.35, 0.0][(anchor - 1) // 3]
+        string = string.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        self.write("BT {} /F1 {} Tf {} {} Td ({}) Tj ET\n".format(self.pdfcolor(rgb, "rg"), self.fontsize, num(x), num(y), string))
@@ -6,14 +6,14 @@
 import sys
 import random
 import hashlib
-from Bio import SeqIO
-from Bio.SeqIO.FastaIO import FastaIterator
 
 import Help
 import MethMap
 import Cluster
+import Profiler
 import RefSequence
-from Utils import safeInt, parseConsecutive, makeColHeaders, INPUT, OUTPUT, WARNING, BANNER, MAPS
+from Fasta import FastaIterator, FastaRecord
+from Utils import safeInt, safeFloat, parseConsecutive, parseRegion, makeColHeaders, INPUT, OUTPUT, WARNING, BANNER, MAPS
 
 # CG -> red black, GC -> yellow black
 
@@ -30,22 +30,68 @@ class MethylMapper():
     remdups    = 0              # If 1, remove duplicate sequences (-u option); if 2, strict remove (-U option).
     white      = False          # Display - and N in white (-z option)
     consecutive = False         # S:N - Remove reads with more than N consecutive occurrences of unmethylated pattern S
+    region     = None           # (start, end) of analysis region in the reference, 1-based (--region)
+    minConversion = None        # Remove reads with a lower conversion rate at non-site Cs (--min-conversion)
+    maxUnconvRun = None         # Remove reads with this number of consecutive unconverted sites on either strand (--max-unconv-run)
+    maxNFraction = None         # Remove reads with a higher fraction of Ns and gaps (--max-n-fraction)
+    offset     = 0              # Position of the first analyzed base in the reference
 
     # Output files
     mapfile  = None
+    mapwriter = None            # MapWriter for mapfile, set by generateMaps
     csvfile  = None
     freqfile = None
     plotfile = None
+    patternfile = None          # Epiallele report (--patterns)
+    patternsTop = 20            # Number of patterns in epiallele report, 0 for all (--patterns-top)
+    summaryfile = None          # Per-cluster summary table (--cluster-summary)
+    qcfile = None               # Per-read QC table (--qc)
+    readsumfile = None          # Per-read map statistics, one file per site (--read-summary)
+    prefix   = ""               # Prepended to the names of all output files (--prefix)
+
+    # Demultiplexing
+    demux     = False           # If True, assign reads to the sequences in the reference file (--demux)
+    demuxTag  = None            # Header tag containing the name of the reference for each read (--demux-tag)
+    ninput    = 0               # Number of input sequences (after -u and -d)
+    seen      = None            # MD5s of input sequences (-u option)
+    nremoved  = 0               # Number of duplicate sequences removed (-u option)
+
+    # Batch mode
+    batchfile = None            # Manifest file (--batch)
+    batchArgs = []              # Command-line options passed on to each job
+    nprocs    = 1               # Number of worker processes (-j)
+    summary   = None            # Batch summary file (--summary)
+    maxheight = None            # Maximum height of heatmap in pixels (--max-height)
+    session = None              # Draw.RenderSession shared by several runs, if any
+
+    # Incremental mode
+    storefile = None            # Store containing the reads from previous runs (--store)
+    store     = None            # Store.Store object
+    attach    = False           # If True, attach new reads to the existing tree instead of clustering again (--attach)
 
     # Map parameters
     top = True                  # Look for sites on top strand?
     bottom = False              # Look for sites on bottom strand?
     openMin = 2                 # Number of sites to open a patch
     closeMin = 1                # Number of sites to close a patch
+    cacheSize = 10000           # Number of site-call patterns whose filled maps are cached (--fill-cache)
     weights = [2.0, 1.0, 0.0, -1.0, -2.0]
 
     # Clustering
-    clust = Cluster.Clusterer()
+    clust = None
+
+    # Profiling
+    profiler = None             # Profiler.Profiler recording stage timings (--profile)
+
+    def __init__(self):
+        self.sites      = []
+        self.sequences  = []
+        self.references = []
+        self.maps       = []
+        self.clust      = Cluster.Clusterer()
+        self.profiler   = Profiler.Profiler()
+        self.seen       = set()
+        self.nremoved   = 0
 
     def getStrands(self):
         if self.top:
@@ -56,28 +102,33 @@ class MethylMapper():
         else:
             return "bottom"
 
+    def addSequence(self, rec):
+        """Add `rec' to the input sequences, unless it is a duplicate and -u was specified."""
+        if self.remdups == 1:
+            md5 = self.digest(rec)
+            if md5 in self.seen:
+                self.nremoved += 1
+                return False
+            self.seen.add(md5)
+        self.sequences.append(rec)
+        self.maxnamelen = max(self.maxnamelen, len(rec.name))
+        return True
+
+    def digest(self, rec):
+        return hashlib.md5(str(rec.seq).encode("ascii", "replace")).hexdigest()
+
     def readSequences(self, f):
-        seen = set()
-        ns = 0
-        removed = 0
         for rec in FastaIterator(f):
             if self.refseq is None:
                 self.refseq = rec
             else:
-                good = True
-                if self.remdups == 1:
-                    md5 = hashlib.md5(str(rec.seq)).hexdigest()
-                    if md5 in seen:
-                        good = False
-                        removed += 1
-                    else:
-                        seen.add(md5)
-                if good:
-                    self.sequences.append(rec)
-                    self.maxnamelen = max(self.maxnamelen, len(rec.name))
-                    ns += 1
+                self.addSequence(rec)
+        self.finishSequences()
+
+    def finishSequences(self):
+        ns = len(self.sequences)
         if self.remdups == 1:
-            sys.stderr.write(INPUT + "{} duplicate sequence(s) removed.\n".format(removed))
+            sys.stderr.write(INPUT + "{} duplicate sequence(s) removed.\n".format(self.nremoved))
         if self.sampleseqs and self.sampleseqs < ns:
             indices = list(range(ns))
             random.shuffle(indices)
@@ -91,16 +142,43 @@ class MethylMapper():
                     self.refseq = rec
                     break
 
-        if self.filename:
-            sys.stderr.write(INPUT + "Reading sequences from file `{}'.\n".format(self.filename))
-            with open(self.filename, "r") as f:
-                self.readSequences(f)
-        else:
-            sys.stderr.write(INPUT + "Reading sequences from standard input.\n")
-            self.readSequences(sys.stdin)
+        with self.profiler.stage("read") as st:
+            if self.filename:
+                sys.stderr.write(INPUT + "Reading sequences from file `{}'.\n".format(self.filename))
+                with open(self.filename, "r") as f:
+                    self.readSequences(f)
+            else:
+                sys.stderr.write(INPUT + "Reading sequences from standard input.\n")
+                self.readSequences(sys.stdin)
+            st.nreads = len(self.sequences)
+        with self.profiler.stage("setup", len(self.sequences)):
+            self.setupMaps()
 
+    def cropRegion(self):
+        """Restrict the reference and all reads to the analysis region, so that all following
+stages only see the bases in the region. Positions in the output files still refer to the
+whole reference."""
+        (start, end) = self.region
+        if start < 1 or end > len(self.refseq) or start > end:
+            sys.stderr.write(WARNING + "Region {}:{} is not within the reference sequence (1:{}).\n".format(start, end, len(self.refseq)))
+            sys.exit(1)
+        sys.stderr.write(INPUT + "Analysis region: {}:{} ({}bp).\n".format(start, end, end - start + 1))
+        self.offset = start - 1
+        self.refseq = FastaRecord(self.refseq.description, str(self.refseq.seq)[self.offset:end])
+        for seq in self.sequences:
+            seq.seq = str(seq.seq)[self.offset:end]
+        clust = self.clust
+        clust.offset = self.offset
+        clust.clusterFrom = min(max(clust.clusterFrom - self.offset, 0), len(self.refseq))
+        if clust.clusterTo is not None:
+            clust.clusterTo = min(max(clust.clusterTo - self.offset, 0), len(self.refseq))
+
+    def setupMaps(self):
+        if self.region:
+            self.cropRegion()
+        self.ninput = len(self.sequences)
         sys.stderr.write(INPUT + "Reference sequence: {}bp.\n".format(len(self.refseq)))
-        sys.stderr.write(INPUT + "{} input sequences.\n".format(len(self.sequences)))
+        sys.stderr.write(INPUT + "{} input sequences.\n".format(self.ninput))
         sys.stderr.write(INPUT + "Detected sites: " + ", ".join(self.sites) + ".\n")
         sys.stderr.write(INPUT + "Detection strands: " + self.getStrands() + "\n")
         sys.stderr.write(INPUT + "Open/close: {}/{}\n".format(self.openMin, self.closeMin))
@@ -113,25 +191,155 @@ class MethylMapper():
             mmap = MethMap.MethMap(site, mref, weights=self.weights, white=self.white)
             mmap.openMin = self.openMin
             mmap.closeMin = self.closeMin
+            mmap.cacheSize = self.cacheSize
+            mmap.offset = self.offset
             mmap.top = self.top
             mmap.bottom = self.bottom
+            mmap.prefix = self.prefix
+            if self.readsumfile:
+                mmap.readStats = MethMap.ReadStats(openMin=self.openMin)
             self.references.append(mref)
             self.maps.append(mmap)
+        if self.storefile:
+            self.openStore()
+
+    def storeParams(self):
+        """Return the parameters that must be the same for all reads in a store."""
+        return {"reference": str(self.refseq.seq), "sites": self.sites, "open": self.openMin, "close": self.closeMin,
+                "strands": self.getStrands(), "weights": self.weights, "region": list(self.region) if self.region else None}
+
+    def openStore(self):
+        """Open the store for incremental mode, loading the reads it contains if it exists."""
+        import Store
+
+        self.store = Store.Store(self.prefix + self.storefile)
+        if not self.store.exists():
+            sys.stderr.write(INPUT + "Creating new store `{}'.\n".format(self.store.filename))
+        else:
+            self.store.load()
+            bad = self.store.check(self.storeParams())
+            if bad:
+                sys.stderr.write(WARNING + "Store `{}' was created with different parameters ({}), cannot add reads to it.\n".format(self.store.filename, ", ".join(bad)))
+                sys.exit(1)
+            stored = set([ self.digest(rec) for rec in self.store.records() ])
+            new = [ seq for seq in self.sequences if self.digest(seq) not in stored ]
+            if len(new) < len(self.sequences):
+                sys.stderr.write(INPUT + "{} sequence(s) already in store removed.\n".format(len(self.sequences) - len(new)))
+            self.sequences = new
+        self.renameDuplicates(set(self.store.names))
 
-    def generateMaps(self):
+    def renameDuplicates(self, used):
+        """Rename the sequences whose name is in `used' (or is the same as that of a previous
+sequence) by adding a suffix _2, _3, ..., since reads are identified by name in the maps."""
+        nrenamed = 0
         for seq in self.sequences:
-            seq.pattern = ""
+            if seq.name in used:
+                k = 2
+                while "{}_{}".format(seq.name, k) in used:
+                    k += 1
+                seq.name = seq.id = "{}_{}".format(seq.name, k)
+                self.maxnamelen = max(self.maxnamelen, len(seq.name))
+                nrenamed += 1
+            used.add(seq.name)
+        if nrenamed:
+            sys.stderr.write(WARNING + "{} sequence(s) renamed because their names were already in use.\n".format(nrenamed))
+
+    def demultiplex(self):
+        """Assign each input read to one of the sequences in the reference file, in a single
+pass over the input, then run a separate analysis for each reference."""
+        import Demux
+
+        with open(self.reffile, "r") as f:
+            refs = list(FastaIterator(f))
+        D = Demux.Demultiplexer(refs, tag=self.demuxTag)
+        sys.stderr.write(INPUT + "Demultiplexing reads against {} reference sequences.\n".format(len(refs)))
+        engines = []
+        for ref in refs:
+            E = MethylMapper()
+            E.parseArgs(self.batchArgs)
+            E.refseq = ref
+            E.prefix = self.prefix + ref.id + "-"
+            E.session = self.session
+            engines.append(E)
+
+        if self.filename:
+            sys.stderr.write(INPUT + "Reading sequences from file `{}'.\n".format(self.filename))
+            f = open(self.filename, "r")
+        else:
+            sys.stderr.write(INPUT + "Reading sequences from standard input.\n")
+            f = sys.stdin
+        with self.profiler.stage("demux") as st:
+            try:
+                for rec in FastaIterator(f):
+                    st.nreads += 1
+                    idx = D.assign(rec)
+                    if idx is not None:
+                        engines[idx].addSequence(rec)
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        D.report()
+
+        for E in engines:
+            if E.sequences:
+                sys.stderr.write(INPUT + "Processing reference {}.\n".format(E.refseq.id))
+                E.finishSequences()
+                with E.profiler.stage("setup", len(E.sequences)):
+                    E.setupMaps()
+                E.main()
+        self.profiler.report(self.prefix)
+        return engines
+
+    def generateMaps(self, store=None):
+        """Compute the maps for all sequences. If `store' is specified, the maps of the reads it
+contains are loaded from it, the current sequences are added to them, and the store is updated."""
+        for seq in self.sequences:
+            seq.pattern = 0
+        if self.mapwriter:
+            self.mapwriter.discard()
+        self.mapwriter = MethMap.MapWriter(self.maxnamelen, tmpdir=self.clust.tmpdir) if self.mapfile else None
+        for m in self.maps:
+            m.writer = self.mapwriter
+            if self.mapwriter:
+                self.mapwriter.addSection(m)
+        counts = None
+        if self.freqfile or store:
+            counts = MethMap.baseCounts(self.sequences, len(self.refseq))
+        if store and store.nreads():
+            sys.stderr.write(MAPS + "Adding {} new sequences to {} sequences from store.\n".format(len(self.sequences), store.nreads()))
+            for m in self.maps:
+                (mapstrs, values, scaled) = store.maps[m.site]
+                m.loadMaps(store.names, store.seqs, mapstrs, values, scaled)
+                m.addMaps(self.sequences)
+            self.sequences = store.records() + self.sequences
+            counts = store.counts + counts
+        else:
+            for m in self.maps:
+                m.makeAllMaps(self.sequences)
+        if store:
+            store.update(self.storeParams(), self.sequences, self.maps, counts)
         for m in self.maps:
-            m.makeAllMaps(self.sequences)
             if self.freqfile:
-                outfile = m.site + "-" + self.freqfile
+                outfile = self.prefix + m.site + "-" + self.freqfile
                 sys.stderr.write(MAPS + "Saving {} frequencies to {}.\n".format(m.site, outfile))
-                m.calcAllFrequencies(self.sequences, outfile)
+                m.calcAllFrequencies(self.sequences, outfile, counts=counts)
         # for seq in self.sequences:
         #     print seq.pattern
 
+    def writeGroupFrequencies(self):
+        """Write base frequencies separately for each group of reads found by cutting the clustering tree."""
+        groups = self.clust.groups
+        ngroups = max(groups.values())
+        seqs = [ seq for seq in self.sequences if seq.name in groups ]
+        counts = MethMap.baseCounts(seqs, len(self.refseq), groups=[ groups[seq.name] - 1 for seq in seqs ], ngroups=ngroups)
+        groupnames = [ str(g + 1) for g in range(ngroups) ]
+        for m in self.maps:
+            outfile = self.prefix + m.site + "-groups-" + self.freqfile
+            sys.stderr.write(OUTPUT + "Saving {} frequencies by group to {}.\n".format(m.site, outfile))
+            m.calcAllFrequencies(seqs, outfile, counts=counts, groupnames=groupnames)
+
     def removeDuplicates(self):
-        seen = {}
+        seen = set()
         unique = []
         norig = len(self.sequences)
         nuniq = 0
@@ -139,47 +347,103 @@ class MethylMapper():
             if seq.pattern in seen:
                 continue
             unique.append(seq)
-            seen[seq.pattern] = True
+            seen.add(seq.pattern)
             nuniq += 1
         sys.stderr.write(MAPS + "{} sequences with unique methylation patterns retained.\n".format(len(unique)))
         self.sequences = unique
-        if nuniq < norig:
+        if nuniq < norig and self.store:
+            # The store now contains all reads: keep the retained ones and reload their maps from it
+            sys.stderr.write(MAPS + "Reloading the maps of the retained sequences from the store.\n")
+            self.store.select([ seq.name for seq in unique ])
+            self.store.counts = MethMap.baseCounts(unique, len(self.refseq))
+            self.sequences = []
+            self.generateMaps(self.store)
+        elif nuniq < norig:
             sys.stderr.write(MAPS + "Recomputing all maps.\n")
             self.generateMaps()
 
+    def qualityControl(self):
+        """Compute the QC measures of all reads (see QC), write them to the QC table if requested,
+and remove the reads that do not pass the filters."""
+        import numpy as np
+        import QC
+
+        stats = QC.QCStats(self.sequences, self.references, self.sites, top=self.top, bottom=self.bottom)
+        failed = stats.applyFilters(self.minConversion, self.maxUnconvRun, self.maxNFraction)
+        conv = stats.conversion[~np.isnan(stats.conversion)]
+        if len(conv):
+            sys.stderr.write(MAPS + "Conversion rate at non-site Cs: mean {:.4f}, median {:.4f}, min {:.4f}.\n".format(
+                conv.mean(), np.median(conv), conv.min()))
+        if self.qcfile:
+            qcfile = self.prefix + self.qcfile
+            sys.stderr.write(OUTPUT + "Writing QC table for {} sequences to {}.\n".format(len(self.sequences), qcfile))
+            with open(qcfile, "w") as out:
+                stats.writeTable(out, self.sequences, self.sites)
+        for (filt, nbad) in failed:
+            sys.stderr.write(MAPS + "{} sequences with {}.\n".format(nbad, filt))
+        if failed:
+            self.sequences = [ seq for (seq, good) in zip(self.sequences, stats.passed) if good ]
+            sys.stderr.write(MAPS + "{} sequences passed QC filters.\n".format(len(self.sequences)))
+
     def removeConsecutive(self):
+        import QC
+
         tmpref = RefSequence.RefSequence(self.refseq, self.consecutive[0])
-        good = []
-        nbad = 0
-        for seq in self.sequences:
-            if tmpref.methylStretch(seq.seq, self.consecutive[1]):
-                good.append(seq)
-            else:
-                nbad += 1
+        (unconv, conv) = QC.strandCalls(QC.readMatrix(self.sequences, tmpref.length), tmpref.cpositionsTop, True)
+        bad = QC.longestRun(unconv) >= self.consecutive[1]
+        good = [ seq for (seq, b) in zip(self.sequences, bad) if not b ]
+        nbad = len(self.sequences) - len(good)
         sys.stderr.write(MAPS + "{} sequences with more than {} consecutive unmethylated positions removed, {} sequences left.\n".format(
             nbad, self.consecutive[1], len(good)))
         self.sequences = good
 
     ### Output
 
+    def writePatterns(self):
+        """Write the most frequent methylation patterns (epialleles) with their counts."""
+        import Patterns
+
+        patfile = self.prefix + self.patternfile
+        layout = [ (m.site, m.ref.nsites(self.top, self.bottom)) for m in self.maps ]
+        with open(patfile, "w") as out:
+            npatterns = Patterns.writeReport(out, self.sequences, layout, top=self.patternsTop)
+        sys.stderr.write(OUTPUT + "{} distinct methylation patterns in {} sequences, {} written to {}.\n".format(
+            npatterns, len(self.sequences), min(npatterns, self.patternsTop or npatterns), patfile))
+
+    def writeClusterSummary(self):
+        """Write the size, consensus calls, methylation fractions and patch occupancy of each cluster."""
+        import Consensus
+
+        outfile = self.prefix + self.summaryfile
+        with open(outfile, "w") as out:
+            nclusters = Consensus.writeSummary(out, self.maps, self.clust.groups, offset=self.offset)
+        sys.stderr.write(OUTPUT + "Summary of {} clusters written to {}.\n".format(nclusters, outfile))
+
+    def writeReadSummaries(self):
+        """Write the statistics of the map of each read (see MethMap.ReadStats), in NumPy .npz
+format if the file name ends in .npz, or as a tab-delimited table otherwise."""
+        for m in self.maps:
+            outfile = self.prefix + m.site + "-" + self.readsumfile
+            names = [ name for (name, fmap) in m.mapstrings ]
+            sys.stderr.write(OUTPUT + "Writing {} map statistics for {} sequences to {}.\n".format(m.site, len(names), outfile))
+            if outfile.endswith(".npz"):
+                m.readStats.save(outfile, names, offset=self.offset)
+            else:
+                with open(outfile, "w") as out:
+                    m.readStats.writeTable(out, names, offset=self.offset)
+
     def writeMapsText(self):
-        sys.stderr.write(OUTPUT + "Writing maps in text format to file {}\n".format(self.mapfile))
-        fstr = "{:" + str(self.maxnamelen) + "} |{}\n"
-        with open(self.mapfile, "w") as out:
-            for m in self.maps:
-                out.write("## " + m.site + "\n")
-                out.write(fstr.format("Reference", m.ref.sequence))
-                out.write(fstr.format("Sites", m.sitesToString()))
-                for row in m.mapstrings:
-                    name = row[0]
-                    seq = "".join(row[1])
-                    out.write(fstr.format(name, seq))
-                out.write("\n")
+        mapfile = self.prefix + self.mapfile
+        sys.stderr.write(OUTPUT + "Writing maps in text format to file {}\n".format(mapfile))
+        self.mapwriter.close(mapfile)
+        self.mapwriter = None
+        for m in self.maps:
+            m.writer = None
 
     def writeMapsCSV(self):
         sys.stderr.write(OUTPUT + "Writing maps in CSV format to files:\n")
         ncols = len(self.refseq)
-        hdr = makeColHeaders(ncols)
+        hdr = makeColHeaders(ncols, self.offset + 1)
         hdrline = "#Seq\t" + "\t".join(hdr) + "\n"
         for m in self.maps:
             m.writeCSV(self.csvfile, hdrline)
@@ -207,14 +471,18 @@ class MethylMapper():
 
         valuedArgs = ["-i", "--fasta", "-r", "--ref", "--reference", "-o", "--open", "-c", "--close", "-s", "--site", "--sites", "--map", "--csv",
                       "-f", "--freq", "-C", "--cluster-on", "-p", "--cluster-from", "-q", "--cluster-to", "-g", "--cluster-dist", "-m", "--cluster-meth",
-                      "--cluster-path", "--plot", "-x", "--strand", "-w", "--weights", "-d", "-n", "--unconv"]
+                      "--cluster-path", "-O", "--leaf-order", "--plot", "-x", "--strand", "-w", "--weights", "-d", "-n", "--unconv", "--max-height", "--prefix",
+                      "--batch", "-j", "--jobs", "--summary", "--demux-tag",
+                      "--profile-json", "--profile-dump", "--freq-groups", "--store", "--patterns", "--patterns-top", "--fill-cache", "--region", "--tmpdir", "--cluster-engine", "--cluster-procs", "--order",
+                      "--cut-height", "--cluster-summary", "--bootstrap", "--qc", "--min-conversion", "--max-unconv-run", "--max-n-fraction",
+                      "--read-summary"]
         next = ""
         for a in args:
             if next in ["-i", "--fasta"]:
                 self.filename = a
                 next = ""
             elif next in ["-r", "--ref", "--reference"]:
-                self.filename = a
+                self.reffile = a
                 next = ""
             elif next in ["-d"]:
                 self.sampleseqs = safeInt(a)
@@ -225,6 +493,33 @@ class MethylMapper():
             elif next in ["-c", "--close"]:
                 self.closeMin = safeInt(a)
                 next = ""
+            elif next == "--order":
+                parts = a.split(":")
+                if parts[0] in ["fraction", "first", "last", "pattern", "kmodes"]:
+                    self.clust.ordering = parts[0]
+                    if len(parts) > 1:
+                        self.clust.nmodes = safeInt(parts[1])
+                else:
+                    sys.stderr.write(WARNING + "Ordering should be one of fraction, first, last, pattern, kmodes[:K]. Argument ignored.\n")
+                next = ""
+            elif next == "--cluster-engine":
+                if a in ["cluster3", "internal"]:
+                    self.clust.engine = a
+                else:
+                    sys.stderr.write(WARNING + "Clustering engine should be one of cluster3, internal. Argument ignored.\n")
+                next = ""
+            elif next == "--cluster-procs":
+                self.clust.nprocs = safeInt(a)
+                next = ""
+            elif next == "--tmpdir":
+                self.clust.tmpdir = a
+                next = ""
+            elif next == "--region":
+                self.region = parseRegion(a)
+                next = ""
+            elif next == "--fill-cache":
+                self.cacheSize = safeInt(a)
+                next = ""
             elif next in ["-n", "--unconv"]:
                 self.consecutive = parseConsecutive(a)
                 next = ""
@@ -267,9 +562,78 @@ class MethylMapper():
             elif next == "--cluster-path":
                 self.clust.clusterPath = a
                 next = ""
+            elif next in ["-O", "--leaf-order"]:
+                if a in ["mean", "optimal"]:
+                    self.clust.leafOrder = a
+                elif a != "none":
+                    sys.stderr.write(WARNING + "Leaf order should be one of none, mean, optimal. Argument ignored.\n")
+                next = ""
             elif next == "--plot":
                 self.plotfile = a
                 next = ""
+            elif next == "--batch":
+                self.batchfile = a
+                next = ""
+            elif next in ["-j", "--jobs"]:
+                self.nprocs = safeInt(a)
+                next = ""
+            elif next == "--summary":
+                self.summary = a
+                next = ""
+            elif next == "--demux-tag":
+                self.demuxTag = a
+                self.demux = True
+                next = ""
+            elif next == "--freq-groups":
+                self.clust.ngroups = safeInt(a)
+                next = ""
+            elif next == "--cut-height":
+                self.clust.cutHeight = safeFloat(a)
+                next = ""
+            elif next == "--read-summary":
+                self.readsumfile = a
+                next = ""
+            elif next == "--qc":
+                self.qcfile = a
+                next = ""
+            elif next == "--min-conversion":
+                self.minConversion = safeFloat(a)
+                next = ""
+            elif next == "--max-unconv-run":
+                self.maxUnconvRun = safeInt(a)
+                next = ""
+            elif next == "--max-n-fraction":
+                self.maxNFraction = safeFloat(a)
+                next = ""
+            elif next == "--bootstrap":
+                self.clust.nboot = safeInt(a)
+                next = ""
+            elif next == "--cluster-summary":
+                self.summaryfile = a
+                next = ""
+            elif next == "--patterns":
+                self.patternfile = a
+                next = ""
+            elif next == "--patterns-top":
+                self.patternsTop = safeInt(a)
+                next = ""
+            elif next == "--store":
+                self.storefile = a
+                next = ""
+            elif next == "--prefix":
+                self.prefix = a
+                next = ""
+            elif next == "--profile-json":
+                self.profiler.jsonfile = a
+                self.profiler.enabled = True
+                next = ""
+            elif next == "--profile-dump":
+                self.profiler.dumpfile = a
+                self.profiler.enabled = True
+                next = ""
+            elif next == "--max-height":
+                self.maxheight = safeInt(a)
+                next = ""
             elif next in ["-x", "--strand"]:
                 if a == "t":
                     self.top = True
@@ -293,6 +657,16 @@ class MethylMapper():
                 self.remdups = 2
             elif a == '-z':
                 self.white = True
+            elif a == '--demux':
+                self.demux = True
+            elif a == '--attach':
+                self.attach = True
+            elif a == '--cluster-fifo':
+                self.clust.useFifo = True
+            elif a == '--bootstrap-reads':
+                self.clust.bootReads = True
+            elif a == '--profile':
+                self.profiler.enabled = True
             else:
                 sys.stderr.write(WARNING + "Unknown command-line option `{}'.\n".format(a))
 
@@ -311,8 +685,22 @@ class MethylMapper():
         if bad:
             sys.stderr.write(WARNING + "Unknown sites for clustering: {}.\n".format(", ".join(bad)))
         self.clust.clusterOn = good
+        self.batchArgs = self.removeOptions(args, ["--batch", "-j", "--jobs", "--summary", "--profile-dump"])
         return True
 
+    def removeOptions(self, args, options):
+        """Return a copy of `args' without the (single-valued) `options' and their values."""
+        result = []
+        skip = False
+        for a in args:
+            if skip:
+                skip = False
+            elif a in options:
+                skip = True
+            else:
+                result.append(a)
+        return result
+
     def parseWeights(self, w):
         good = False
         try:
@@ -327,17 +715,59 @@ class MethylMapper():
             return False
 
     def main(self):
+        P = self.profiler
+        if self.qcfile or self.minConversion is not None or self.maxUnconvRun is not None or self.maxNFraction is not None:
+            with P.stage("qc", len(self.sequences)):
+                self.qualityControl()
         if self.consecutive:
-            self.removeConsecutive()
-        self.generateMaps()
+            with P.stage("unconv", len(self.sequences)):
+                self.removeConsecutive()
+        with P.stage("maps", len(self.sequences)):
+            self.generateMaps(self.store)
+        if self.patternfile:
+            with P.stage("patterns", len(self.sequences)):
+                self.writePatterns()
         if self.remdups == 2:
-            self.removeDuplicates()
+            with P.stage("dedup", len(self.sequences)):
+                self.removeDuplicates()
+        if self.readsumfile:
+            with P.stage("readsum", len(self.sequences)):
+                self.writeReadSummaries()
         if self.mapfile:
-            self.writeMapsText()
+            with P.stage("mapfile", len(self.sequences)):
+                self.writeMapsText()
         if self.csvfile:
-            self.writeMapsCSV()
+            with P.stage("csv", len(self.sequences)):
+                self.writeMapsCSV()
         if self.clust.clusterOn:
-            self.clust.run(self.maps, plotfile=self.plotfile)
+            plotfile = (self.prefix + self.plotfile) if self.plotfile else None
+            with P.stage("cluster", len(self.sequences)):
+                if self.clust.ordering:
+                    self.clust.order(self.maps, plotfile=plotfile, maxheight=self.maxheight, session=self.session)
+                elif self.attach and self.store:
+                    self.clust.attach(self.maps, self.store.tree, self.store.gids, plotfile=plotfile, maxheight=self.maxheight, session=self.session)
+                else:
+                    self.clust.run(self.maps, plotfile=plotfile, maxheight=self.maxheight, session=self.session)
+            if self.freqfile and self.clust.groups:
+                with P.stage("groupfreq", len(self.sequences)):
+                    self.writeGroupFrequencies()
+            if self.clust.nboot > 0:
+                if self.clust.groups:
+                    with P.stage("bootstrap", len(self.sequences)):
+                        self.clust.bootstrap(self.maps)
+                else:
+                    sys.stderr.write(WARNING + "Bootstrap requires --freq-groups, --cut-height, or --order kmodes.\n")
+            if self.summaryfile:
+                if self.clust.groups:
+                    with P.stage("summary", len(self.sequences)):
+                        self.writeClusterSummary()
+                else:
+                    sys.stderr.write(WARNING + "Writing the cluster summary requires --freq-groups, --cut-height, or --order kmodes.\n")
+        if self.store:
+            with P.stage("store", len(self.sequences)):
+                self.store.setTree(self.clust.branches, self.clust.rownames)
+                self.store.save()
+        P.report(self.prefix)
 
 ### Main
 
@@ -345,5 +775,16 @@ if __name__ == "__main__":
     M = MethylMapper()
     if M.parseArgs(sys.argv[1:]):
         sys.stderr.write(BANNER)
-        M.initialize()
-        M.main()
+        M.profiler.startCProfile()
+        if M.batchfile:
+            import Batch
+            B = Batch.Batch(M.batchfile, M.batchArgs, nprocs=M.nprocs, summary=M.summary)
+            good = B.run()
+        elif M.demux:
+            M.demultiplex()
+        else:
+            M.initialize()
+            M.main()
+        M.profiler.stopCProfile()
+        if M.batchfile and not good:
+            sys.exit(1)
@@ -0,0 +1,51 @@
+## (c) 2017, Alberto Riva (ariva@ufl.edu)
+## DiBiG, ICBR Bioinformatics, University of Florida
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import MethMap
+
+def test_scale_patch_at_last_position():
+    fmap = "*#--#++*"
+    values = [2.0, -2.0, -1.0, -1.0, -2.0, 1.0, 1.0, 2.0]
+    scaled = MethMap.scaleMatrix([fmap], [values], dtype="float64")
+    assert scaled.tolist() == [[2.0, -2.0, -0.5, -0.5, -2.0, 0.5, 0.5, 2.0]]
+    fmap = "*#*++++"
+    scaled = MethMap.scaleMatrix([fmap], [[2.0, -2.0, 2.0, 1.0, 1.0, 1.0, 1.0]], dtype="float64")
+    assert scaled.tolist() == [[2.0, -2.0, 2.0, 0.25, 0.25, 0.25, 0.25]]
+
+def test_scale_adjacent_patches():
+    scaled = MethMap.scaleMatrix(["++---"], [[1.0, 1.0, -1.0, -1.0, -1.0]])
+    assert scaled.dtype == np.float32
+    assert np.allclose(scaled, [[0.5, 0.5, -1.0/3, -1.0/3, -1.0/3]])
+
+def test_read_summary_patches():
+    stats = MethMap.ReadStats()
+    stats.addMaps(["  *++*+*  #  #--#-#*+*",
+                   "#-#   *  *++++*#---#--"])
+    (result, patches) = stats.arrays()
+    assert patches.tolist() == [[0, 1, 2, 8], [0, -1, 13, 19], [0, 1, 19, 22],
+                                [1, -1, 0, 3], [1, 1, 9, 15], [1, -1, 15, 22]]
+    assert result["meth"].tolist() == [5, 3]
+    assert result["unmeth"].tolist() == [4, 4]
+    assert result["nplus"].tolist() == [2, 1]
+    assert result["pluslen"].tolist() == [9, 6]
+    assert result["maxplus"].tolist() == [6, 6]
+    assert result["nminus"].tolist() == [1, 2]
+    assert result["minuslen"].tolist() == [6, 10]
+    assert result["maxminus"].tolist() == [6, 7]
+
+def test_read_summary_adjacent_sites():
+    fmap = "  **  *  ##  *#"
+    for (openMin, expected) in [(2, [[0, 1, 2, 4], [0, -1, 9, 11]]),
+                                (1, [[0, 1, 2, 4], [0, 1, 6, 7], [0, -1, 9, 11], [0, 1, 13, 14], [0, -1, 14, 15]]),
+                                (3, [])]:
+        stats = MethMap.ReadStats(openMin=openMin)
+        stats.addMaps([fmap])
+        (result, patches) = stats.arrays()
+        assert patches.tolist() == expected